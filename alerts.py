@@ -0,0 +1,174 @@
+"""Push-based low-stock alerts.
+
+``products.below_reorder`` is a stored generated column (``stock <
+reorder_level``) with its own index, so MySQL keeps the low-stock set up to
+date on every stock write and listing or counting it never scans the table.
+
+Routes that move stock call ``record_crossings()`` inside their transaction.
+Only products that *cross* their reorder level produce an event
+(``stock.low`` or ``stock.restored``) in the outbox, and ``stream()`` tails
+the shared event log to push those events to browsers as server-sent events.
+``astream()`` is the same stream for the async app (``asgi.py``), where an
+open stream costs a coroutine rather than a worker thread.
+"""
+import asyncio
+import os
+import time
+from collections import namedtuple
+
+import db
+import events
+
+STREAM_POLL_SECONDS = 1.0
+STREAM_KEEPALIVE_SECONDS = 15
+# A Flask stream holds a worker thread for its whole life; browsers reconnect
+# automatically (resuming from Last-Event-ID) after this many seconds.
+STREAM_MAX_SECONDS = 300
+
+ALERT_TYPES = (events.STOCK_LOW, events.STOCK_RESTORED)
+
+LowStockItem = namedtuple("LowStockItem", "id name stock reorder_level price")
+
+SQL_LOW_STOCK = """
+    SELECT id, name, stock, reorder_level, price FROM products
+    WHERE below_reorder = 1
+    ORDER BY stock ASC
+"""
+SQL_LOW_STOCK_COUNT = "SELECT COUNT(*) FROM products WHERE below_reorder = 1"
+
+
+def low_stock_items(conn):
+    return db.query_all(conn, SQL_LOW_STOCK, row_type=LowStockItem)
+
+
+def low_stock_count(conn):
+    return db.query_one(conn, SQL_LOW_STOCK_COUNT)[0]
+
+
+SQL_CROSSING_PRODUCTS = "SELECT id, name, stock, reorder_level FROM products WHERE id IN ({ids})"
+
+
+def crossings(rows, changes=None, previous=None):
+    """Alert events for ``SQL_CROSSING_PRODUCTS`` rows read after the change."""
+    previous = previous or {}
+    changes = changes or {}
+    alerts = []
+    for product_id, name, stock, level in rows:
+        if product_id in previous:
+            stock_before, level_before = previous[product_id]
+        else:
+            stock_before, level_before = stock - changes[product_id], level
+        was_low = stock_before < level_before
+        is_low = stock < level
+        if was_low == is_low:
+            continue
+        alerts.append((events.STOCK_LOW if is_low else events.STOCK_RESTORED, product_id, {
+            "product_id": product_id,
+            "name": name,
+            "stock": stock,
+            "reorder_level": level,
+        }))
+    return alerts
+
+
+def record_crossings(conn, changes=None, previous=None):
+    """Queue alerts for products whose stock crossed their reorder level.
+
+    Call after the stock UPDATEs and before ``commit()``. Pass ``changes``
+    as ``{product_id: change_qty}`` for relative moves, or ``previous`` as
+    ``{product_id: (stock_before, reorder_level_before)}`` when the old
+    values are already known (e.g. a product edit).
+    """
+    ids = list(set(changes or {}) | set(previous or {}))
+    if not ids:
+        return []
+    cur = conn.cursor()
+    cur.execute(SQL_CROSSING_PRODUCTS.format(ids=db.in_clause(ids)), ids)
+    alerts = crossings(cur.fetchall(), changes, previous)
+    events.record_many(cur, alerts)
+    cur.close()
+    return alerts
+
+
+# -----------------------
+# SERVER-SENT EVENTS
+# -----------------------
+def _sse(event_type, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append("data: " + events.dumps(data))
+    return "\n".join(lines) + "\n\n"
+
+
+def parse_last_event_id(value):
+    """``"<offset>:<byte position>"`` -> byte position to resume from."""
+    try:
+        return int(value.split(":", 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def _start(snapshot, position, path):
+    if position is None:
+        position = os.path.getsize(path) if os.path.exists(path) else 0
+    return position, ["retry: 3000\n\n", _sse("snapshot", snapshot)]
+
+
+def _poll(path, position, last_sent):
+    """New alert frames past ``position``; returns ``(frames, position, last_sent)``."""
+    frames = []
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < position:
+        position = 0  # log was rotated
+    if size > position:
+        for event, next_position in events.read_log(position, path):
+            position = next_position
+            if event["type"] in ALERT_TYPES:
+                frames.append(_sse(event["type"], event["data"], f"{event['offset']}:{position}"))
+                last_sent = time.time()
+    if time.time() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+        frames.append(": keepalive\n\n")
+        last_sent = time.time()
+    return frames, position, last_sent
+
+
+def stream(snapshot, position=None, path=None, max_seconds=STREAM_MAX_SECONDS):
+    """Yield SSE frames: a ``snapshot`` then live low-stock alerts.
+
+    ``position`` is a byte offset into the event log (from Last-Event-ID);
+    without one, only events appended after the connection opened are sent.
+    Waiting is a ``stat()`` of the log file, not a database query.
+    """
+    path = path or events.log_path()
+    position, frames = _start(snapshot, position, path)
+    yield from frames
+    started = last_sent = time.time()
+    while time.time() - started < max_seconds:
+        frames, position, last_sent = _poll(path, position, last_sent)
+        yield from frames
+        time.sleep(STREAM_POLL_SECONDS)
+
+
+async def astream(snapshot, position, path, max_seconds=STREAM_MAX_SECONDS):
+    """``stream()`` as an async generator, sleeping on the event loop."""
+    position, frames = _start(snapshot, position, path)
+    for frame in frames:
+        yield frame
+    started = last_sent = time.time()
+    while time.time() - started < max_seconds:
+        frames, position, last_sent = _poll(path, position, last_sent)
+        for frame in frames:
+            yield frame
+        await asyncio.sleep(STREAM_POLL_SECONDS)
+
+
+def snapshot_payload(items):
+    return [{
+        "id": item.id,
+        "name": item.name,
+        "stock": item.stock,
+        "reorder_level": item.reorder_level,
+    } for item in items]
+
@@ -0,0 +1,265 @@
+"""Incremental Parquet export of sales and stock data for offline analysis.
+
+``export()`` copies rows added to ``bills_new``, ``bill_items``,
+``credit_notes`` (sales returns) and ``stock_movements`` since the last run
+into date-partitioned Parquet files::
+
+    instance/analytics/bills/date=2024-03-31/part-000001200.parquet
+
+Each table keeps a watermark (the last exported id) in ``_watermarks.json``.
+Rows are read in keyset-paginated chunks, so memory stays flat however much
+is pending. Only rows older than ``SETTLE_SECONDS`` are exported: ids are
+handed out before commit, and the lag makes sure a slow transaction with a
+lower id is never skipped by the watermark. Part files are named after the
+watermark their chunk started from and written atomically. A crash before
+the watermark is saved therefore overwrites the same files on the next run,
+even if more rows have settled by then and the chunk comes back larger.
+
+With a tenant directory (``tenants.py``) each tenant gets its own export
+directory, watermarks included, under ``instance/tenants/<slug>/analytics``::
+
+    python tenants.py run all analytics export
+
+The query helpers below (``daily_sales``, ``top_products``, ``stock_flow``)
+read only these files, so analysts can work without touching MySQL::
+
+    python analytics.py export
+    python analytics.py daily_sales 2024-03-01 2024-03-31
+"""
+import json
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import tenants
+from db import get_db_connection
+
+EXPORT_DIR = os.path.join("instance", "analytics")
+WATERMARKS = "_watermarks.json"
+CHUNK_ROWS = 50000
+SETTLE_SECONDS = 60
+
+# Exported tables: keyset query (``%s`` = last id, settle lag, chunk size),
+# output columns (the last one is the partition date) and money columns
+TABLES = {
+    "bills": {
+        "sql": """
+            SELECT id, bill_number, total, discount, subtotal, gst_total, payment_mode,
+                   created_by, bill_date, DATE(bill_date)
+            FROM bills_new
+            WHERE id > %s AND bill_date < NOW() - INTERVAL %s SECOND
+            ORDER BY id
+            LIMIT %s
+        """,
+        "columns": ["id", "bill_number", "total", "discount", "subtotal", "gst_total", "payment_mode",
+                    "created_by", "bill_date", "date"],
+        "money": ["total", "discount", "subtotal", "gst_total"],
+    },
+    "bill_items": {
+        "sql": """
+            SELECT i.id, i.bill_id, i.product_id, i.product_name, i.quantity, i.price, i.gst,
+                   i.item_total, b.bill_date, DATE(b.bill_date)
+            FROM bill_items i
+            JOIN bills_new b ON b.id = i.bill_id
+            WHERE i.id > %s AND b.bill_date < NOW() - INTERVAL %s SECOND
+            ORDER BY i.id
+            LIMIT %s
+        """,
+        "columns": ["id", "bill_id", "product_id", "product_name", "quantity", "price", "gst",
+                    "item_total", "bill_date", "date"],
+        "money": ["price", "gst", "item_total"],
+    },
+    "credit_notes": {
+        "sql": """
+            SELECT id, credit_note_number, bill_id, total, discount, subtotal, gst_total, refund_mode,
+                   created_by, created_at, DATE(created_at)
+            FROM credit_notes
+            WHERE id > %s AND created_at < NOW() - INTERVAL %s SECOND
+            ORDER BY id
+            LIMIT %s
+        """,
+        "columns": ["id", "credit_note_number", "bill_id", "total", "discount", "subtotal", "gst_total",
+                    "refund_mode", "created_by", "created_at", "date"],
+        "money": ["total", "discount", "subtotal", "gst_total"],
+    },
+    "stock_movements": {
+        "sql": """
+            SELECT id, product_id, change_qty, movement_type, reference_id, created_by,
+                   created_at, DATE(created_at)
+            FROM stock_movements
+            WHERE id > %s AND created_at < NOW() - INTERVAL %s SECOND
+            ORDER BY id
+            LIMIT %s
+        """,
+        "columns": ["id", "product_id", "change_qty", "movement_type", "reference_id", "created_by",
+                    "created_at", "date"],
+        "money": [],
+    },
+}
+
+
+# -----------------------
+# WATERMARKS
+# -----------------------
+def _export_dir(directory=None):
+    """``directory``, or the current tenant's export directory."""
+    return directory or tenants.scoped_path(EXPORT_DIR)
+
+
+def load_watermarks(directory=None):
+    path = os.path.join(_export_dir(directory), WATERMARKS)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_watermarks(watermarks, directory=None):
+    directory = _export_dir(directory)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, WATERMARKS)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(watermarks, f)
+    os.replace(path + ".tmp", path)
+
+
+# -----------------------
+# EXPORT
+# -----------------------
+def _frame(rows, spec):
+    df = pd.DataFrame.from_records(rows, columns=spec["columns"])
+    for column in spec["money"]:
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+    df["date"] = df["date"].astype(str)
+    return df
+
+
+def write_partitions(df, table, start_id, directory=None):
+    """Write one Parquet part per date in ``df``, the chunk read after ``start_id``; returns the paths."""
+    directory = _export_dir(directory)
+    paths = []
+    for day, part in df.groupby("date", sort=True):
+        folder = os.path.join(directory, table, f"date={day}")
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, f"part-{start_id:09d}.parquet")
+        arrow_table = pa.Table.from_pandas(part.drop(columns=["date"]), preserve_index=False)
+        pq.write_table(arrow_table, path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
+
+
+def export_table(conn, table, watermarks, directory=None, chunk_rows=CHUNK_ROWS):
+    """Export rows past the table's watermark; returns the row count."""
+    spec = TABLES[table]
+    cur = conn.cursor()
+    exported = 0
+    try:
+        while True:
+            last_id = watermarks.get(table, 0)
+            cur.execute(spec["sql"], (last_id, SETTLE_SECONDS, chunk_rows))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            write_partitions(_frame(rows, spec), table, last_id, directory)
+            watermarks[table] = rows[-1][0]
+            save_watermarks(watermarks, directory)
+            exported += len(rows)
+            if len(rows) < chunk_rows:
+                break
+    finally:
+        cur.close()
+    return exported
+
+
+def export(tables=None, directory=None):
+    """Export every table (or ``tables``); returns ``{table: rows exported}``."""
+    conn = get_db_connection()
+    if not conn:
+        print("Analytics export: database connection error")
+        return {}
+    watermarks = load_watermarks(directory)
+    counts = {}
+    try:
+        for table in tables or TABLES:
+            counts[table] = export_table(conn, table, watermarks, directory)
+    except Exception as e:
+        print(f"Analytics export failed: {e}")
+    finally:
+        conn.close()
+    return counts
+
+
+# -----------------------
+# QUERIES
+# -----------------------
+def read(table, start=None, end=None, columns=None, directory=None):
+    """Load a table's exported rows for ``start <= date <= end`` (ISO dates)."""
+    path = os.path.join(_export_dir(directory), table)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns or TABLES[table]["columns"])
+    filters = []
+    if start:
+        filters.append(("date", ">=", str(start)))
+    if end:
+        filters.append(("date", "<=", str(end)))
+    df = pd.read_parquet(path, columns=columns, filters=filters or None)
+    if "date" in df.columns:
+        df["date"] = df["date"].astype(str)
+    return df
+
+
+def daily_sales(start=None, end=None, directory=None):
+    """Bills, sales, discount and refunds (by day of return) per day."""
+    df = read("bills", start, end, ["date", "id", "total", "discount"], directory)
+    sales = (df.groupby("date")
+               .agg(bills=("id", "count"), total=("total", "sum"), discount=("discount", "sum")))
+    refunds = read("credit_notes", start, end, ["date", "total"], directory).groupby("date")["total"].sum()
+    sales = sales.join(refunds.rename("refunds"), how="outer").fillna({"bills": 0, "total": 0, "discount": 0, "refunds": 0})
+    sales["bills"] = sales["bills"].astype(int)
+    sales["net"] = sales["total"] - sales["refunds"]
+    return sales.reset_index()
+
+
+def top_products(start=None, end=None, limit=10, directory=None):
+    """Best sellers by quantity, with revenue (including GST)."""
+    df = read("bill_items", start, end, ["date", "product_id", "product_name", "quantity", "item_total"], directory)
+    return (df.groupby(["product_id", "product_name"], dropna=False)
+              .agg(quantity=("quantity", "sum"), revenue=("item_total", "sum"))
+              .sort_values("quantity", ascending=False)
+              .head(limit)
+              .reset_index())
+
+
+def stock_flow(start=None, end=None, directory=None):
+    """Net quantity moved per product and movement type."""
+    df = read("stock_movements", start, end, ["date", "product_id", "movement_type", "change_qty"], directory)
+    return (df.pivot_table(index="product_id", columns="movement_type", values="change_qty",
+                           aggfunc="sum", fill_value=0)
+              .reset_index())
+
+
+QUERIES = {
+    "daily_sales": daily_sales,
+    "top_products": top_products,
+    "stock_flow": stock_flow,
+}
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "export":
+        for table, count in export().items():
+            print(f"Analytics export: {table}: {count} rows")
+    elif command in QUERIES:
+        args = [date.fromisoformat(arg) for arg in sys.argv[2:4]]
+        print(QUERIES[command](*args).to_string(index=False))
+    else:
+        print(f"Usage: python analytics.py [export | {' | '.join(QUERIES)}] [start] [end]")
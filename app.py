@@ -1,12 +1,35 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, send_file
-import mysql.connector
+from flask import Flask, Response, g, render_template, request, redirect, url_for, jsonify, session, flash, stream_template, stream_with_context
 from mysql.connector import Error
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 from functools import wraps
-import pandas as pd
+import csv
+import io
 import os
+import uuid
+
+import alerts
+import artifacts
+import assets
+import cache
+import catalog
+import checkout
+import compression
+import db
+import events
+import forecast
+import grn
+import gst
+import passwords
+import periods
+import promotions
+import reconcile
+import returns
+import sessions
+import tenants
+import valuation
+from db import get_db_connection
 
 print("App is starting...")
 
@@ -20,31 +43,46 @@ def home():
 # File upload configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Create uploads directory if it doesn't exist
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+def create_app(config=None):
+    """Configure ``app`` from the environment and ``config``; returns it.
+
+    Routes are registered on the module-level ``app`` when this module is
+    imported; the factory applies settings and sets up the page cache and
+    session store that depend on them. It never touches MySQL - create or
+    migrate the schema once with ``python bootstrap.py``.
+    """
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+    # Page cache: "sqlite" shares entries and invalidations between gunicorn
+    # workers; "memory" is per process, for a single process only
+    app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'sqlite')
+    app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', os.path.join('instance', 'cache.sqlite3'))
+
+    # Login sessions live server-side; the cookie only holds a session id.
+    # "sqlite" shares sessions (and revocations) between workers; "memory"
+    # is per process, for a single process only
+    app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite')
+    app.config['SESSION_PATH'] = os.environ.get('SESSION_PATH', os.path.join('instance', 'sessions.sqlite3'))
+
+    # Hashed, precompressed copies of static/*.js and *.css
+    app.config['ASSET_DIR'] = os.environ.get('ASSET_DIR', os.path.join('instance', 'assets'))
+
+    app.config.update(config or {})
+    cache.init_app(app)
+    sessions.init_app(app)
+    tenants.init_app(app)
+    compression.init_app(app)
+    assets.init_app(app)
+
+    # Create uploads directory if it doesn't exist
+    if not os.path.exists(app.config['UPLOAD_FOLDER']):
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+    return app
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# -----------------------
-# DB CONNECTION
-# -----------------------
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(
-            host='localhost',
-            user='root',  # Change this to your MySQL username
-            password='',  # Change this to your MySQL password
-            database='supermarket_saas'
-        )
-        return conn
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
-
 # -----------------------
 # LOGIN REQUIRED DECORATORS
 # -----------------------
@@ -54,6 +92,11 @@ def login_required(f):
         if "user_id" not in session:
             flash("Please login first", "warning")
             return redirect(url_for("login"))
+        # Picks up role changes and deactivations made since login
+        if not sessions.current_user(session):
+            session.clear()
+            flash("Your account has been deactivated", "danger")
+            return redirect(url_for("login"))
         return f(*args, **kwargs)
     return decorated
 
@@ -70,17 +113,21 @@ def admin_required(f):
 # DATABASE INITIALIZATION
 # -----------------------
 def init_database():
-    conn = get_db_connection()
+    """Create or migrate the current database (the current tenant's, if any).
+
+    ``python bootstrap.py`` runs it for every tenant in parallel.
+    """
+    conn, database = db.get_server_connection()
     if not conn:
         print("Failed to connect to database")
-        return
+        return False
     
     cur = conn.cursor()
 
     # Create database if not exists
     try:
-        cur.execute("CREATE DATABASE IF NOT EXISTS supermarket_saas")
-        cur.execute("USE supermarket_saas")
+        cur.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+        cur.execute(f"USE `{database}`")
     except Error as e:
         print(f"Error creating database: {e}")
 
@@ -98,6 +145,7 @@ def init_database():
             FOREIGN KEY (store_id) REFERENCES stores (id)
         )
     """)
+    db.ensure_column(cur, "users", "active", "TINYINT NOT NULL DEFAULT 1")
 
     # Products table
     cur.execute("""
@@ -108,7 +156,8 @@ def init_database():
             gst DECIMAL(5, 2),
             stock INT,
             product_code VARCHAR(100) UNIQUE,
-            cost_price DECIMAL(10, 2) DEFAULT 0
+            cost_price DECIMAL(10, 2) DEFAULT 0,
+            reorder_level INT NOT NULL DEFAULT 10
         )
     """)
 
@@ -133,7 +182,9 @@ def init_database():
             discount DECIMAL(10, 2),
             payment_mode VARCHAR(50),
             bill_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by INT
+            created_by INT,
+            subtotal DECIMAL(10, 2),
+            gst_total DECIMAL(10, 2)
         )
     """)
 
@@ -146,10 +197,29 @@ def init_database():
             quantity INT,
             price DECIMAL(10, 2),
             gst DECIMAL(5, 2),
-            item_total DECIMAL(10, 2)
+            item_total DECIMAL(10, 2),
+            product_id INT NULL
         )
     """)
 
+    # Bill lines reference the product; product_name stays as the name at
+    # the time of sale. Older rows are back-filled by name in id ranges so
+    # the UPDATE never locks the whole table at once.
+    db.ensure_column(cur, "bill_items", "product_id", "INT NULL")
+    db.ensure_index(cur, "bill_items", "idx_bill_items_bill", "bill_id")
+    db.ensure_index(cur, "bill_items", "idx_bill_items_product", "product_id, bill_id")
+    cur.execute("SELECT MIN(id), MAX(id) FROM bill_items WHERE product_id IS NULL")
+    first_id, last_id = cur.fetchone()
+    if first_id is not None:
+        for start in range(first_id, last_id + 1, 10000):
+            cur.execute("""
+                UPDATE bill_items i
+                JOIN products p ON p.name = i.product_name
+                SET i.product_id = p.id
+                WHERE i.id BETWEEN %s AND %s AND i.product_id IS NULL
+            """, (start, start + 9999))
+            conn.commit()
+
     # Purchases table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS purchases (
@@ -165,6 +235,22 @@ def init_database():
         )
     """)
 
+    # Goods-received notes (one row per delivery, lines live in purchases)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS grns (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            supplier VARCHAR(255),
+            reference VARCHAR(100),
+            token VARCHAR(64) UNIQUE,
+            line_count INT,
+            created_by INT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    """)
+    db.ensure_column(cur, "purchases", "grn_id", "INT NULL")
+    db.ensure_index(cur, "purchases", "idx_purchases_grn", "grn_id")
+
     # Stock movements table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS stock_movements (
@@ -180,6 +266,119 @@ def init_database():
         )
     """)
 
+    # Outbox of sale/stock events, written in the same transaction as the
+    # change and delivered by events.dispatch_pending()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS outbox_events (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            event_type VARCHAR(50),
+            aggregate_id INT,
+            payload MEDIUMTEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            dispatched_at TIMESTAMP NULL DEFAULT NULL,
+            log_offset BIGINT NULL,
+            UNIQUE KEY uq_outbox_log_offset (log_offset),
+            KEY idx_outbox_pending (dispatched_at, id)
+        )
+    """)
+
+    # Reorder suggestions, refreshed by the forecast job (forecast.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reorder_suggestions (
+            product_id INT PRIMARY KEY,
+            supplier VARCHAR(255),
+            avg_7d DECIMAL(12, 3),
+            avg_28d DECIMAL(12, 3),
+            velocity DECIMAL(12, 3),
+            days_of_cover DECIMAL(10, 1),
+            suggested_qty INT,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_reorder_supplier (supplier, suggested_qty)
+        )
+    """)
+
+    # Weighted-average cost per product, the ledger of every valued move and
+    # per-day, per-store totals for reports (maintained by valuation.record())
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_valuation (
+            product_id INT PRIMARY KEY,
+            quantity INT NOT NULL DEFAULT 0,
+            avg_cost DECIMAL(12, 4) NOT NULL DEFAULT 0,
+            value DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            KEY idx_valuation_value (value)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS valuation_ledger (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            product_id INT NOT NULL,
+            store_id INT NOT NULL DEFAULT 0,
+            movement_type VARCHAR(50),
+            reference_id INT,
+            quantity INT,
+            unit_cost DECIMAL(12, 4),
+            value_change DECIMAL(14, 2),
+            qty_after INT,
+            avg_cost_after DECIMAL(12, 4),
+            created_by INT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_ledger_product (product_id, id),
+            KEY idx_ledger_store_date (store_id, created_at)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS valuation_daily (
+            day DATE NOT NULL,
+            store_id INT NOT NULL DEFAULT 0,
+            purchase_value DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            sales_revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            cogs DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            writeoff_value DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, store_id)
+        )
+    """)
+
+    # Period-end close (periods.py): immutable per-day/per-month totals and
+    # closing stock, plus the list of closed periods
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS closed_periods (
+            period_type VARCHAR(5) NOT NULL,
+            period_start DATE NOT NULL,
+            closed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (period_type, period_start)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS period_summaries (
+            period_type VARCHAR(5) NOT NULL,
+            period_start DATE NOT NULL,
+            store_id INT NOT NULL DEFAULT 0,
+            bill_count INT NOT NULL DEFAULT 0,
+            sales_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            discount_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            sales_revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            purchase_value DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            cogs DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            writeoff_value DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (period_type, period_start, store_id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_snapshots (
+            period_type VARCHAR(5) NOT NULL,
+            period_start DATE NOT NULL,
+            product_id INT NOT NULL,
+            closing_stock INT NOT NULL,
+            avg_cost DECIMAL(12, 4) NOT NULL,
+            closing_value DECIMAL(14, 2) NOT NULL,
+            PRIMARY KEY (period_type, period_start, product_id),
+            KEY idx_snapshots_product (product_id, period_type, period_start)
+        )
+    """)
+    db.ensure_index(cur, "valuation_ledger", "idx_ledger_date", "created_at")
+    db.ensure_index(cur, "stock_movements", "idx_movements_product_date", "product_id, created_at")
+
     # Activity logs table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS activity_logs (
@@ -192,6 +391,164 @@ def init_database():
         )
     """)
 
+    # Subtotal and GST stored at checkout (older databases get the columns
+    # added and back-filled from bill_items once)
+    db.ensure_column(cur, "bills_new", "subtotal", "DECIMAL(10, 2)")
+    db.ensure_column(cur, "bills_new", "gst_total", "DECIMAL(10, 2)")
+    cur.execute("""
+        UPDATE bills_new b
+        JOIN (
+            SELECT bill_id, SUM(price * quantity) AS subtotal,
+                   SUM(price * quantity * gst / 100) AS gst_total
+            FROM bill_items
+            GROUP BY bill_id
+        ) t ON t.bill_id = b.id
+        SET b.subtotal = t.subtotal, b.gst_total = t.gst_total
+        WHERE b.subtotal IS NULL
+    """)
+    db.ensure_index(cur, "bills_new", "idx_bills_date", "bill_date")
+
+    # Per-product reorder level; MySQL maintains below_reorder on every stock
+    # write so the low-stock set is an index lookup, not a table scan
+    db.ensure_column(cur, "products", "reorder_level", "INT NOT NULL DEFAULT 10")
+    db.ensure_column(cur, "products", "below_reorder", "TINYINT AS (stock < reorder_level) STORED")
+    db.ensure_index(cur, "products", "idx_products_below_reorder", "below_reorder, stock")
+
+    # Forecast scans: SALE movements by date, latest purchase per product
+    db.ensure_index(cur, "stock_movements", "idx_movements_type_date", "movement_type, created_at")
+    db.ensure_index(cur, "purchases", "idx_purchases_product", "product_id, id")
+
+    # Indexes for paginated inventory filters and sorts
+    db.ensure_index(cur, "products", "idx_products_stock", "stock")
+    db.ensure_index(cur, "products", "idx_products_gst_name", "gst, name")
+    db.ensure_index(cur, "products", "idx_products_price", "price")
+
+    # Catalog delta sync (catalog.py): MySQL stamps every insert and update,
+    # and deleted products leave a tombstone
+    db.ensure_column(cur, "products", "row_version",
+                     "TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)")
+    db.ensure_index(cur, "products", "idx_products_row_version", "row_version")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_deletions (
+            product_id INT PRIMARY KEY,
+            deleted_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            INDEX idx_catalog_deletions_at (deleted_at)
+        )
+    """)
+
+    # Promotions (promotions.py): rules, product categories for category
+    # offers, and the promotion and discount applied to each bill line
+    db.ensure_column(cur, "products", "category", "VARCHAR(100) NULL")
+    db.ensure_index(cur, "products", "idx_products_category", "category")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS promotions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            kind ENUM('bogo', 'slab', 'percent') NOT NULL,
+            product_id INT NULL,
+            category VARCHAR(100) NULL,
+            buy_qty INT NOT NULL DEFAULT 0,
+            free_qty INT NOT NULL DEFAULT 0,
+            min_qty INT NOT NULL DEFAULT 1,
+            percent DECIMAL(5, 2) NOT NULL DEFAULT 0,
+            starts_at DATETIME NULL,
+            ends_at DATETIME NULL,
+            daily_from TIME NULL,
+            daily_to TIME NULL,
+            active TINYINT NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_promotions_active (active, ends_at),
+            FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+        )
+    """)
+    db.ensure_column(cur, "bill_items", "discount", "DECIMAL(10, 2) NOT NULL DEFAULT 0")
+    db.ensure_column(cur, "bill_items", "promotion_id", "INT NULL")
+
+    # Sales returns (returns.py): credit notes and their lines, and how much
+    # of each bill line has been returned
+    db.ensure_column(cur, "bill_items", "returned_qty", "INT NOT NULL DEFAULT 0")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS credit_notes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            credit_note_number VARCHAR(50) NOT NULL,
+            bill_id INT NOT NULL,
+            reason VARCHAR(255),
+            refund_mode VARCHAR(50),
+            subtotal DECIMAL(10, 2) NOT NULL,
+            gst_total DECIMAL(10, 2) NOT NULL,
+            discount DECIMAL(10, 2) NOT NULL DEFAULT 0,
+            total DECIMAL(10, 2) NOT NULL,
+            created_by INT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_credit_notes_bill (bill_id),
+            INDEX idx_credit_notes_date (created_at),
+            FOREIGN KEY (bill_id) REFERENCES bills_new (id),
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS credit_note_items (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            credit_note_id INT NOT NULL,
+            bill_item_id INT NOT NULL,
+            product_id INT,
+            quantity INT NOT NULL,
+            price DECIMAL(10, 2) NOT NULL,
+            gst DECIMAL(5, 2) NOT NULL,
+            discount DECIMAL(10, 2) NOT NULL DEFAULT 0,
+            gst_amount DECIMAL(10, 2) NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            INDEX idx_credit_items_note (credit_note_id),
+            INDEX idx_credit_items_bill_item (bill_item_id),
+            FOREIGN KEY (credit_note_id) REFERENCES credit_notes (id)
+        )
+    """)
+
+    # GST per rate per bill and credit note (gst.py), clustered by date so a
+    # filing period is one range of the primary key
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS gst_entries (
+            id BIGINT AUTO_INCREMENT,
+            entry_date DATETIME NOT NULL,
+            bill_id INT NOT NULL,
+            credit_note_id INT NULL,
+            gst_rate DECIMAL(5, 2) NOT NULL,
+            taxable_value DECIMAL(12, 2) NOT NULL,
+            tax_amount DECIMAL(12, 2) NOT NULL,
+            store_id INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (entry_date, id),
+            KEY idx_gst_entries_id (id),
+            KEY idx_gst_entries_bill (bill_id)
+        )
+    """)
+
+    # Stock reconciliation (reconcile.py): per-product ledger sums folded up
+    # to a checkpoint, and the last run's mismatches
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS job_checkpoints (
+            job VARCHAR(64) PRIMARY KEY,
+            last_id BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_ledger_totals (
+            product_id INT PRIMARY KEY,
+            ledger_qty BIGINT NOT NULL DEFAULT 0,
+            movement_count BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_mismatches (
+            product_id INT PRIMARY KEY,
+            stock INT NOT NULL,
+            ledger_qty BIGINT NOT NULL,
+            difference BIGINT NOT NULL,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            repaired TINYINT NOT NULL DEFAULT 0
+        )
+    """)
+
     # Default admin
     cur.execute("SELECT * FROM users WHERE username='admin'")
     if not cur.fetchone():
@@ -220,27 +577,42 @@ def init_database():
             )
         print("✓ Sample products created for demo")
 
+    # Value stock for products that have no valuation yet
+    valuation.seed(cur)
+    gst.seed(cur)
+
     conn.commit()
     conn.close()
     print("✓ Database initialized!")
+    return True
 
 # -----------------------
 # ACTIVITY LOGGING
 # -----------------------
-def log_activity(user_id, action, details=""):
+def log_activity(user_id, action, details="", conn=None):
+    """Write an activity log row.
+
+    Routes that still hold their connection pass it as ``conn`` (after their
+    own commit), so a request never waits on the pool for a second one.
+    """
+    own_conn = conn is None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return
+        if own_conn:
+            conn = get_db_connection()
+            if not conn:
+                return
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)",
             (user_id, action, details)
         )
         conn.commit()
-        conn.close()
+        cur.close()
     except Exception as e:
         print(f"Error logging activity: {e}")
+    finally:
+        if own_conn and conn:
+            conn.close()
 
 # -----------------------
 # LOGIN / LOGOUT
@@ -255,6 +627,18 @@ def login():
             flash("Please enter both username and password", "danger")
             return render_template("login.html")
 
+        # Set by tenants.init_app from the host name or the company field
+        if tenants.enabled() and g.tenant is None:
+            flash("Unknown company", "danger")
+            return render_template("login.html")
+
+        address = request.remote_addr or ""
+        login_key = tenants.scope(username)
+        wait = passwords.login_blocked(login_key, address)
+        if wait:
+            flash(f"Too many failed logins. Try again in {wait // 60 + 1} minutes.", "danger")
+            return render_template("login.html"), 429
+
         conn = get_db_connection()
         if not conn:
             flash("Database connection error", "danger")
@@ -265,10 +649,25 @@ def login():
         user = cur.fetchone()
         conn.close()
 
-        if user and check_password_hash(user["password"], password):
+        try:
+            valid = user is not None and passwords.check(user["password"], password)
+        except passwords.Busy as e:
+            flash(str(e), "warning")
+            return render_template("login.html"), 503
+
+        if valid:
+            passwords.login_succeeded(login_key)
+            if not user["active"]:
+                flash("This account has been deactivated", "danger")
+                return render_template("login.html")
+            session.clear()
+            sessions.rotate(session)
             session["user_id"] = user["id"]
             session["username"] = user["username"]
             session["role"] = user["role"]
+            session["store_id"] = user["store_id"]
+            if g.tenant:
+                session["tenant"] = g.tenant.slug
             log_activity(user["id"], "Login", f"User {username} logged in")
             flash(f"Welcome back, {username}!", "success")
             
@@ -276,6 +675,7 @@ def login():
                 return redirect(url_for("admin_dashboard"))
             return redirect(url_for("user_dashboard"))
 
+        passwords.login_failed(login_key, address)
         flash("Invalid username or password", "danger")
 
     return render_template("login.html")
@@ -296,6 +696,7 @@ def logout():
 @app.route("/admin")
 @login_required
 @admin_required
+@cache.cached_view(ttl=30, depends=("products", "bills", "stores"), per_user=True)
 def admin_dashboard():
     conn = get_db_connection()
     if not conn:
@@ -328,6 +729,7 @@ def admin_dashboard():
 
 @app.route("/user")
 @login_required
+@cache.cached_view(ttl=30, depends=("products", "bills"), per_user=True)
 def user_dashboard():
     conn = get_db_connection()
     if not conn:
@@ -345,8 +747,7 @@ def user_dashboard():
     cur.execute("SELECT COALESCE(SUM(total), 0) FROM bills_new WHERE created_by = %s", (session["user_id"],))
     user_sales = cur.fetchone()[0] or 0
 
-    cur.execute("SELECT COUNT(*) FROM products WHERE stock < 10")
-    low_stock_items = cur.fetchone()[0] or 0
+    low_stock_items = alerts.low_stock_count(conn)
 
     conn.close()
 
@@ -369,19 +770,100 @@ def dashboard():
 # -----------------------
 # PRODUCTS
 # -----------------------
+# Stock set by hand (new products, edits, Add Stock) is written to the ledger
+# too, so stock_movements keeps summing to products.stock (see reconcile.py)
+SQL_INSERT_MANUAL_MOVEMENT = """
+    INSERT INTO stock_movements (product_id, change_qty, movement_type, created_by)
+    VALUES (%s, %s, %s, %s)
+"""
+
+def inventory_filters(args):
+    """Normalise inventory query-string filters shared by the page and the API."""
+    per_page = args.get("per_page", 50, type=int)
+    if per_page not in db.INVENTORY_PAGE_SIZES:
+        per_page = 50
+    sort = args.get("sort", "name")
+    if sort not in db.INVENTORY_SORTS:
+        sort = "name"
+    return {
+        "search": args.get("q", "").strip(),
+        "min_stock": args.get("min_stock", None, type=int),
+        "max_stock": args.get("max_stock", None, type=int),
+        "gst": args.get("gst", None, type=float),
+        "sort": sort,
+        "direction": "desc" if args.get("dir") == "desc" else "asc",
+        "page": max(args.get("page", 1, type=int), 1),
+        "per_page": per_page,
+    }
+
 @app.route("/inventory")
 @login_required
 def inventory():
+    filters = inventory_filters(request.args)
+
     conn = get_db_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("dashboard"))
     
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM products ORDER BY name")
-    products = cur.fetchall()
+    products, total = db.search_products(conn, **filters)
+    slabs = db.gst_slabs(conn)
     conn.close()
-    return render_template("inventory.html", products=products)
+
+    pages = max((total + filters["per_page"] - 1) // filters["per_page"], 1)
+    return render_template("inventory.html", products=products, total=total, pages=pages,
+                           filters=filters, gst_slabs=slabs, page_sizes=db.INVENTORY_PAGE_SIZES)
+
+def inventory_return_url():
+    """Inventory page the user came from (keeps page, sort and filters)."""
+    next_url = request.args.get("next", "")
+    if next_url.startswith("/inventory"):
+        return next_url
+    return url_for("inventory")
+
+@app.route("/api/inventory")
+@login_required
+def api_inventory():
+    filters = inventory_filters(request.args)
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database connection error"}), 500
+
+    products, total = db.search_products(conn, **filters)
+    conn.close()
+
+    return jsonify({
+        "page": filters["page"],
+        "per_page": filters["per_page"],
+        "total": total,
+        "products": [{
+            "id": p.id,
+            "name": p.name,
+            "product_code": p.product_code,
+            "price": float(p.price),
+            "gst": float(p.gst),
+            "stock": p.stock,
+            "cost_price": float(p.cost_price or 0)
+        } for p in products]
+    })
+
+@app.route("/api/catalog/changes")
+@login_required
+def api_catalog_changes():
+    """Products changed or deleted since ``?since=<version>`` (0 = everything)."""
+    since = request.args.get("since", 0, type=int)
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database connection error"}), 500
+    try:
+        delta = catalog.changes(conn, since)
+    finally:
+        conn.close()
+    response = jsonify(delta)
+    response.cache_control.no_store = True
+    return response
 
 @app.route("/add_product", methods=["GET", "POST"])
 @login_required
@@ -391,7 +873,10 @@ def add_product():
         price = request.form.get("price", "")
         gst = request.form.get("gst", "")
         stock = request.form.get("stock", "")
+        cost_price = request.form.get("cost_price", "") or 0
+        reorder_level = request.form.get("reorder_level", "") or 10
         product_code = request.form.get("product_code", "").strip().upper()
+        category = request.form.get("category", "").strip() or None
 
         if not name or not product_code:
             flash("Product name and product code are required", "danger")
@@ -401,8 +886,10 @@ def add_product():
             price = float(price)
             gst = float(gst)
             stock = int(stock)
+            cost_price = float(cost_price)
+            reorder_level = int(reorder_level)
         except ValueError:
-            flash("Invalid price, GST, or stock value", "danger")
+            flash("Invalid price, GST, stock, cost price or reorder level value", "danger")
             return render_template("add_product.html")
 
         conn = get_db_connection()
@@ -412,10 +899,18 @@ def add_product():
         
         cur = conn.cursor()
         try:
-            cur.execute("INSERT INTO products (name, price, gst, stock, product_code) VALUES (%s, %s, %s, %s, %s)",
-                        (name, price, gst, stock, product_code))
+            cur.execute("INSERT INTO products (name, price, gst, stock, product_code, reorder_level, category, cost_price) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                        (name, price, gst, stock, product_code, reorder_level, category, cost_price))
+            product_id = cur.lastrowid
+            if stock:
+                cur.execute(SQL_INSERT_MANUAL_MOVEMENT, (product_id, stock, "OPENING", session["user_id"]))
+                # Opening stock enters the valuation at its cost price
+                valuation.record(conn, [valuation.Move(product_id, stock, movement_type="OPENING")],
+                                 session["user_id"], session.get("store_id"))
             conn.commit()
-            log_activity(session["user_id"], "Add Product", f"Added product '{name}' with code '{product_code}'")
+            # A category can bring the product under a category promotion
+            cache.invalidate("products", "promotions", "valuation")
+            log_activity(session["user_id"], "Add Product", f"Added product '{name}' with code '{product_code}'", conn)
             flash(f"Product '{name}' added successfully!", "success")
             return redirect(url_for("inventory"))
         except Error as e:
@@ -456,6 +951,10 @@ def bulk_import():
             file.save(filepath)
             
             try:
+                # pandas (and openpyxl behind it) is only loaded by the
+                # spreadsheet routes, keeping it out of every worker's startup
+                import pandas as pd
+
                 # Read Excel file
                 df = pd.read_excel(filepath)
                 
@@ -479,6 +978,7 @@ def bulk_import():
                 cur = conn.cursor()
                 imported_count = 0
                 errors = []
+                opening = []
                 
                 for index, row in df.iterrows():
                     try:
@@ -486,6 +986,9 @@ def bulk_import():
                         price = float(row['price'])
                         gst = float(row['gst'])
                         stock = int(row['stock'])
+                        cost_price = 0.0
+                        if 'cost_price' in df.columns and pd.notna(row.get('cost_price')):
+                            cost_price = float(row['cost_price'])
                         
                         # Handle optional product_code
                         product_code = None
@@ -496,17 +999,20 @@ def bulk_import():
                             errors.append(f"Row {index+2}: Product name cannot be empty")
                             continue
                         
-                        if price < 0 or gst < 0 or stock < 0:
-                            errors.append(f"Row {index+2}: Price, GST, and stock must be non-negative")
+                        if price < 0 or gst < 0 or stock < 0 or cost_price < 0:
+                            errors.append(f"Row {index+2}: Price, GST, stock and cost price must be non-negative")
                             continue
                         
                         # Insert with or without product_code
                         if product_code:
-                            cur.execute("INSERT INTO products (name, price, gst, stock, product_code) VALUES (%s, %s, %s, %s, %s)",
-                                        (name, price, gst, stock, product_code))
+                            cur.execute("INSERT INTO products (name, price, gst, stock, product_code, cost_price) VALUES (%s, %s, %s, %s, %s, %s)",
+                                        (name, price, gst, stock, product_code, cost_price))
                         else:
-                            cur.execute("INSERT INTO products (name, price, gst, stock) VALUES (%s, %s, %s, %s)",
-                                        (name, price, gst, stock))
+                            cur.execute("INSERT INTO products (name, price, gst, stock, cost_price) VALUES (%s, %s, %s, %s, %s)",
+                                        (name, price, gst, stock, cost_price))
+                        if stock:
+                            cur.execute(SQL_INSERT_MANUAL_MOVEMENT, (cur.lastrowid, stock, "OPENING", session["user_id"]))
+                            opening.append(valuation.Move(cur.lastrowid, stock, movement_type="OPENING"))
                         imported_count += 1
                         
                     except (ValueError, TypeError) as e:
@@ -522,8 +1028,11 @@ def bulk_import():
                         else:
                             errors.append(f"Row {index+2}: Database error - {str(e)}")
                 
+                # Opening stock of every imported product, valued at its cost price
+                valuation.record(conn, opening, session["user_id"], session.get("store_id"))
                 conn.commit()
                 conn.close()
+                cache.invalidate("products", "valuation")
                 
                 # Log the bulk import
                 log_activity(session["user_id"], "Bulk Import", f"Imported {imported_count} products from Excel file")
@@ -549,33 +1058,49 @@ def bulk_import():
 @app.route("/download_template")
 @login_required
 def download_template():
-    # Create a sample Excel template
-    import io
-    
-    # Create sample data with all columns including product_code
-    sample_data = {
-        'name': ['Rice 1kg', 'Milk 500ml', 'Sugar 1kg', 'Oil 1L'],
-        'price': [60.0, 25.0, 45.0, 120.0],
-        'gst': [5.0, 5.0, 5.0, 5.0],
-        'stock': [100, 50, 75, 30],
-        'product_code': ['RICE100', 'MILK500', 'SUGAR100', 'OIL100']
-    }
-    
-    df = pd.DataFrame(sample_data)
-    
-    # Create Excel file in memory
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Products', index=False)
-    
-    output.seek(0)
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name='product_template.xlsx'
-    )
+    # Pre-built sample (name, price, gst, stock, product_code); served with
+    # ETag/Last-Modified so repeat downloads are a 304
+    return artifacts.send(os.path.join(app.static_folder, "product_template.xlsx"), "product_template.xlsx")
+
+@app.route("/export_products")
+@login_required
+def export_products():
+    """Current catalog as CSV (default) or ``?format=xlsx``."""
+    fmt = "xlsx" if request.args.get("format") == "xlsx" else "csv"
+    try:
+        path = artifacts.build(f"catalog-{fmt}", fmt, lambda: _catalog_export(fmt), depends=("products", "stock"))
+    except Exception as e:
+        print(f"Error exporting catalog: {e}")
+        flash("Could not export products", "danger")
+        return redirect(url_for("inventory"))
+    return artifacts.send(path, f"products.{fmt}")
+
+CATALOG_EXPORT_COLUMNS = ["id", "product_code", "name", "price", "gst", "stock", "cost_price", "reorder_level"]
+
+def _catalog_export(fmt):
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database connection error")
+    try:
+        rows = list(db.iter_rows(conn, f"SELECT {', '.join(CATALOG_EXPORT_COLUMNS)} FROM products ORDER BY id"))
+    finally:
+        conn.close()
+    if fmt == "xlsx":
+        import pandas as pd
+        output = io.BytesIO()
+        with pd.ExcelWriter(output, engine="openpyxl") as writer:
+            pd.DataFrame.from_records(rows, columns=CATALOG_EXPORT_COLUMNS).to_excel(
+                writer, sheet_name="Products", index=False)
+        return output.getvalue()
+    return _csv_bytes(CATALOG_EXPORT_COLUMNS, rows)
+
+def _csv_bytes(header, rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    writer.writerows(rows)
+    # BOM so Excel opens the file as UTF-8 (product names, ₹)
+    return output.getvalue().encode("utf-8-sig")
 
 # -----------------------
 # PURCHASE ENTRY MODULE
@@ -646,8 +1171,31 @@ def add_purchase():
                 VALUES (%s, %s, 'PURCHASE', %s, %s)
             """, (product_id, quantity, purchase_id, session["user_id"]))
 
+            events.record_many(cur, [
+                (events.PURCHASE_CREATED, purchase_id, {
+                    "purchase_id": purchase_id,
+                    "product_id": int(product_id),
+                    "quantity": quantity,
+                    "cost_price": cost_price,
+                    "supplier": supplier,
+                    "created_by": session["user_id"],
+                }),
+                (events.STOCK_CHANGED, int(product_id), {
+                    "product_id": int(product_id),
+                    "change_qty": quantity,
+                    "movement_type": "PURCHASE",
+                    "reference_id": purchase_id,
+                }),
+            ])
+            alerts.record_crossings(conn, changes={int(product_id): quantity})
+            valuation.record(conn, [
+                valuation.Move(int(product_id), quantity, cost_price, "PURCHASE", purchase_id),
+            ], session["user_id"], session.get("store_id"))
+
             conn.commit()
-            log_activity(session["user_id"], "Add Purchase", f"Added purchase for product ID {product_id}, quantity {quantity}")
+            cache.invalidate("purchases", "products", "stock", "valuation")
+            events.dispatch_pending(conn)
+            log_activity(session["user_id"], "Add Purchase", f"Added purchase for product ID {product_id}, quantity {quantity}", conn)
             flash("Purchase added successfully!", "success")
             return redirect(url_for("inventory"))
 
@@ -666,9 +1214,120 @@ def add_purchase():
     cur = conn.cursor(dictionary=True)
     cur.execute("SELECT id, name FROM products ORDER BY name")
     products = cur.fetchall()
+
+    # Pre-fill from /reorder_suggestions links or the latest forecast
+    prefill = {
+        "product_id": request.args.get("product_id", type=int),
+        "quantity": request.args.get("quantity", type=int),
+        "supplier": request.args.get("supplier", ""),
+    }
+    if prefill["product_id"] and not prefill["quantity"]:
+        suggestion = forecast.suggestion_for(conn, prefill["product_id"])
+        if suggestion:
+            prefill["quantity"] = suggestion.suggested_qty or None
+            prefill["supplier"] = prefill["supplier"] or suggestion.supplier
     conn.close()
 
-    return render_template("add_purchase.html", products=products)
+    return render_template("add_purchase.html", products=products, prefill=prefill)
+
+# -----------------------
+# GOODS RECEIVED NOTES
+# -----------------------
+def save_grn(raw_lines, supplier, reference, token):
+    """Resolve and write a GRN; returns ``(grn_id, line_count)``.
+
+    Raises ``grn.GrnError`` for bad input and ``mysql.connector.Error`` for
+    database failures (including a re-submitted token).
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise grn.GrnError(["Database connection error"])
+    try:
+        lines = grn.resolve(conn, raw_lines, supplier)
+        grn_id, _ = grn.receive(conn, lines, session["user_id"], supplier, reference, token, session.get("store_id"))
+        conn.commit()
+        cache.invalidate("purchases", "products", "stock", "valuation")
+        events.dispatch_pending(conn)
+        return grn_id, len(lines)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@app.route("/add_grn", methods=["GET", "POST"])
+@login_required
+@admin_required
+def add_grn():
+    if request.method == "POST":
+        supplier = request.form.get("supplier", "").strip()
+        reference = request.form.get("reference", "").strip()
+        token = request.form.get("grn_token") or None
+
+        try:
+            upload = request.files.get("file")
+            if upload and upload.filename:
+                if not allowed_file(upload.filename):
+                    raise grn.GrnError(["Invalid file type. Please upload an Excel file (.xlsx or .xls)"])
+                raw_lines = grn.parse_excel(upload)
+            else:
+                raw_lines = grn.parse_form(request.form)
+            grn_id, line_count = save_grn(raw_lines, supplier, reference, token)
+            flash(f"GRN #{grn_id} saved: {line_count} lines received", "success")
+            return redirect(url_for("inventory"))
+        except grn.GrnError as e:
+            flash(f"GRN not saved ({len(e.errors)} errors):<br>" + "<br>".join(e.errors[:10]), "danger")
+        except Error as e:
+            if "Duplicate entry" in str(e) and "token" in str(e):
+                flash("This GRN was already saved", "warning")
+                return redirect(url_for("inventory"))
+            flash(f"Error saving GRN: {str(e)}", "danger")
+        except Exception as e:
+            flash(f"Error processing GRN: {str(e)}", "danger")
+
+    conn = get_db_connection()
+    if not conn:
+        flash("Database connection error", "danger")
+        return redirect(url_for("dashboard"))
+
+    cur = conn.cursor(dictionary=True)
+    cur.execute("SELECT id, name, product_code, cost_price FROM products ORDER BY name")
+    products = cur.fetchall()
+    conn.close()
+
+    return render_template("add_grn.html", products=products, grn_token=uuid.uuid4().hex,
+                           max_lines=grn.MAX_LINES)
+
+@app.route("/api/grn", methods=["POST"])
+@login_required
+@admin_required
+def api_grn():
+    """JSON GRN: ``{"supplier", "reference", "token", "lines": [...]}``."""
+    data = request.json or {}
+    try:
+        grn_id, line_count = save_grn(grn.parse_json(data), (data.get("supplier") or "").strip(),
+                                      (data.get("reference") or "").strip(), data.get("token"))
+    except grn.GrnError as e:
+        return jsonify({"success": False, "errors": e.errors}), 400
+    except Error as e:
+        if "Duplicate entry" in str(e) and "token" in str(e):
+            return jsonify({"success": False, "errors": ["This GRN was already saved"]}), 409
+        return jsonify({"success": False, "errors": [str(e)]}), 500
+    return jsonify({"success": True, "grn_id": grn_id, "lines": line_count})
+
+@app.route("/reorder_suggestions")
+@login_required
+@admin_required
+def reorder_suggestions():
+    conn = get_db_connection()
+    if not conn:
+        flash("Database connection error", "danger")
+        return redirect(url_for("dashboard"))
+
+    groups = forecast.suggestions_by_supplier(conn)
+    conn.close()
+    return render_template("reorder_suggestions.html", groups=groups,
+                           lead_time=forecast.LEAD_TIME_DAYS, cover_days=forecast.COVER_DAYS)
 
 # -----------------------
 # STOCK ADJUSTMENT MODULE
@@ -731,8 +1390,22 @@ def stock_adjustment():
                 VALUES (%s, %s, %s, %s)
             """, (product_id, -quantity, adjustment_type, session["user_id"]))
 
+            events.record(cur, events.STOCK_CHANGED, int(product_id), {
+                "product_id": int(product_id),
+                "change_qty": -quantity,
+                "movement_type": adjustment_type,
+                "reason": reason,
+                "stock_after": product["stock"] - quantity,
+            })
+            alerts.record_crossings(conn, changes={int(product_id): -quantity})
+            valuation.record(conn, [
+                valuation.Move(int(product_id), -quantity, movement_type=adjustment_type),
+            ], session["user_id"], session.get("store_id"))
+
             conn.commit()
-            log_activity(session["user_id"], f"Stock {adjustment_type}", f"Adjusted {quantity} units of product ID {product_id} as {adjustment_type}")
+            cache.invalidate("products", "stock", "valuation")
+            events.dispatch_pending(conn)
+            log_activity(session["user_id"], f"Stock {adjustment_type}", f"Adjusted {quantity} units of product ID {product_id} as {adjustment_type}", conn)
             flash(f"Stock adjustment ({adjustment_type}) completed successfully!", "success")
             return redirect(url_for("inventory"))
 
@@ -762,42 +1435,29 @@ def stock_adjustment():
 @login_required
 @admin_required
 def stock_history(product_id):
-    conn = get_db_connection()
+    conn = db.get_read_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("inventory"))
     
-    cur = conn.cursor(dictionary=True)
-
     # Get product details
-    cur.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product = cur.fetchone()
+    product = db.get_product(conn, product_id)
 
     if not product:
         flash("Product not found", "danger")
         conn.close()
         return redirect(url_for("inventory"))
 
-    # Get stock movements
-    cur.execute("""
-        SELECT sm.*, u.username, 
-               CASE 
-                   WHEN sm.movement_type = 'PURCHASE' THEN 'Purchase'
-                   WHEN sm.movement_type = 'SALE' THEN 'Sale'
-                   WHEN sm.movement_type = 'DAMAGE' THEN 'Damage'
-                   WHEN sm.movement_type = 'EXPIRED' THEN 'Expired'
-                   ELSE sm.movement_type
-               END as movement_description
-        FROM stock_movements sm
-        JOIN users u ON sm.created_by = u.id
-        WHERE sm.product_id = %s
-        ORDER BY sm.created_at DESC
-    """, (product_id,))
-    
-    movements = cur.fetchall()
+    # Movements since the last month-end close, starting from its closing
+    # stock; ?full=1 lists the whole history
+    opening = None if request.args.get("full") else periods.opening_balance(conn, product_id)
+    since = periods.opening_date(opening) if opening else None
+    movements = db.get_stock_movements(conn, product_id, since)
+    stock_value = valuation.product_valuation(conn, product_id)
     conn.close()
 
-    return render_template("stock_history.html", product=product, movements=movements)
+    return render_template("stock_history.html", product=product, movements=movements, stock_value=stock_value,
+                           opening=opening, since=since)
 
 @app.route("/edit_product/<int:id>", methods=["GET", "POST"])
 @login_required
@@ -808,9 +1468,8 @@ def edit_product(id):
         flash("Database connection error", "danger")
         return redirect(url_for("inventory"))
     
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM products WHERE id=%s", (id,))
-    product = cur.fetchone()
+    cur = conn.cursor()
+    product = db.get_product(conn, id)
 
     if not product:
         flash("Product not found", "danger")
@@ -822,19 +1481,32 @@ def edit_product(id):
         price = request.form.get("price", "")
         gst = request.form.get("gst", "")
         stock = request.form.get("stock", "")
+        reorder_level = request.form.get("reorder_level", product.reorder_level)
+        category = request.form.get("category", "").strip() or None
         
         try:
             price = float(price)
             gst = float(gst)
             stock = int(stock)
+            reorder_level = int(reorder_level)
             
-            cur.execute("UPDATE products SET name=%s, price=%s, gst=%s, stock=%s WHERE id=%s",
-                        (name, price, gst, stock, id))
+            cur.execute("UPDATE products SET name=%s, price=%s, gst=%s, stock=%s, reorder_level=%s, category=%s WHERE id=%s",
+                        (name, price, gst, stock, reorder_level, category, id))
+            if stock != product.stock:
+                cur.execute(SQL_INSERT_MANUAL_MOVEMENT, (id, stock - product.stock, "EDIT", session["user_id"]))
+            alerts.record_crossings(conn, previous={id: (product.stock, product.reorder_level)})
+            valuation.record(conn, [
+                valuation.Move(id, stock - product.stock, movement_type="EDIT"),
+            ], session["user_id"], session.get("store_id"))
             conn.commit()
+            cache.invalidate("products", "valuation")
+            if category != product.category:
+                cache.invalidate("promotions")
+            events.dispatch_pending(conn)
             flash(f"Product '{name}' updated successfully!", "success")
-            return redirect(url_for("inventory"))
+            return redirect(inventory_return_url())
         except ValueError:
-            flash("Invalid price, GST, or stock value", "danger")
+            flash("Invalid price, GST, stock, or reorder level value", "danger")
         except Error as e:
             if "Duplicate entry" in str(e):
                 flash("A product with this name already exists", "danger")
@@ -857,31 +1529,101 @@ def delete_product(id):
     
     cur = conn.cursor()
     cur.execute("DELETE FROM products WHERE id=%s", (id,))
+    cur.execute("DELETE FROM stock_valuation WHERE product_id=%s", (id,))
+    cur.execute(catalog.SQL_RECORD_DELETION, (id,))
     conn.commit()
+    cache.invalidate("products", "promotions")
     conn.close()
     flash("Product deleted successfully", "success")
-    return redirect(url_for("inventory"))
+    return redirect(inventory_return_url())
+
+# -----------------------
+# STOCK RECONCILIATION
+# -----------------------
+@app.route("/stock_reconciliation", methods=["GET", "POST"])
+@login_required
+@admin_required
+def stock_reconciliation():
+    if request.method == "POST":
+        action = request.form.get("action")
+        if action == "check":
+            result = reconcile.run()
+            if result is None:
+                flash("Reconciliation failed", "danger")
+            else:
+                flash(f"Checked {result.products} products: {len(result.mismatches)} mismatch(es)",
+                      "success" if not result.mismatches else "danger")
+        elif action == "repair":
+            conn = get_db_connection()
+            if not conn:
+                flash("Database connection error", "danger")
+                return redirect(url_for("stock_reconciliation"))
+            try:
+                count = reconcile.repair_reported(conn, session["user_id"])
+                log_activity(session["user_id"], "Stock Reconciliation", f"Repaired {count} ledger mismatch(es)", conn)
+                flash(f"Wrote {count} reconciling movement(s)", "success")
+            except Exception as e:
+                conn.rollback()
+                flash(f"Error repairing ledger: {str(e)}", "danger")
+            finally:
+                conn.close()
+        return redirect(url_for("stock_reconciliation"))
+
+    conn = get_db_connection()
+    if not conn:
+        flash("Database connection error", "danger")
+        return redirect(url_for("dashboard"))
+    mismatches = reconcile.mismatches(conn)
+    checkpoint = reconcile.last_checkpoint(conn)
+    conn.close()
+    return render_template("stock_reconciliation.html", mismatches=mismatches, checkpoint=checkpoint)
 
 # -----------------------
 # LOW STOCK & ADD STOCK
 # -----------------------
 @app.route("/low_stock")
 @login_required
+@cache.cached_view(ttl=60, depends=("products",))
 def low_stock():
-    threshold = request.args.get('threshold', 10, type=int)
+    # Without ?threshold= each product is compared with its own reorder level
+    threshold = request.args.get('threshold', None, type=int)
     
     conn = get_db_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("dashboard"))
     
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT id, name, stock, price FROM products WHERE stock < %s ORDER BY stock ASC", (threshold,))
-    low_stock_products = cur.fetchall()
+    if threshold is None:
+        low_stock_products = alerts.low_stock_items(conn)
+    else:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SELECT id, name, stock, reorder_level, price FROM products WHERE stock < %s ORDER BY stock ASC", (threshold,))
+        low_stock_products = cur.fetchall()
     conn.close()
     
     return render_template("low_stock.html", low_stock_products=low_stock_products, threshold=threshold)
 
+@app.route("/low_stock/stream")
+@login_required
+def low_stock_stream():
+    """Server-sent events: current low-stock set, then live crossings.
+
+    Behind ``asgi.py`` the async version of this route answers instead; this
+    one holds a worker thread for the life of the stream.
+    """
+    position = alerts.parse_last_event_id(request.headers.get("Last-Event-ID"))
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database connection error"}), 500
+    snapshot = alerts.snapshot_payload(alerts.low_stock_items(conn))
+    conn.close()
+
+    response = Response(stream_with_context(alerts.stream(snapshot, position, events.log_path())), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 @app.route("/add_stock/<int:product_id>", methods=["GET", "POST"])
 @login_required
 @admin_required
@@ -901,7 +1643,19 @@ def add_stock(product_id):
                 flash("Quantity must be positive", "danger")
             else:
                 cur.execute("UPDATE products SET stock = stock + %s WHERE id = %s", (quantity, product_id))
+                cur.execute(SQL_INSERT_MANUAL_MOVEMENT, (product_id, quantity, "MANUAL", session["user_id"]))
+                events.record(cur, events.STOCK_CHANGED, product_id, {
+                    "product_id": product_id,
+                    "change_qty": quantity,
+                    "movement_type": "MANUAL",
+                })
+                alerts.record_crossings(conn, changes={product_id: quantity})
+                valuation.record(conn, [
+                    valuation.Move(product_id, quantity, movement_type="MANUAL"),
+                ], session["user_id"], session.get("store_id"))
                 conn.commit()
+                cache.invalidate("products", "valuation")
+                events.dispatch_pending(conn)
                 flash(f"Added {quantity} units to stock successfully!", "success")
                 return redirect(url_for("low_stock"))
         except ValueError:
@@ -924,6 +1678,7 @@ def add_stock(product_id):
 # -----------------------
 @app.route("/stores")
 @login_required
+@cache.cached_view(ttl=300, depends=("stores",))
 def stores():
     conn = get_db_connection()
     if not conn:
@@ -958,6 +1713,7 @@ def add_store():
         cur.execute("INSERT INTO stores (store_name, location, phone) VALUES (%s, %s, %s)",
                     (store_name, location, phone))
         conn.commit()
+        cache.invalidate("stores")
         conn.close()
         flash(f"Store '{store_name}' added successfully!", "success")
         return redirect(url_for("stores"))
@@ -970,6 +1726,7 @@ def add_store():
 @app.route("/users")
 @login_required
 @admin_required
+@cache.cached_view(ttl=300, depends=("users", "stores"), per_user=True)
 def users():
     conn = get_db_connection()
     if not conn:
@@ -1019,6 +1776,13 @@ def add_user():
             store_id = None
         elif store_id:
             store_id = int(store_id)
+
+        # Hash before taking a database connection: it may queue for a while
+        try:
+            hashed_password = passwords.generate(password)
+        except passwords.Busy as e:
+            flash(str(e), "warning")
+            return render_template("add_user.html", stores=stores)
         
         conn = get_db_connection()
         if not conn:
@@ -1027,13 +1791,13 @@ def add_user():
         
         cur = conn.cursor()
         try:
-            hashed_password = generate_password_hash(password)
             cur.execute("""
                 INSERT INTO users (username, password, role, store_id, full_name, email) 
                 VALUES (%s, %s, %s, %s, %s, %s)
             """, (username, hashed_password, role, store_id, full_name, email))
             conn.commit()
-            log_activity(session["user_id"], "Add User", f"Added user '{username}' with role '{role}'")
+            cache.invalidate("users")
+            log_activity(session["user_id"], "Add User", f"Added user '{username}' with role '{role}'", conn)
             flash(f"User '{username}' added successfully!", "success")
             return redirect(url_for("users"))
         except Error as e:
@@ -1046,6 +1810,145 @@ def add_user():
             
     return render_template("add_user.html", stores=stores)
 
+@app.route("/update_user/<int:user_id>", methods=["POST"])
+@login_required
+@admin_required
+def update_user(user_id):
+    role = request.form.get("role", "").strip()
+    active = 1 if request.form.get("active") == "1" else 0
+
+    if user_id == session["user_id"] and (not active or role != session.get("role")):
+        flash("You cannot change your own role or deactivate yourself", "danger")
+        return redirect(url_for("users"))
+    if role not in ("admin", "company_admin", "store_admin", "store_user"):
+        flash("Invalid role", "danger")
+        return redirect(url_for("users"))
+
+    conn = get_db_connection()
+    if not conn:
+        flash("Database connection error", "danger")
+        return redirect(url_for("users"))
+
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE users SET role = %s, active = %s WHERE id = %s", (role, active, user_id))
+        conn.commit()
+        # Other workers reload the user on their next request
+        cache.invalidate("users")
+        if not active:
+            sessions.revoke_user(user_id)
+        log_activity(session["user_id"], "Update User",
+                     f"Set user ID {user_id} role '{role}', {'active' if active else 'inactive'}", conn)
+        flash("User updated successfully!", "success")
+    except Error as e:
+        flash(f"Database error: {str(e)}", "danger")
+    finally:
+        conn.close()
+    return redirect(url_for("users"))
+
+# -----------------------
+# PROMOTIONS
+# -----------------------
+@app.route("/promotions", methods=["GET", "POST"])
+@login_required
+@admin_required
+def promotions_page():
+    conn = get_db_connection()
+    if not conn:
+        flash("Database connection error", "danger")
+        return redirect(url_for("admin_dashboard"))
+
+    cur = conn.cursor(dictionary=True)
+    if request.method == "POST":
+        form = request.form
+        name = form.get("name", "").strip()
+        kind = form.get("kind", "")
+        product_code = form.get("product_code", "").strip().upper()
+        category = form.get("category", "").strip() or None
+        try:
+            buy_qty = int(form.get("buy_qty") or 0)
+            free_qty = int(form.get("free_qty") or 0)
+            min_qty = int(form.get("min_qty") or 1)
+            percent = float(form.get("percent") or 0)
+            starts_at = datetime.fromisoformat(form["starts_at"]) if form.get("starts_at") else None
+            ends_at = datetime.fromisoformat(form["ends_at"]) if form.get("ends_at") else None
+        except ValueError:
+            flash("Invalid quantity, percent or date", "danger")
+            conn.close()
+            return redirect(url_for("promotions_page"))
+        daily_from = form.get("daily_from") or None
+        daily_to = form.get("daily_to") or None
+
+        product_id = None
+        if product_code:
+            product = db.query_one(conn, "SELECT id FROM products WHERE product_code = %s", (product_code,))
+            product_id = product[0] if product else None
+
+        error = None
+        if not name or kind not in promotions.KINDS:
+            error = "Name and a valid type are required"
+        elif product_code and product_id is None:
+            error = f"No product with code {product_code}"
+        elif kind in (promotions.BOGO, promotions.SLAB) and product_id is None:
+            error = "Buy-X-get-Y and quantity slab offers need a product code"
+        elif kind == promotions.PERCENT and (product_id is None) == (category is None):
+            error = "Percent-off offers need either a product code or a category"
+        elif kind == promotions.BOGO and (buy_qty < 1 or free_qty < 1):
+            error = "Buy and free quantities must be at least 1"
+        elif kind != promotions.BOGO and not 0 < percent <= 100:
+            error = "Percent must be between 0 and 100"
+        elif (daily_from is None) != (daily_to is None):
+            error = "Give both ends of the daily time window"
+        elif starts_at and ends_at and ends_at <= starts_at:
+            error = "The offer must end after it starts"
+        if error:
+            flash(error, "danger")
+            conn.close()
+            return redirect(url_for("promotions_page"))
+
+        try:
+            cur.execute("""
+                INSERT INTO promotions (name, kind, product_id, category, buy_qty, free_qty, min_qty, percent,
+                                        starts_at, ends_at, daily_from, daily_to)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (name, kind, product_id, None if product_id else category, buy_qty, free_qty, max(min_qty, 1),
+                  percent, starts_at, ends_at, daily_from, daily_to))
+            conn.commit()
+            cache.invalidate("promotions")
+            log_activity(session["user_id"], "Add Promotion", f"Added {kind} promotion '{name}'", conn)
+            flash(f"Promotion '{name}' added", "success")
+        except Error as e:
+            flash(f"Database error: {str(e)}", "danger")
+        finally:
+            conn.close()
+        return redirect(url_for("promotions_page"))
+
+    cur.execute("""
+        SELECT pr.*, p.name AS product_name, p.product_code
+        FROM promotions pr
+        LEFT JOIN products p ON pr.product_id = p.id
+        ORDER BY pr.active DESC, pr.created_at DESC
+    """)
+    rules = cur.fetchall()
+    conn.close()
+    return render_template("promotions.html", rules=rules, now=datetime.now())
+
+@app.route("/promotions/<int:promotion_id>/toggle", methods=["POST"])
+@login_required
+@admin_required
+def toggle_promotion(promotion_id):
+    conn = get_db_connection()
+    if not conn:
+        flash("Database connection error", "danger")
+        return redirect(url_for("promotions_page"))
+    cur = conn.cursor()
+    cur.execute("UPDATE promotions SET active = 1 - active WHERE id = %s", (promotion_id,))
+    conn.commit()
+    conn.close()
+    cache.invalidate("promotions")
+    flash("Promotion updated", "success")
+    return redirect(url_for("promotions_page"))
+
 # -----------------------
 # ACTIVITY LOG
 # -----------------------
@@ -1053,7 +1956,7 @@ def add_user():
 @login_required
 @admin_required
 def activity_log():
-    conn = get_db_connection()
+    conn = db.get_read_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("dashboard"))
@@ -1077,16 +1980,8 @@ def activity_log():
 @app.route("/billing")
 @login_required
 def billing():
-    conn = get_db_connection()
-    if not conn:
-        flash("Database connection error", "danger")
-        return redirect(url_for("dashboard"))
-    
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM products WHERE stock > 0 ORDER BY name")
-    products = cur.fetchall()
-    conn.close()
-    return render_template("billing.html", products=products)
+    # The till loads products from its own catalog cache (static/js/catalog.js)
+    return render_template("billing.html")
 
 @app.route("/get_product_by_code", methods=["POST"])
 @login_required
@@ -1101,22 +1996,41 @@ def get_product_by_code():
     if not conn:
         return jsonify({"error": "Database connection error"}), 500
     
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT id, name, price, gst, stock FROM products WHERE product_code = %s AND stock > 0", (product_code,))
-    product = cur.fetchone()
+    product = db.get_product_by_code(conn, product_code)
     conn.close()
     
     if product:
         return jsonify({
-            "id": product["id"],
-            "name": product["name"],
-            "price": float(product["price"]),
-            "gst": float(product["gst"]),
-            "stock": product["stock"]
+            "id": product.id,
+            "name": product.name,
+            "price": float(product.price),
+            "gst": float(product.gst),
+            "stock": product.stock
         })
     else:
         return jsonify({"error": "Product not found or out of stock"}), 404
 
+@app.route("/api/checkout/quote", methods=["POST"])
+@login_required
+def checkout_quote():
+    """Promotion discounts for the till's current cart, so it shows the real total."""
+    cart = (request.json or {}).get("cart", [])
+    try:
+        promotions.current_index().apply(cart)
+        discount = float((request.json or {}).get("discount", 0))
+        subtotal, gst_total, total = checkout.cart_totals(cart, discount)
+    except promotions.Unavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Invalid cart"}), 400
+    return jsonify({
+        "lines": [{"discount": item["discount"], "promotion_id": item["promotion_id"]} for item in cart],
+        "promotion_total": checkout.promotion_total(cart),
+        "subtotal": round(subtotal, 2),
+        "gst_total": round(gst_total, 2),
+        "total": round(total, 2),
+    })
+
 @app.route("/process_checkout", methods=["POST"])
 @login_required
 def process_checkout():
@@ -1135,24 +2049,19 @@ def process_checkout():
     cur = conn.cursor(dictionary=True)
 
     try:
-        subtotal = 0
-        gst_total = 0
-
-        for item in cart:
-            item_subtotal = item["price"] * item["qty"]
-            item_gst = item_subtotal * (item["gst"] / 100)
-            subtotal += item_subtotal
-            gst_total += item_gst
-
-        total = subtotal + gst_total - discount
-        bill_no = f"BILL{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        promotions.current_index(conn).apply(cart)
+        totals = checkout.cart_totals(cart, discount)
+        subtotal, gst_total, total = totals
+        bill_discount = discount + checkout.promotion_total(cart)
+        now = datetime.now()
+        bill_no = checkout.bill_number(now, session["user_id"])
 
-        cur.execute("""
-            INSERT INTO bills_new (bill_number, total, discount, payment_mode, bill_date, created_by)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (bill_no, total, discount, payment_mode, datetime.now(), session["user_id"]))
+        cur.execute(checkout.SQL_INSERT_BILL,
+                    (bill_no, total, bill_discount, payment_mode, now, session["user_id"], subtotal, gst_total))
 
         bill_id = cur.lastrowid
+        cur.executemany(gst.SQL_INSERT_ENTRY, checkout.gst_rows(bill_id, cart, now, session.get("store_id")))
+        stock_after = []
 
         for item in cart:
             # Check stock availability
@@ -1162,22 +2071,26 @@ def process_checkout():
             if not product or product['stock'] < item["qty"]:
                 raise ValueError(f"Insufficient stock for {item['name']}")
             
-            item_total = (item["price"] * item["qty"]) + ((item["price"] * item["qty"]) * item["gst"] / 100)
-            cur.execute("""
-                INSERT INTO bill_items (bill_id, product_name, quantity, price, gst, item_total)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (bill_id, item["name"], item["qty"], item["price"], item["gst"], item_total))
+            cur.execute(checkout.SQL_INSERT_ITEM, checkout.item_row(bill_id, item))
 
             cur.execute("UPDATE products SET stock = stock - %s WHERE id=%s", (item["qty"], item["id"]))
 
             # Log stock movement for sale (negative quantity)
-            cur.execute("""
-                INSERT INTO stock_movements (product_id, change_qty, movement_type, reference_id, created_by)
-                VALUES (%s, %s, 'SALE', %s, %s)
-            """, (item["id"], -item["qty"], bill_id, session["user_id"]))
+            cur.execute(checkout.SQL_INSERT_MOVEMENT, (item["id"], -item["qty"], bill_id, session["user_id"]))
+            stock_after.append(product["stock"] - item["qty"])
+
+        events.record_many(cur, checkout.sale_events(
+            bill_id, bill_no, cart, totals, bill_discount, payment_mode,
+            session["user_id"], session.get("store_id"), stock_after,
+        ))
+        alerts.record_crossings(conn, changes=checkout.stock_changes(cart))
+        valuation.record(conn, checkout.valuation_moves(cart, bill_id),
+                         session["user_id"], session.get("store_id"), revenue=subtotal - bill_discount)
 
         conn.commit()
-        log_activity(session["user_id"], "Create Bill", f"Created bill {bill_no} with total ₹{round(total, 2)}")
+        cache.invalidate("bills", "products", "stock", "valuation")
+        events.dispatch_pending(conn)
+        log_activity(session["user_id"], "Create Bill", f"Created bill {bill_no} with total ₹{round(total, 2)}", conn)
         return jsonify({"success": True, "bill_number": bill_no, "total": round(total, 2)})
     
     except Exception as e:
@@ -1186,200 +2099,394 @@ def process_checkout():
     finally:
         conn.close()
 
-@app.route("/view_bill/<int:bill_id>")
-@login_required
-def view_bill(bill_id):
+# Bills are immutable once committed, so rendered pages are cached per
+# bill and format; only a return changes what the bill page shows, and
+# process_return drops the cached pages.
+BILL_TEMPLATES = {
+    "view": "view_bill.html",
+    "a4": "print_bill_a4.html",
+    "thermal": "print_bill_thermal.html",
+}
+BILL_CACHE_TTL = 24 * 60 * 60
+BATCH_PRINT_LIMIT = 1000
+
+def bill_totals(bill, items):
+    """Subtotal and GST stored at checkout, recomputed for older bills."""
+    if bill.subtotal is not None and bill.gst_total is not None:
+        return float(bill.subtotal), float(bill.gst_total)
+    subtotal = 0
+    total_gst = 0
+    for item in items:
+        item_price = float(item.price) * item.quantity
+        item_gst = item_price * (float(item.gst) / 100)
+        subtotal += item_price
+        total_gst += item_gst
+    return subtotal, total_gst
+
+def render_bill(fmt, bill, items, credit_notes=(), slabs=()):
+    if fmt == "view":
+        return render_template("view_bill.html", bill=bill, items=items, credit_notes=credit_notes,
+                               refund_modes=returns.REFUND_MODES)
+    subtotal, total_gst = bill_totals(bill, items)
+    title = f"Invoice - {bill.bill_number}" if fmt == "a4" else f"Receipt - {bill.bill_number}"
+    return render_template(BILL_TEMPLATES[fmt], bills=[(bill, items, subtotal, total_gst, slabs)], title=title)
+
+def show_bill(bill_id, fmt):
+    # Only admins get the return form, so the page is cached per audience
+    key = f"bill:{fmt}:{bill_id}"
+    if fmt == "view" and session.get("role") == "admin":
+        key += ":admin"
+    # A page carrying flashed messages (after a return) is rendered fresh and
+    # not cached
+    fresh = "_flashes" in session
+    html = None if fresh else cache.get(key)
+    if html is not None:
+        return html
+
     conn = get_db_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("reports"))
     
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM bills_new WHERE id=%s", (bill_id,))
-    bill = cur.fetchone()
+    bill = db.get_bill(conn, bill_id)
     
     if not bill:
         flash("Bill not found", "danger")
         conn.close()
         return redirect(url_for("reports"))
     
-    cur.execute("SELECT * FROM bill_items WHERE bill_id=%s", (bill_id,))
-    items = cur.fetchall()
+    items = db.get_bill_items(conn, bill_id)
+    credit_notes = returns.bill_credit_notes(conn, bill_id) if fmt == "view" else ()
+    slabs = gst.bill_slabs(conn, [bill_id])[bill_id] if fmt != "view" else ()
     conn.close()
-    return render_template("view_bill.html", bill=bill, items=items)
 
-@app.route("/print_bill_a4/<int:bill_id>")
+    html = render_bill(fmt, bill, items, credit_notes, slabs)
+    if not fresh:
+        cache.set(key, html, BILL_CACHE_TTL)
+    return html
+
+@app.route("/view_bill/<int:bill_id>")
 @login_required
-def print_bill_a4(bill_id):
+def view_bill(bill_id):
+    return show_bill(bill_id, "view")
+
+@app.route("/bills/<int:bill_id>/return", methods=["POST"])
+@login_required
+@admin_required
+def process_return(bill_id):
+    """Credit note for the quantities entered against each bill line."""
+    quantities = {}
+    for field, value in request.form.items():
+        if field.startswith("return_qty_") and value.strip():
+            try:
+                quantities[int(field[len("return_qty_"):])] = int(value)
+            except ValueError:
+                flash("Invalid return quantity", "danger")
+                return redirect(url_for("view_bill", bill_id=bill_id))
+    reason = request.form.get("reason", "").strip()
+    refund_mode = request.form.get("refund_mode", "Cash")
+    if refund_mode not in returns.REFUND_MODES:
+        flash("Invalid refund mode", "danger")
+        return redirect(url_for("view_bill", bill_id=bill_id))
+
     conn = get_db_connection()
     if not conn:
         flash("Database connection error", "danger")
-        return redirect(url_for("reports"))
-    
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM bills_new WHERE id=%s", (bill_id,))
-    bill = cur.fetchone()
-    
-    if not bill:
-        flash("Bill not found", "danger")
+        return redirect(url_for("view_bill", bill_id=bill_id))
+
+    try:
+        credit_note_id, number, note = returns.record(
+            conn, bill_id, quantities, session["user_id"], reason, refund_mode, session.get("store_id"))
+        conn.commit()
+    except returns.ReturnError as e:
+        conn.rollback()
         conn.close()
-        return redirect(url_for("reports"))
-    
-    cur.execute("SELECT * FROM bill_items WHERE bill_id=%s", (bill_id,))
-    items = cur.fetchall()
-    
-    # Calculate subtotal and GST
-    subtotal = 0
-    total_gst = 0
-    for item in items:
-        item_price = float(item['price']) * item['quantity']
-        item_gst = item_price * (float(item['gst']) / 100)
-        subtotal += item_price
-        total_gst += item_gst
-    
+        for error in e.errors:
+            flash(error, "danger")
+        return redirect(url_for("view_bill", bill_id=bill_id))
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        flash(f"Error processing return: {str(e)}", "danger")
+        return redirect(url_for("view_bill", bill_id=bill_id))
+
+    cache.invalidate("bills", "products", "stock", "valuation")
+    cache.delete(f"bill:view:{bill_id}")
+    cache.delete(f"bill:view:{bill_id}:admin")
+    events.dispatch_pending(conn)
     conn.close()
-    return render_template("print_bill_a4.html", bill=bill, items=items, subtotal=subtotal, total_gst=total_gst)
+    log_activity(session["user_id"], "Sales Return",
+                 f"Credit note {number} for bill ID {bill_id}: refund ₹{note.total} by {refund_mode}")
+    flash(f"Credit note {number} created: refund ₹{note.total:.2f} by {refund_mode}", "success")
+    return redirect(url_for("view_bill", bill_id=bill_id))
+
+@app.route("/print_bill_a4/<int:bill_id>")
+@login_required
+def print_bill_a4(bill_id):
+    return show_bill(bill_id, "a4")
 
 @app.route("/print_bill_thermal/<int:bill_id>")
 @login_required
 def print_bill_thermal(bill_id):
+    return show_bill(bill_id, "thermal")
+
+@app.route("/print_bills")
+@login_required
+@admin_required
+def print_bills():
+    """Print many bills as one streamed document, by ``ids`` or by ``date``."""
+    fmt = request.args.get("format", "a4")
+    if fmt not in ("a4", "thermal"):
+        fmt = "a4"
+    bill_ids = [int(x) for x in request.args.get("ids", "").split(",") if x.strip().isdigit()]
+    day = request.args.get("date") or datetime.now().strftime("%Y-%m-%d")
+
+    try:
+        start = datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        flash("Invalid date, expected YYYY-MM-DD", "danger")
+        return redirect(url_for("reports"))
+
     conn = get_db_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("reports"))
-    
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT * FROM bills_new WHERE id=%s", (bill_id,))
-    bill = cur.fetchone()
-    
-    if not bill:
-        flash("Bill not found", "danger")
-        conn.close()
-        return redirect(url_for("reports"))
-    
-    cur.execute("SELECT * FROM bill_items WHERE bill_id=%s", (bill_id,))
-    items = cur.fetchall()
-    
-    # Calculate subtotal and GST
-    subtotal = 0
-    total_gst = 0
-    for item in items:
-        item_price = float(item['price']) * item['quantity']
-        item_gst = item_price * (float(item['gst']) / 100)
-        subtotal += item_price
-        total_gst += item_gst
-    
+
+    if bill_ids:
+        bills = db.get_bills_with_items(conn, bill_ids=bill_ids[:BATCH_PRINT_LIMIT])
+    else:
+        day_bills = db.get_bills_between(conn, start, start + timedelta(days=1), BATCH_PRINT_LIMIT)
+        bills = db.get_bills_with_items(conn, bills=day_bills)
+    slabs = gst.bill_slabs(conn, [bill.id for bill, _ in bills])
     conn.close()
-    return render_template("print_bill_thermal.html", bill=bill, items=items, subtotal=subtotal, total_gst=total_gst)
+
+    if not bills:
+        flash("No bills found to print", "warning")
+        return redirect(url_for("reports"))
+
+    rows = ((bill, items) + bill_totals(bill, items) + (slabs[bill.id],) for bill, items in bills)
+    title = f"Bills ({len(bills)})" if bill_ids else f"Bills for {day} ({len(bills)})"
+    return stream_template(BILL_TEMPLATES[fmt], bills=rows, title=title)
 
 # -----------------------
 # REPORTS
 # -----------------------
+# Bills covered by each reports period, as ranges on idx_bills_date
+REPORT_DATE_FILTERS = {
+    'daily': "bill_date >= CURDATE()",
+    'weekly': "bill_date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)",
+    'monthly': "bill_date >= DATE_FORMAT(CURDATE(), '%Y-%m-01')",
+    'all': "1=1",
+}
+REPORT_PAGE_SIZE = 100
+
 @app.route("/reports")
 @login_required
+@cache.cached_view(ttl=60, depends=("bills", "purchases", "valuation"))
 def reports():
     report_type = request.args.get('type', 'all')
     
     # Validate report type
-    valid_types = ['daily', 'weekly', 'monthly', 'all']
-    if report_type not in valid_types:
+    if report_type not in REPORT_DATE_FILTERS:
         report_type = 'all'
     
-    conn = get_db_connection()
+    # Reports tolerate a few seconds of staleness, so they read from a replica
+    conn = db.get_read_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("dashboard"))
     
     cur = conn.cursor(dictionary=True)
     
-    # Build query based on report type
-    if report_type == 'daily':
-        date_filter = "DATE(bill_date) = CURDATE()"
-    elif report_type == 'weekly':
-        date_filter = "DATE(bill_date) >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)"
-    elif report_type == 'monthly':
-        date_filter = "DATE_FORMAT(bill_date, '%Y-%m') = DATE_FORMAT(CURDATE(), '%Y-%m')"
-    else:  # all
-        date_filter = "1=1"
-    
-    # Get bills with filter
-    query = f"""
+    # One page of bills, newest first. Keyset on (bill_date, id) walks
+    # idx_bills_date from the last bill shown, so a page costs the same
+    # however much history there is
+    keyset, params = "", []
+    before = request.args.get('before', type=int)
+    if before:
+        row = db.query_one(conn, "SELECT bill_date FROM bills_new WHERE id = %s", (before,))
+        if row:
+            keyset = "AND (bill_date < %s OR (bill_date = %s AND id < %s))"
+            params = [row[0], row[0], before]
+    cur.execute(f"""
         SELECT bill_number, bill_date, total, payment_mode, id
         FROM bills_new
-        WHERE {date_filter}
-        ORDER BY bill_date DESC
-    """
-    cur.execute(query)
+        WHERE {REPORT_DATE_FILTERS[report_type]} {keyset}
+        ORDER BY bill_date DESC, id DESC
+        LIMIT %s
+    """, params + [REPORT_PAGE_SIZE + 1])
     bills = cur.fetchall()
+    next_before = bills[REPORT_PAGE_SIZE - 1]['id'] if len(bills) > REPORT_PAGE_SIZE else None
+    bills = bills[:REPORT_PAGE_SIZE]
     
-    # Get statistics
-    stats_query = f"""
-        SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(discount), 0)
-        FROM bills_new
-        WHERE {date_filter}
-    """
-    cur.execute(stats_query)
-    stats_row = cur.fetchone()
-    stats = (stats_row['COUNT(*)'], float(stats_row['COALESCE(SUM(total), 0)']), float(stats_row['COALESCE(SUM(discount), 0)']))
-    
-    # Get purchase statistics
-    if report_type == 'daily':
-        purchase_date_filter = "DATE(p.created_at) = CURDATE()"
-    elif report_type == 'weekly':
-        purchase_date_filter = "DATE(p.created_at) >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)"
-    elif report_type == 'monthly':
-        purchase_date_filter = "DATE_FORMAT(p.created_at, '%Y-%m') = DATE_FORMAT(CURDATE(), '%Y-%m')"
-    else:  # all
-        purchase_date_filter = "1=1"
-    
-    purchase_query = f"""
-        SELECT COALESCE(SUM(p.quantity * p.cost_price), 0) as total_purchases
-        FROM purchases p
-        WHERE {purchase_date_filter}
-    """
-    cur.execute(purchase_query)
-    purchase_row = cur.fetchone()
-    total_purchases = float(purchase_row['total_purchases']) if purchase_row else 0
+    # Closed days and months come from period-close snapshots; only the
+    # open period is aggregated from raw rows
+    summary = periods.summary(conn, valuation.period_start(report_type))
+    stats = db.SalesStats(summary.bill_count, float(summary.sales_total), float(summary.discount_total))
+    totals = valuation.PeriodTotals(summary.purchase_value, summary.sales_revenue, summary.cogs, summary.writeoff_value)
+    total_purchases = float(totals.purchase_value)
+    inventory_value = float(valuation.inventory_value(conn))
     
     conn.close()
-    return render_template("reports.html", bills=bills, stats=stats, total_purchases=total_purchases, report_type=report_type)
+    return render_template("reports.html", bills=bills, stats=stats, total_purchases=total_purchases,
+                           totals=totals, inventory_value=inventory_value, report_type=report_type,
+                           before=before, next_before=next_before)
 
 # -----------------------
 # PRODUCT ANALYTICS
 # -----------------------
+REPORT_EXPORT_COLUMNS = ["bill_number", "bill_date", "payment_mode", "subtotal", "gst_total", "discount", "total"]
+
+@app.route("/reports/export")
+@login_required
+def export_report():
+    """Bills of a reports period as CSV; rebuilt only after new bills."""
+    report_type = request.args.get('type', 'all')
+    if report_type not in REPORT_DATE_FILTERS:
+        report_type = 'all'
+
+    def build():
+        # Primary, not a replica: the file is kept until the next bill, so it
+        # must not be built from rows a lagging replica hasn't received yet
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection error")
+        try:
+            rows = list(db.iter_rows(conn, f"""
+                SELECT {', '.join(REPORT_EXPORT_COLUMNS)}
+                FROM bills_new
+                WHERE {REPORT_DATE_FILTERS[report_type]}
+                ORDER BY bill_date DESC, id DESC
+            """))
+        finally:
+            conn.close()
+        return _csv_bytes(REPORT_EXPORT_COLUMNS, rows)
+
+    # The periods move with the calendar, so each day gets its own build
+    today = datetime.now().strftime("%Y-%m-%d")
+    try:
+        path = artifacts.build(f"report-{report_type}", "csv", build, depends=("bills",), key=today)
+    except Exception as e:
+        print(f"Error exporting report: {e}")
+        flash("Could not export report", "danger")
+        return redirect(url_for("reports", type=report_type))
+    return artifacts.send(path, f"sales-{report_type}-{today}.csv")
+
+GST_EXPORT_COLUMNS = ["key", "gst_rate", "taxable_value", "cgst", "sgst", "tax_amount", "bills"]
+
+def _gst_report_args():
+    """``(start, end, group)`` from the query string; flashes and returns ``None`` if invalid."""
+    start, end = gst.month_range()
+    try:
+        if request.args.get("start"):
+            start = datetime.strptime(request.args["start"], "%Y-%m-%d").date()
+        if request.args.get("end"):
+            end = datetime.strptime(request.args["end"], "%Y-%m-%d").date()
+    except ValueError:
+        flash("Dates must be YYYY-MM-DD", "danger")
+        return None
+    if end < start:
+        flash("End date is before start date", "danger")
+        return None
+    group = request.args.get("group", "rate")
+    if group not in gst.GROUPS:
+        group = "rate"
+    return start, end, group
+
+@app.route("/reports/gst")
+@login_required
+@admin_required
+@cache.cached_view(ttl=300, depends=("bills",))
+def gst_report():
+    """Taxable value and tax by GST rate, day or store from stored ``gst_entries``."""
+    args = _gst_report_args()
+    if args is None:
+        return redirect(url_for("gst_report"))
+    start, end, group = args
+
+    conn = db.get_read_connection()
+    if not conn:
+        flash("Database connection error", "danger")
+        return redirect(url_for("reports"))
+    try:
+        rows = gst.summary(conn, start, end, group)
+    finally:
+        conn.close()
+    totals = [sum(getattr(row, field) for row in rows)
+              for field in ("taxable_value", "cgst", "sgst", "tax_amount")]
+    return render_template("gst_report.html", rows=rows, totals=totals, start=start, end=end,
+                           group=group, groups=list(gst.GROUPS))
+
+@app.route("/reports/gst/export")
+@login_required
+@admin_required
+def export_gst_report():
+    """The GST summary as CSV; rebuilt only after new bills or returns."""
+    args = _gst_report_args()
+    if args is None:
+        return redirect(url_for("gst_report"))
+    start, end, group = args
+
+    def build():
+        # Primary, for the same reason as export_report
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection error")
+        try:
+            rows = gst.summary(conn, start, end, group)
+        finally:
+            conn.close()
+        return _csv_bytes(GST_EXPORT_COLUMNS, rows)
+
+    try:
+        path = artifacts.build(f"gst-{group}", "csv", build, depends=("bills",), key=f"{start}-{end}")
+    except Exception as e:
+        print(f"Error exporting GST summary: {e}")
+        flash("Could not export GST summary", "danger")
+        return redirect(url_for("gst_report", start=start, end=end, group=group))
+    return artifacts.send(path, f"gst-{group}-{start}-{end}.csv")
+
 @app.route("/product_analytics")
 @login_required
 @admin_required
+@cache.cached_view(ttl=300, depends=("products", "stock"))
 def product_analytics():
-    conn = get_db_connection()
+    conn = db.get_read_connection()
     if not conn:
         flash("Database connection error", "danger")
         return redirect(url_for("dashboard"))
     
     cur = conn.cursor(dictionary=True)
 
-    # Top selling products (based on quantity sold)
+    # Top selling products (based on quantity sold), aggregated straight
+    # from bill lines by product_id
     cur.execute("""
-        SELECT p.name, p.id, SUM(ABS(sm.change_qty)) as total_sold, 
-               COUNT(DISTINCT sm.reference_id) as bills_count,
-               p.stock as current_stock
-        FROM stock_movements sm
-        JOIN products p ON sm.product_id = p.id
-        WHERE sm.movement_type = 'SALE'
-        GROUP BY p.id, p.name, p.stock
-        ORDER BY total_sold DESC
-        LIMIT 10
+        SELECT p.name, p.id, t.total_sold, t.bills_count, p.stock as current_stock
+        FROM (
+            SELECT product_id, SUM(quantity) as total_sold, COUNT(DISTINCT bill_id) as bills_count
+            FROM bill_items
+            WHERE product_id IS NOT NULL
+            GROUP BY product_id
+            ORDER BY total_sold DESC
+            LIMIT 10
+        ) t
+        JOIN products p ON p.id = t.product_id
+        ORDER BY t.total_sold DESC
     """)
     top_selling = cur.fetchall()
 
     # Low selling products (products with least sales or no sales)
     cur.execute("""
-        SELECT p.name, p.id, COALESCE(SUM(ABS(sm.change_qty)), 0) as total_sold,
-               COUNT(DISTINCT sm.reference_id) as bills_count,
+        SELECT p.name, p.id, COALESCE(t.total_sold, 0) as total_sold,
+               COALESCE(t.bills_count, 0) as bills_count,
                p.stock as current_stock
         FROM products p
-        LEFT JOIN stock_movements sm ON p.id = sm.product_id AND sm.movement_type = 'SALE'
-        GROUP BY p.id, p.name, p.stock
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) as total_sold, COUNT(DISTINCT bill_id) as bills_count
+            FROM bill_items
+            WHERE product_id IS NOT NULL
+            GROUP BY product_id
+        ) t ON t.product_id = p.id
         ORDER BY total_sold ASC, p.stock DESC
         LIMIT 10
     """)
@@ -1392,5 +2499,5 @@ def product_analytics():
 # MAIN
 # -----------------------
 if __name__ == "__main__":
-    init_database()
-    app.run(debug=True)
+    # Development server; create the schema first with ``python bootstrap.py``
+    create_app().run(debug=True)
@@ -0,0 +1,95 @@
+"""Generated downloads (CSV and Excel) built once per data version.
+
+``build()`` returns the file for an artifact and only generates it again when
+the page-cache namespaces it depends on ("products", "bills", ...) have been
+invalidated since the last build. Files are written under
+``instance/artifacts`` and named after a hash of their content, so a rebuild
+that produces the same bytes (e.g. after a restart) reuses the same file,
+modification time and ETag. The newest ``KEEP`` builds of each artifact are
+kept and older ones deleted. Each tenant's files live in its own directory.
+
+``send()`` serves a file through ``send_file``, which answers
+``If-None-Match``/``If-Modified-Since`` with 304 and honours ``Range``
+requests, so interrupted downloads resume.
+"""
+import glob
+import hashlib
+import os
+
+from flask import send_file
+
+import cache
+import tenants
+
+ARTIFACT_DIR = os.path.join("instance", "artifacts")
+ARTIFACT_TTL = 3600
+KEEP = 5
+DIGEST_LENGTH = 16
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def _files(name, ext, directory):
+    return glob.glob(os.path.join(directory, f"{name}-{'?' * DIGEST_LENGTH}.{ext}"))
+
+
+def _prune(name, ext, directory):
+    files = sorted(_files(name, ext, directory), key=os.path.getmtime, reverse=True)
+    for path in files[KEEP:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def write(name, ext, data, directory=None):
+    """Store ``data`` as a build of ``name``; returns its absolute path."""
+    directory = directory or tenants.scoped_path(ARTIFACT_DIR)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    digest = hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]
+    path = os.path.abspath(os.path.join(directory, f"{name}-{digest}.{ext}"))
+    # Same content as an earlier build: keep that file, its mtime and ETag
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    _prune(name, ext, directory)
+    return path
+
+
+def build(name, ext, builder, depends=(), key=""):
+    """Path of the current build of an artifact.
+
+    ``builder()`` returns the file's bytes and is only called when nothing
+    was built since ``depends`` last changed. ``key`` separates variants that
+    share the same data (e.g. the day a report covers).
+    """
+    def produce():
+        return write(name, ext, builder())
+
+    path = cache.get_or_set(f"artifact:{name}:{key}", produce, ARTIFACT_TTL, depends)
+    if not os.path.exists(path):
+        # Pruned by newer builds from another worker
+        path = produce()
+    return path
+
+
+def send(path, download_name):
+    """Download response for an artifact with ETag, Last-Modified and Range."""
+    response = send_file(
+        path,
+        mimetype=MIMETYPES[path.rsplit(".", 1)[1]],
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+    )
+    # Exports hold prices and sales, so only the user's browser may keep a copy
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,271 @@
+"""ASGI entry point: async till endpoints in front of the Flask app.
+
+``/get_product_by_code`` and ``/process_checkout`` are served by asyncio
+handlers on an aiomysql pool, so a worker keeps serving other tills while
+one waits on MySQL. ``/low_stock/stream`` (server-sent events) is served
+here too, so an open stream is a coroutine instead of a blocked worker. Every other path falls through to the unchanged Flask
+app. The handlers accept the same JSON, return the same responses and
+honour the same server-side login session as the Flask routes, and build bills from the
+shared ``checkout`` helpers.
+
+    uvicorn asgi:app --workers 4
+
+``python app.py`` and gunicorn keep serving the plain Flask versions. With a
+tenant directory (``tenants.py``) each tenant gets its own aiomysql pool,
+opened on its first request.
+"""
+import asyncio
+import contextlib
+import os
+from datetime import datetime
+
+import aiomysql
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import alerts
+import cache
+import checkout
+import db
+import events
+import gst
+import promotions
+import sessions
+import tenants
+import valuation
+from app import create_app
+
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = int(os.environ.get("ASYNC_DB_POOL_SIZE", 20))
+
+flask_app = create_app()
+pools = {}  # tenant slug (None when single-tenant) -> aiomysql pool
+pools_lock = None
+
+
+async def open_pool(config):
+    return await aiomysql.create_pool(
+        host=config["host"],
+        port=config.get("port", 3306),
+        user=config["user"],
+        password=config["password"],
+        db=config["database"],
+        minsize=POOL_MIN_SIZE,
+        maxsize=POOL_MAX_SIZE,
+        autocommit=False,
+    )
+
+
+async def get_pool(tenant):
+    key = tenant and tenant.slug
+    if key not in pools:
+        async with pools_lock:
+            if key not in pools:
+                pools[key] = await open_pool(db.DB_CONFIG if tenant is None else tenant.config)
+    return pools[key]
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global pools_lock
+    pools_lock = asyncio.Lock()
+    if not tenants.enabled():
+        await get_pool(None)
+    try:
+        yield
+    finally:
+        for pool in pools.values():
+            pool.close()
+            await pool.wait_closed()
+        pools.clear()
+
+
+# -----------------------
+# SESSION
+# -----------------------
+def flask_session(request):
+    """``(session, tenant)`` for the request's login cookie; ``({}, None)`` if not logged in.
+
+    Deactivated users get ``{}``; role and store changes are applied as in
+    the Flask ``login_required`` check. A session is only valid on its own
+    tenant's host names.
+    """
+    data = sessions.interface.load(request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"]))
+    if not data or "user_id" not in data:
+        return {}, None
+    tenant = None
+    if tenants.enabled():
+        tenant = tenants.resolve(request.headers.get("host"), None, data.get("tenant"))
+        if tenant is None or data.get("tenant") != tenant.slug:
+            return {}, None
+    if not tenants.run_for(tenant, sessions.current_user, data):
+        return {}, None
+    return data, tenant
+
+
+def _unauthorized():
+    return JSONResponse({"success": False, "message": "Please login first"}, status_code=401)
+
+
+# -----------------------
+# TILL ENDPOINTS
+# -----------------------
+async def get_product_by_code(request):
+    # Session store and user lookups are blocking; keep them off the loop
+    session, tenant = await asyncio.to_thread(flask_session, request)
+    if "user_id" not in session:
+        return _unauthorized()
+    data = await request.json()
+    product_code = (data.get("product_code") or "").strip().upper()
+    if not product_code:
+        return JSONResponse({"error": "Product code is required"}, status_code=400)
+
+    pool = await get_pool(tenant)
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(db.SQL_PRODUCT_BY_CODE_IN_STOCK, (product_code,))
+            row = await cur.fetchone()
+        await conn.commit()  # end the read snapshot before the connection goes back
+
+    if not row:
+        return JSONResponse({"error": "Product not found or out of stock"}, status_code=404)
+    product = db.Product(*row)
+    return JSONResponse({
+        "id": product.id,
+        "name": product.name,
+        "price": float(product.price),
+        "gst": float(product.gst),
+        "stock": product.stock,
+    })
+
+
+async def _place_order(cur, cart, discount, payment_mode, user_id, store_id):
+    """All checkout writes on one transaction; returns ``(bill_no, total)``."""
+    totals = checkout.cart_totals(cart, discount)
+    subtotal, gst_total, total = totals
+    bill_discount = discount + checkout.promotion_total(cart)
+    now = datetime.now()
+    bill_no = checkout.bill_number(now, user_id)
+    changes = checkout.stock_changes(cart)
+    ids = sorted(changes)
+
+    # Lock every product in id order up front, so concurrent tills selling
+    # the same items queue instead of deadlocking or overselling
+    await cur.execute(f"SELECT id, stock FROM products WHERE id IN ({db.in_clause(ids)}) ORDER BY id FOR UPDATE", ids)
+    remaining = dict(await cur.fetchall())
+    stock_after = []
+    for item in cart:
+        product_id = int(item["id"])
+        if remaining.get(product_id, 0) < item["qty"]:
+            raise ValueError(f"Insufficient stock for {item['name']}")
+        remaining[product_id] -= item["qty"]
+        stock_after.append(remaining[product_id])
+
+    await cur.execute(checkout.SQL_INSERT_BILL,
+                      (bill_no, total, bill_discount, payment_mode, now, user_id, subtotal, gst_total))
+    bill_id = cur.lastrowid
+    await cur.executemany(checkout.SQL_INSERT_ITEM, [checkout.item_row(bill_id, item) for item in cart])
+    await cur.executemany(gst.SQL_INSERT_ENTRY, checkout.gst_rows(bill_id, cart, now, store_id))
+    await cur.executemany("UPDATE products SET stock = stock + %s WHERE id = %s",
+                          [(change, product_id) for product_id, change in changes.items()])
+    await cur.executemany(checkout.SQL_INSERT_MOVEMENT,
+                          [(item["id"], -item["qty"], bill_id, user_id) for item in cart])
+
+    outbox = checkout.sale_events(bill_id, bill_no, cart, totals, bill_discount, payment_mode,
+                                  user_id, store_id, stock_after)
+    await cur.execute(alerts.SQL_CROSSING_PRODUCTS.format(ids=db.in_clause(ids)), ids)
+    outbox += alerts.crossings(await cur.fetchall(), changes=changes)
+    await cur.executemany(events.SQL_RECORD, events.outbox_rows(outbox))
+
+    moves = checkout.valuation_moves(cart, bill_id)
+    await cur.execute(valuation.SQL_LOCK_STATES.format(ids=db.in_clause(ids)), ids)
+    states = valuation.states_from_rows(await cur.fetchall())
+    missing = [product_id for product_id in ids if product_id not in states]
+    if missing:
+        await cur.execute(valuation.SQL_PRODUCT_COSTS.format(ids=db.in_clause(missing)), missing)
+        valuation.add_missing_states(states, moves, await cur.fetchall())
+    valued = valuation.apply(states, moves, user_id, store_id, revenue=subtotal - bill_discount)
+    await cur.executemany(valuation.SQL_INSERT_LEDGER, valued.ledger_rows)
+    await cur.executemany(valuation.SQL_SAVE_STATES, valued.state_rows)
+    await cur.execute(valuation.SQL_ADD_DAILY, valued.daily_params)
+
+    await cur.execute(
+        "INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)",
+        (user_id, "Create Bill", f"Created bill {bill_no} with total ₹{round(total, 2)}")
+    )
+    return bill_no, total
+
+
+def _after_commit():
+    cache.invalidate("bills", "products", "stock", "valuation")
+    events.dispatch_pending()
+
+
+async def process_checkout(request):
+    session, tenant = await asyncio.to_thread(flask_session, request)
+    if "user_id" not in session:
+        return _unauthorized()
+    data = await request.json()
+    cart = data.get("cart", [])
+    discount = float(data.get("discount", 0))
+    payment_mode = data.get("payment_mode", "Cash")
+    if not cart:
+        return JSONResponse({"success": False, "message": "Cart is empty"}, status_code=400)
+
+    # Compiled promotions are cached; a rebuild reads MySQL, so off the loop
+    try:
+        index = await asyncio.to_thread(tenants.run_for, tenant, promotions.current_index)
+    except promotions.Unavailable as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=503)
+    index.apply(cart)
+
+    pool = await get_pool(tenant)
+    async with pool.acquire() as conn:
+        try:
+            async with conn.cursor() as cur:
+                bill_no, total = await _place_order(
+                    cur, cart, discount, payment_mode, session["user_id"], session.get("store_id"))
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            return JSONResponse({"success": False, "message": str(e)}, status_code=500)
+
+    # Cache invalidation and outbox delivery are blocking; keep them off the loop
+    asyncio.get_running_loop().run_in_executor(None, tenants.run_for, tenant, _after_commit)
+    return JSONResponse({"success": True, "bill_number": bill_no, "total": round(total, 2)})
+
+
+# -----------------------
+# LOW-STOCK ALERTS
+# -----------------------
+async def low_stock_stream(request):
+    """Server-sent events: current low-stock set, then live crossings."""
+    session, tenant = await asyncio.to_thread(flask_session, request)
+    if "user_id" not in session:
+        return _unauthorized()
+    position = alerts.parse_last_event_id(request.headers.get("last-event-id"))
+
+    pool = await get_pool(tenant)
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(alerts.SQL_LOW_STOCK)
+            rows = await cur.fetchall()
+        await conn.commit()
+    snapshot = alerts.snapshot_payload([alerts.LowStockItem(*row) for row in rows])
+
+    path = tenants.run_for(tenant, events.log_path)
+    return StreamingResponse(alerts.astream(snapshot, position, path), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+app = Starlette(
+    routes=[
+        Route("/get_product_by_code", get_product_by_code, methods=["POST"]),
+        Route("/process_checkout", process_checkout, methods=["POST"]),
+        Route("/low_stock/stream", low_stock_stream),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,102 @@
+"""Content-hashed, precompressed static assets with far-future caching.
+
+``init_app()`` copies every ``.js`` and ``.css`` file under ``static/`` to
+``instance/assets`` as ``<name>.<hash>.<ext>``, together with ``.gz`` and
+(when brotli is installed) ``.br`` versions compressed at the highest level.
+Files are only written when their content hash is new, so restarts are
+cheap. Templates link assets with ``asset_url("js/billing.js")``; the URL
+changes whenever the file does, so ``/assets/...`` responses can be cached
+for a year and marked ``immutable``. Browsers then load the billing page's
+script, styles and scanner library from cache on every visit but the first.
+"""
+import hashlib
+import mimetypes
+import os
+
+from flask import abort, request, send_file, url_for
+from werkzeug.security import safe_join
+
+import compression
+
+ASSET_DIR = os.path.join("instance", "assets")
+ASSET_EXTENSIONS = (".js", ".css")
+MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 12
+
+manifest = {}
+directory = os.path.abspath(ASSET_DIR)
+
+
+def _write(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(static_folder, target=None):
+    """Hash and precompress static assets; returns ``{source: hashed name}``."""
+    target = target or ASSET_DIR
+    built = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            if not name.endswith(ASSET_EXTENSIONS):
+                continue
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_folder).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(relative)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+            path = os.path.join(target, hashed)
+            if not os.path.exists(path):
+                folder = os.path.dirname(path)
+                if not os.path.exists(folder):
+                    os.makedirs(folder)
+                _write(path + ".gz", compression.encode(data, "gzip", best=True))
+                if compression.brotli is not None:
+                    _write(path + ".br", compression.encode(data, "br", best=True))
+                # Written last: its presence means the variants are complete
+                _write(path, data)
+            built[relative] = hashed
+    return built
+
+
+def asset_url(filename):
+    """Cache-busting URL for a file under ``static/``."""
+    hashed = manifest.get(filename)
+    if hashed is None:
+        return url_for("static", filename=filename)
+    return url_for("asset", filename=hashed)
+
+
+def serve(filename):
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    encoding = compression.choose(request.accept_encodings)
+    suffix = {"br": ".br", "gzip": ".gz"}.get(encoding)
+    if suffix and os.path.isfile(path + suffix):
+        response = send_file(path + suffix, mimetype=mimetype, conditional=True, max_age=MAX_AGE)
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, max_age=MAX_AGE)
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    global manifest, directory
+    directory = os.path.abspath(app.config.get("ASSET_DIR", ASSET_DIR))
+    try:
+        manifest = build(app.static_folder, directory)
+    except OSError as e:
+        # Fall back to plain /static URLs rather than failing to start
+        print(f"Error building static assets: {e}")
+        manifest = {}
+    if "asset" not in app.view_functions:
+        app.add_url_rule("/assets/<path:filename>", "asset", serve)
+        app.jinja_env.globals["asset_url"] = asset_url
@@ -0,0 +1,111 @@
+"""Cost of pricing a basket against thousands of active promotions.
+
+Run from the project root (no database needed)::
+
+    python benchmarks/promotions_eval.py --rules 1000 5000 20000 --lines 50
+
+Builds a random catalog and rule set (BOGO, quantity slabs, product and
+category percent-off, some limited to a daily time window), then times
+``PromotionIndex.apply`` on 50-line baskets against a naive evaluator that
+checks every rule for every line. Both must agree on every basket.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import promotions  # noqa: E402
+
+CATEGORIES = [f"cat{i}" for i in range(50)]
+
+
+def make_rules(count, products, rng):
+    rules = []
+    for rule_id in range(1, count + 1):
+        kind = rng.choice([promotions.BOGO, promotions.SLAB, promotions.SLAB, promotions.PERCENT])
+        category = None
+        product_id = rng.randrange(1, products + 1)
+        if kind == promotions.PERCENT and rng.random() < 0.1:
+            product_id, category = None, rng.choice(CATEGORIES)
+        window = rng.random() < 0.2
+        rules.append(promotions.Rule(
+            id=rule_id, name=f"rule {rule_id}", kind=kind, product_id=product_id, category=category,
+            buy_qty=rng.randint(1, 3), free_qty=1, min_qty=rng.randint(1, 6), percent=rng.choice([5, 10, 15, 20]),
+            starts_at=None, ends_at=None,
+            daily_from=timedelta(hours=17) if window else None, daily_to=timedelta(hours=19) if window else None,
+        ))
+    return [promotions.compile_rule(rule) for rule in rules]
+
+
+def naive_apply(rules, categories, cart, now):
+    """O(lines x rules) reference: scan every rule for every product."""
+    quantities, prices = {}, {}
+    for item in cart:
+        quantities[item["id"]] = quantities.get(item["id"], 0) + item["qty"]
+        prices.setdefault(item["id"], item["price"])
+    total = 0
+    for product_id, qty in quantities.items():
+        best = 0
+        for rule in rules:
+            applies = rule.product_id == product_id or (
+                rule.product_id is None and rule.category == categories[product_id])
+            if applies and promotions.is_live(rule, now):
+                best = max(best, promotions.rule_discount(rule, prices[product_id], qty))
+        total += round(best, 2)
+    return round(total, 2)
+
+
+def make_baskets(count, lines, products, rng):
+    return [[
+        {"id": rng.randrange(1, products + 1), "price": rng.choice([10.0, 25.0, 60.0, 120.0]),
+         "qty": rng.randint(1, 6), "gst": 5.0}
+        for _ in range(lines)
+    ] for _ in range(count)]
+
+
+def timed(fn, baskets):
+    timings = []
+    results = []
+    for basket in baskets:
+        started = time.perf_counter()
+        results.append(fn(basket))
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1e6, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--lines", type=int, default=50)
+    parser.add_argument("--baskets", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    categories = {product_id: rng.choice(CATEGORIES) for product_id in range(1, args.products + 1)}
+    now = datetime.now().replace(hour=18, minute=0)  # inside the happy-hour windows
+    print(f"{args.products} products, {args.lines}-line baskets, median of {args.baskets}")
+    print(f"{'rules':>7} {'compile ms':>11} {'index us':>10} {'naive us':>10} {'speed-up':>9}")
+    for count in args.rules:
+        rules = make_rules(count, args.products, rng)
+        baskets = make_baskets(args.baskets, args.lines, args.products, rng)
+
+        started = time.perf_counter()
+        index = promotions.PromotionIndex(rules, categories.items())
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        indexed_us, indexed = timed(lambda basket: index.apply([dict(i) for i in basket], now), baskets)
+        naive_us, naive = timed(lambda basket: naive_apply(rules, categories, basket, now), baskets[:20])
+        mismatches = sum(abs(a - b) > 0.011 for a, b in zip(indexed, naive))
+        print(f"{count:>7} {compile_ms:>11.1f} {indexed_us:>10.0f} {naive_us:>10.0f} {naive_us / indexed_us:>8.0f}x"
+              + (f"  ({mismatches} mismatches!)" if mismatches else ""))
+
+
+if __name__ == "__main__":
+    main()
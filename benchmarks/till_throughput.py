@@ -0,0 +1,139 @@
+"""Concurrent-till throughput: sync Flask workers vs the async till API.
+
+Start the same code base twice against a *test* database (checkouts sell
+real stock), e.g.::
+
+    gunicorn -w 4 -b :8000 wsgi:app           # sync path
+    uvicorn asgi:app --workers 4 --port 8001  # async path
+
+then run::
+
+    python benchmarks/till_throughput.py --target sync=http://localhost:8000 \\
+        --target async=http://localhost:8001 --tills 200 --seconds 30 --code RICE100
+
+Every simulated till logs in, then loops: scan a product, and every
+``--checkout-every`` scans check out a one-line cart. Results are requests
+per second and latency percentiles per endpoint.
+
+``--login-burst N`` adds N threads that log in over and over for the whole
+run, to see how a shift-change login storm affects checkout latency.
+"""
+import argparse
+import http.cookiejar
+import json
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def login(base_url, username, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    body = urllib.parse.urlencode({"username": username, "password": password}).encode()
+    opener.open(base_url + "/", body, timeout=30).read()
+    return opener
+
+
+def post_json(opener, url, payload):
+    request = urllib.request.Request(url, json.dumps(payload).encode(), {"Content-Type": "application/json"})
+    with opener.open(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def till(base_url, args, deadline, results, lock):
+    opener = login(base_url, args.username, args.password)
+    latencies = {"scan": [], "checkout": []}
+    errors = 0
+    scans = 0
+    while time.time() < deadline:
+        try:
+            started = time.perf_counter()
+            product = post_json(opener, base_url + "/get_product_by_code", {"product_code": args.code})
+            latencies["scan"].append(time.perf_counter() - started)
+            scans += 1
+            if scans % args.checkout_every == 0:
+                cart = [{"id": product["id"], "name": product["name"], "price": product["price"],
+                         "gst": product["gst"], "qty": 1}]
+                started = time.perf_counter()
+                result = post_json(opener, base_url + "/process_checkout",
+                                   {"cart": cart, "discount": 0, "payment_mode": "Cash"})
+                latencies["checkout"].append(time.perf_counter() - started)
+                if not result.get("success"):
+                    errors += 1
+        except Exception:
+            errors += 1
+    with lock:
+        for name, values in latencies.items():
+            results[name].extend(values)
+        results["errors"] += errors
+
+
+def login_storm(base_url, args, deadline, results, lock):
+    latencies = []
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            login(base_url, args.username, args.password)
+        except Exception:
+            continue
+        latencies.append(time.perf_counter() - started)
+    with lock:
+        results["login"].extend(latencies)
+
+
+def run(label, base_url, args):
+    results = {"scan": [], "checkout": [], "login": [], "errors": 0}
+    lock = threading.Lock()
+    deadline = time.time() + args.seconds
+    threads = [threading.Thread(target=till, args=(base_url, args, deadline, results, lock))
+               for _ in range(args.tills)]
+    threads += [threading.Thread(target=login_storm, args=(base_url, args, deadline, results, lock))
+                for _ in range(args.login_burst)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"\n{label} ({base_url}), {args.tills} tills, {args.seconds}s")
+    for name in ("scan", "checkout", "login"):
+        values = results[name]
+        if name == "login" and not args.login_burst:
+            continue
+        if not values:
+            print(f"  {name:9s} no completed requests")
+            continue
+        print(f"  {name:9s} {len(values) / args.seconds:8.1f} req/s   "
+              f"p50 {statistics.median(values) * 1000:7.1f} ms   "
+              f"p95 {percentile(values, 0.95) * 1000:7.1f} ms   "
+              f"p99 {percentile(values, 0.99) * 1000:7.1f} ms")
+    print(f"  errors    {results['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", required=True, help="label=base_url, repeatable")
+    parser.add_argument("--tills", type=int, default=100)
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--code", default="RICE100", help="product code to scan and sell")
+    parser.add_argument("--checkout-every", type=int, default=5)
+    parser.add_argument("--login-burst", type=int, default=0, help="threads logging in continuously")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    args = parser.parse_args()
+
+    for target in args.target:
+        label, _, base_url = target.partition("=")
+        run(label, base_url.rstrip("/"), args)
+
+
+if __name__ == "__main__":
+    main()
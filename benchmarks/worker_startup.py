@@ -0,0 +1,135 @@
+"""Cold start and per-worker memory of the WSGI app.
+
+Two measurements (Linux, run from the project root)::
+
+    python benchmarks/worker_startup.py import --runs 5
+    python benchmarks/worker_startup.py gunicorn --workers 4
+
+``import`` times ``import wsgi`` in fresh interpreters and reports the
+resulting RSS, once as shipped and once with pandas imported up front (what
+every worker used to pay).
+
+``gunicorn`` starts ``gunicorn -w N wsgi:app`` with and without ``--preload``,
+waits until it answers HTTP, and reads each worker's RSS and PSS from
+``/proc``. PSS splits shared pages between the processes sharing them, so
+its total is the real memory cost of the worker set. The app must be able to
+start; no database is needed.
+"""
+import argparse
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+{preamble}
+import wsgi
+elapsed = time.perf_counter() - started
+rss = [line for line in open("/proc/self/status") if line.startswith("VmRSS")][0].split()[1]
+print(elapsed, rss)
+"""
+
+
+def measure_import(preamble, runs):
+    timings, rss = [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(preamble=preamble)],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        timings.append(float(out[-2]))
+        rss.append(int(out[-1]) / 1024)
+    return statistics.median(timings), statistics.median(rss)
+
+
+def run_import(args):
+    for label, preamble in (("lazy (as shipped)", ""), ("eager pandas", "import pandas")):
+        seconds, rss = measure_import(preamble, args.runs)
+        print(f"  {label:18s} import {seconds * 1000:7.0f} ms   RSS {rss:6.1f} MB")
+
+
+def children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_mb(pid):
+    """``(rss, pss)`` in MB from ``smaps_rollup``."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1]) / 1024
+    return values.get("Rss:", 0), values.get("Pss:", 0)
+
+
+def wait_ready(url, proc, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("gunicorn did not answer in time")
+
+
+def run_gunicorn(args):
+    for preload in (False, True):
+        cmd = ["gunicorn", "-w", str(args.workers), "-b", f"127.0.0.1:{args.port}", "wsgi:app"]
+        if preload:
+            cmd.insert(1, "--preload")
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(f"http://127.0.0.1:{args.port}/static/", proc)
+            ready = time.perf_counter() - started
+            # Let every worker finish booting before reading /proc
+            deadline = time.time() + 30
+            while len(children(proc.pid)) < args.workers and time.time() < deadline:
+                time.sleep(0.1)
+            time.sleep(args.settle)
+            workers = [memory_mb(pid) for pid in children(proc.pid)]
+            master = memory_mb(proc.pid)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+
+        label = "--preload" if preload else "no preload"
+        rss = [w[0] for w in workers]
+        pss = sum(w[1] for w in workers) + master[1]
+        print(f"  {label:10s} first response {ready * 1000:6.0f} ms   "
+              f"worker RSS {statistics.mean(rss):6.1f} MB avg   "
+              f"total PSS {pss:6.1f} MB ({len(workers)} workers + master)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["import", "gunicorn"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait before reading memory")
+    args = parser.parse_args()
+
+    if args.mode == "import":
+        run_import(args)
+    else:
+        run_gunicorn(args)
+
+
+if __name__ == "__main__":
+    main()
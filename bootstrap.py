@@ -0,0 +1,37 @@
+"""One-shot schema setup: tables, indexes, migrations and seed data.
+
+Run it once per deploy (and before the first start), not from every app
+worker::
+
+    python bootstrap.py
+
+With a tenant directory (``tenants.py``) it creates and migrates every
+tenant's database, ``--workers`` at a time (default 4), so a deploy takes
+about as long as the slowest tenant rather than the sum of all of them.
+``--tenant <slug>`` migrates a single tenant.
+"""
+import sys
+
+import tenants
+from app import init_database
+
+
+def option(name, default=None):
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+if __name__ == "__main__":
+    if not tenants.enabled():
+        sys.exit(0 if init_database() else 1)
+
+    slug = option("--tenant")
+    targets = [tenants.get(slug)] if slug else tenants.all_tenants()
+    if None in targets:
+        sys.exit(f"Unknown tenant {slug!r}")
+    results = tenants.migrate(init_database, targets, int(option("--workers", tenants.MIGRATE_WORKERS)))
+    failed = sorted(name for name, ok in results.items() if not ok)
+    print(f"Migrated {len(results) - len(failed)}/{len(results)} tenant(s)"
+          + (f"; failed: {', '.join(failed)}" if failed else ""))
+    sys.exit(1 if failed else 0)
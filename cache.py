@@ -0,0 +1,287 @@
+"""Response and fragment cache for read-heavy pages.
+
+Entries are invalidated by *namespace* rather than by key: every cached value
+records the version of the namespaces it was built from ("products", "bills",
+...), and write routes call ``invalidate()`` to bump those versions. Stale
+entries are then never looked up again and simply age out via their TTL.
+
+Two backends are available:
+
+* ``SQLiteCache`` (default) - a shared SQLite file so that every gunicorn
+  worker sees the same entries and, more importantly, the same namespace
+  versions.
+* ``MemoryCache`` - per-process dict, only for a single process (tests,
+  ``python app.py``); gunicorn refuses it with more than one worker.
+
+Select one with ``CACHE_BACKEND`` ("sqlite" or "memory") and ``CACHE_PATH``
+in the app config. Keys and namespaces are prefixed with the current tenant
+(``tenants.scope``), so tenants never see or invalidate each other's pages.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request, session
+
+import tenants
+
+DEFAULT_TTL = 60
+
+
+# -----------------------
+# BACKENDS
+# -----------------------
+class MemoryCache:
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def versions(self, names):
+        with self._lock:
+            return tuple(self._versions.get(name, 0) for name in names)
+
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._versions.clear()
+
+
+class SQLiteCache:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                expires REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        # A connection opened before a fork (gunicorn --preload) must not be
+        # used by the worker, so connections are per process and thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, expires FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.delete(key)
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        expires = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires)
+        )
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def versions(self, names):
+        rows = dict(self._conn().execute(
+            f"SELECT name, version FROM cache_versions WHERE name IN ({', '.join('?' * len(names))})",
+            tuple(names)
+        ).fetchall()) if names else {}
+        return tuple(rows.get(name, 0) for name in names)
+
+    def bump(self, names):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for name in names:
+                conn.execute("""
+                    INSERT INTO cache_versions (name, version) VALUES (?, 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1
+                """, (name,))
+            # Opportunistically drop expired rows so the file does not grow forever
+            conn.execute("DELETE FROM cache_entries WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache_entries")
+        conn.execute("DELETE FROM cache_versions")
+
+
+backend = MemoryCache()
+
+
+def init_app(app):
+    global backend
+    if app.config.get("CACHE_BACKEND", "sqlite") != "memory":
+        backend = SQLiteCache(app.config.get("CACHE_PATH", os.path.join("instance", "cache.sqlite3")))
+    else:
+        backend = MemoryCache(app.config.get("CACHE_MAX_ENTRIES", 2048))
+
+
+# -----------------------
+# INVALIDATION
+# -----------------------
+def invalidate(*namespaces):
+    """Mark everything built from these namespaces as stale."""
+    try:
+        backend.bump([tenants.scope(name) for name in namespaces])
+    except Exception as e:
+        print(f"Error invalidating cache: {e}")
+
+
+def versions(names):
+    """Current versions of the current tenant's namespaces."""
+    return backend.versions([tenants.scope(name) for name in names])
+
+
+def versioned_key(key, depends):
+    key = tenants.scope(key)
+    if not depends:
+        return key
+    return key + "|" + ",".join(f"{name}:{v}" for name, v in zip(depends, versions(depends)))
+
+
+# -----------------------
+# FRAGMENTS
+# -----------------------
+def get(key):
+    return backend.get(tenants.scope(key))
+
+
+def set(key, value, ttl=DEFAULT_TTL):
+    backend.set(tenants.scope(key), value, ttl)
+
+
+def delete(key):
+    backend.delete(tenants.scope(key))
+
+
+def get_or_set(key, producer, ttl=DEFAULT_TTL, depends=()):
+    """Return the cached value for ``key`` or build, store and return it."""
+    full_key = versioned_key(key, depends)
+    value = backend.get(full_key)
+    if value is None:
+        value = producer()
+        if value is not None:
+            backend.set(full_key, value, ttl)
+    return value
+
+
+# -----------------------
+# RESPONSES
+# -----------------------
+def _request_key(per_user):
+    parts = [
+        request.endpoint or "",
+        request.full_path,
+        f"role={session.get('role')}",
+        f"store={session.get('store_id')}",
+    ]
+    if per_user:
+        parts.append(f"user={session.get('user_id')}")
+    return "view:" + "|".join(parts)
+
+
+def _conditional(body, mimetype, etag):
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # Pages are per-role/per-store, so only the browser may keep a copy
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def cached_view(ttl=DEFAULT_TTL, depends=(), per_user=False):
+    """Cache a GET view's rendered HTML keyed by route, query, role and store.
+
+    Responses carry an ETag so browsers revalidate with If-None-Match and get
+    a 304 while the underlying namespaces are unchanged. Requests with pending
+    flash messages bypass the cache so messages are never stored or lost.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method != "GET" or session.get("_flashes"):
+                return f(*args, **kwargs)
+
+            key = versioned_key(_request_key(per_user), depends)
+            entry = backend.get(key)
+            if entry is not None:
+                return _conditional(*entry)
+
+            result = f(*args, **kwargs)
+            if isinstance(result, str):
+                body, mimetype = result.encode("utf-8"), "text/html"
+            elif isinstance(result, Response) and result.status_code == 200 and not result.is_streamed:
+                body, mimetype = result.get_data(), result.mimetype
+            else:
+                return result
+            # A flash raised while rendering (e.g. an error) must not be cached
+            if session.get("_flashes"):
+                return result
+
+            entry = (body, mimetype, hashlib.md5(body).hexdigest())
+            backend.set(key, entry, ttl)
+            return _conditional(*entry)
+        return decorated
+    return decorator
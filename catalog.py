@@ -0,0 +1,86 @@
+"""Catalog delta sync for till-side product caches.
+
+Every product row carries ``row_version``, a microsecond timestamp that MySQL
+sets on insert and on every update that changes the row (``ON UPDATE
+CURRENT_TIMESTAMP(6)``), so sales, purchases, GRNs, edits and imports all
+bump it without each route having to remember. Deleted products leave a
+tombstone in ``catalog_deletions``.
+
+``changes(conn, since)`` returns the products changed and deleted after
+version ``since`` plus the version to ask for next. A row's version is taken
+when its statement runs, not when its transaction commits, so each poll
+looks ``OVERLAP_SECONDS`` further back and re-sends rows changed in that
+window; tills apply rows as upserts, so repeats are harmless.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import db
+
+OVERLAP_SECONDS = 60
+EPOCH = datetime(1970, 1, 1)
+
+CatalogProduct = namedtuple("CatalogProduct", "id name price gst stock product_code")
+
+SQL_ALL = "SELECT id, name, price, gst, stock, product_code FROM products"
+SQL_CHANGED = f"{SQL_ALL} WHERE row_version > %s"
+SQL_DELETED = "SELECT product_id FROM catalog_deletions WHERE deleted_at > %s"
+SQL_RECORD_DELETION = """
+    INSERT INTO catalog_deletions (product_id) VALUES (%s)
+    ON DUPLICATE KEY UPDATE deleted_at = CURRENT_TIMESTAMP(6)
+"""
+
+
+def to_version(moment):
+    """Integer version (microseconds since the epoch, UTC) for a timestamp."""
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_version(version):
+    return EPOCH + timedelta(microseconds=version)
+
+
+def _as_json(product):
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": float(product.price),
+        "gst": float(product.gst),
+        "stock": product.stock,
+        "product_code": product.product_code,
+    }
+
+
+def changes(conn, since=0):
+    """``{"version", "full", "products", "deleted"}`` since version ``since``.
+
+    ``since=0`` returns the whole catalog with ``full`` set, telling the
+    till to drop what it had.
+    """
+    # Versions are UTC so they never jump with the server's time zone. The
+    # connection goes back to a pool that keeps session state, so the
+    # session's own zone is put back afterwards
+    cur = conn.cursor()
+    cur.execute("SELECT @@session.time_zone")
+    time_zone = cur.fetchone()[0]
+    try:
+        cur.execute("SET time_zone = '+00:00'")
+        cur.execute("SELECT NOW(6)")
+        version = to_version(cur.fetchone()[0])
+
+        if since <= 0:
+            products = db.query_all(conn, SQL_ALL, row_type=CatalogProduct)
+            deleted = []
+        else:
+            cutoff = from_version(since) - timedelta(seconds=OVERLAP_SECONDS)
+            products = db.query_all(conn, SQL_CHANGED, (cutoff,), CatalogProduct)
+            deleted = [row[0] for row in db.query_all(conn, SQL_DELETED, (cutoff,))]
+    finally:
+        cur.execute("SET time_zone = %s", (time_zone,))
+        cur.close()
+    return {
+        "version": version,
+        "full": since <= 0,
+        "products": [_as_json(p) for p in products],
+        "deleted": deleted,
+    }
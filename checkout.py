@@ -0,0 +1,127 @@
+"""Driver-independent pieces of a till checkout.
+
+Both the Flask route (``app.process_checkout``) and the async till API
+(``asgi.py``) build bills from the same cart maths, bill numbers and outbox
+payloads defined here, so the two paths cannot drift apart.
+
+Promotion discounts (``promotions.py``) arrive as ``item["discount"]`` on
+each line and come off the line before GST; the bill's ``discount`` column
+holds them plus the cashier's bill-level discount, so
+``total = subtotal + gst_total - discount`` still holds. The taxable value
+and tax per GST rate go to ``gst_entries`` (``gst.py``).
+"""
+from datetime import datetime
+
+import events
+import gst
+import valuation
+
+SQL_INSERT_BILL = """
+    INSERT INTO bills_new (bill_number, total, discount, payment_mode, bill_date, created_by, subtotal, gst_total)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_INSERT_ITEM = """
+    INSERT INTO bill_items (bill_id, product_id, product_name, quantity, price, gst, item_total, discount, promotion_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_INSERT_MOVEMENT = """
+    INSERT INTO stock_movements (product_id, change_qty, movement_type, reference_id, created_by)
+    VALUES (%s, %s, 'SALE', %s, %s)
+"""
+
+
+def line_total(item):
+    """Price x quantity less its promotion, plus GST, for one cart line."""
+    line = item["price"] * item["qty"] - item.get("discount", 0)
+    return line + line * item["gst"] / 100
+
+
+def promotion_total(cart):
+    return sum(item.get("discount", 0) for item in cart)
+
+
+def cart_totals(cart, discount=0):
+    """``(subtotal, gst_total, total)`` for a cart; ``discount`` is the bill-level discount."""
+    subtotal = 0
+    gst_total = 0
+    for item in cart:
+        item_subtotal = item["price"] * item["qty"]
+        subtotal += item_subtotal
+        gst_total += (item_subtotal - item.get("discount", 0)) * (item["gst"] / 100)
+    return subtotal, gst_total, subtotal - promotion_total(cart) + gst_total - discount
+
+
+def item_row(bill_id, item):
+    """``SQL_INSERT_ITEM`` parameters for a cart line."""
+    return (bill_id, item["id"], item["name"], item["qty"], item["price"], item["gst"], line_total(item),
+            item.get("discount", 0), item.get("promotion_id"))
+
+
+def gst_rows(bill_id, cart, when, store_id=None):
+    """``gst.SQL_INSERT_ENTRY`` parameters: the bill's taxable value and tax per GST rate."""
+    lines = []
+    for item in cart:
+        taxable = item["price"] * item["qty"] - item.get("discount", 0)
+        lines.append((item["gst"], taxable, taxable * item["gst"] / 100))
+    return gst.entry_rows(bill_id, gst.slabs(lines), when, store_id)
+
+
+def bill_number(now=None, user_id=None):
+    """``BILL<date and time to the microsecond>-<user id>``.
+
+    ``bill_number`` is unique, and many tills check out in the same second;
+    a collision would need one login to place two bills in one microsecond.
+    """
+    return f"BILL{(now or datetime.now()).strftime('%Y%m%d%H%M%S%f')}-{user_id or 0}"
+
+
+def stock_changes(cart):
+    """``{product_id: change_qty}`` with repeated products added up."""
+    changes = {}
+    for item in cart:
+        changes[int(item["id"])] = changes.get(int(item["id"]), 0) - item["qty"]
+    return changes
+
+
+def valuation_moves(cart, bill_id):
+    return [
+        valuation.Move(int(item["id"]), -item["qty"], movement_type="SALE", reference_id=bill_id)
+        for item in cart
+    ]
+
+
+def sale_events(bill_id, bill_no, cart, totals, discount, payment_mode, user_id, store_id, stock_after):
+    """Outbox events for a sale: ``sale.created`` then one ``stock.changed`` per line.
+
+    ``stock_after`` lists each line's product stock after that line.
+    """
+    subtotal, gst_total, total = totals
+    outbox = [(events.SALE_CREATED, bill_id, {
+        "bill_id": bill_id,
+        "bill_number": bill_no,
+        "total": total,
+        "subtotal": subtotal,
+        "gst_total": gst_total,
+        "discount": discount,
+        "payment_mode": payment_mode,
+        "created_by": user_id,
+        "store_id": store_id,
+        "items": [{
+            "product_id": item["id"],
+            "name": item["name"],
+            "qty": item["qty"],
+            "price": item["price"],
+            "gst": item["gst"],
+            "discount": item.get("discount", 0),
+            "promotion_id": item.get("promotion_id"),
+        } for item in cart],
+    })]
+    for item, stock in zip(cart, stock_after):
+        outbox.append((events.STOCK_CHANGED, item["id"], {
+            "product_id": item["id"],
+            "change_qty": -item["qty"],
+            "movement_type": "SALE",
+            "reference_id": bill_id,
+            "stock_after": stock,
+        }))
+    return outbox
@@ -0,0 +1,68 @@
+"""gzip/brotli compression for HTML, JSON and other text responses.
+
+Tills often sit on weak store Wi-Fi, and pages like billing and inventory
+are mostly repetitive markup that compresses 5-10x. ``init_app()`` adds an
+``after_request`` hook that compresses eligible responses with brotli when
+the client accepts it (and the ``brotli`` package is installed), otherwise
+gzip. Streamed responses and files sent with ``send_file`` are left alone;
+static assets are precompressed by ``assets.py`` instead.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE = {
+    "text/html",
+    "text/css",
+    "text/csv",
+    "text/plain",
+    "application/json",
+    "application/javascript",
+}
+MIN_SIZE = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def choose(accept_encodings):
+    """Best encoding the client accepts: ``"br"``, ``"gzip"`` or ``None``."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def encode(data, encoding, best=False):
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose(request.accept_encodings)
+    data = response.get_data()
+    if encoding is None or len(data) < MIN_SIZE:
+        return response
+    response.set_data(encode(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # The compressed body is a different byte sequence; a weak ETag still
+    # matches If-None-Match (compared weakly), so cached pages keep their 304s
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    if compress_response not in app.after_request_funcs.setdefault(None, []):
+        app.after_request(compress_response)
@@ -0,0 +1,568 @@
+"""Data-access layer: connections, prepared statements and compact row types.
+
+Routes in app.py call these helpers instead of building SQL with
+``cursor(dictionary=True)``. Connections come from a per-process pool, and
+statements run through server-side prepared cursors cached on the pooled
+connection, so each statement is prepared once per connection rather than
+once per request. Rows come back as namedtuples (attribute and positional
+access, no per-row dict).
+
+Heavy, staleness-tolerant reads (reports, analytics, history pages) use
+``get_read_connection()``, which prefers a read replica listed in
+``DB_REPLICAS`` and falls back to the primary.
+
+With a tenant directory (``tenants.py``) every connection goes to the
+current tenant's database, from that tenant's own pool.
+"""
+import itertools
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from contextvars import ContextVar
+from datetime import datetime, time
+from time import monotonic, sleep
+
+import mysql.connector
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+from mysql.connector.pooling import MySQLConnectionPool, PooledMySQLConnection
+
+# -----------------------
+# DB CONNECTION
+# -----------------------
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",  # Change this to your MySQL username
+    "password": "",  # Change this to your MySQL password
+    "database": "supermarket_saas",
+}
+
+
+# The tenant (tenants.Tenant) whose database requests and jobs use; None
+# means single-tenant DB_CONFIG. Set per request by tenants.init_app().
+current_tenant = ContextVar("current_tenant", default=None)
+
+# Per tenant (or DB_CONFIG) and process, so one busy chain cannot take every
+# connection. Larger than gunicorn's threads per worker, so a thread never
+# waits on the pool while every other thread holds a connection
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 12))
+POOL_WAIT_SECONDS = 5
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def current_config():
+    tenant = current_tenant.get()
+    return DB_CONFIG if tenant is None else tenant.config
+
+
+class _PooledConnection(PooledMySQLConnection):
+    """Goes back to the pool without ``reset_session()``, which would drop the
+    connection's prepared statements; an open transaction is rolled back."""
+
+    def close(self):
+        cnx, self._cnx = self._cnx, None
+        if cnx is None:
+            return
+        try:
+            cnx.rollback()
+        except Error:
+            cnx.disconnect()  # the pool reconnects it on next use
+        self._cnx_pool.add_connection(cnx)
+
+
+class _Pool(MySQLConnectionPool):
+    def get_connection(self):
+        pooled = super().get_connection()
+        cnx, pooled._cnx = pooled._cnx, None
+        return _PooledConnection(self, cnx)
+
+
+def _pool(key, config):
+    global _pools, _pools_pid
+    with _pools_lock:
+        # Pools hold sockets, which must not be shared with forked workers
+        if _pools_pid != os.getpid():
+            _pools, _pools_pid = {}, os.getpid()
+        pool = _pools.get(key)
+        if pool is None or pool.config != config:
+            pool = _pools[key] = _Pool(pool_name=f"db_{key}", pool_size=POOL_SIZE,
+                                       pool_reset_session=False, **config)
+            pool.config = config
+        return pool
+
+
+def _pooled_connection(key, config):
+    deadline = monotonic() + POOL_WAIT_SECONDS
+    while True:
+        try:
+            return _pool(key, config).get_connection()
+        except PoolError as e:
+            # Exhausted: wait for one of this tenant's own requests to finish
+            if "exhausted" not in str(e) or monotonic() > deadline:
+                raise
+            sleep(0.05)
+
+
+def get_db_connection():
+    tenant = current_tenant.get()
+    try:
+        if tenant is None:
+            return _pooled_connection("default", DB_CONFIG)
+        return _pooled_connection(f"tenant_{tenant.slug}", tenant.config)
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        return None
+
+
+def get_server_connection():
+    """Connection to the current database's server with no database selected,
+    for ``CREATE DATABASE``."""
+    config = dict(current_config())
+    database = config.pop("database")
+    try:
+        return mysql.connector.connect(**config), database
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        return None, database
+
+
+# -----------------------
+# READ REPLICAS
+# -----------------------
+# DB_REPLICAS="10.0.0.5,10.0.0.6:3307" - same user, password and database as
+# DB_CONFIG. Reads only go to a replica whose lag is within the caller's
+# max_lag; unreachable replicas are skipped for REPLICA_RETRY_SECONDS.
+REPLICA_MAX_LAG = int(os.environ.get("DB_REPLICA_MAX_LAG", 30))
+REPLICA_CONNECT_TIMEOUT = 2
+REPLICA_RETRY_SECONDS = 30
+LAG_CHECK_SECONDS = 5
+
+
+def parse_replicas(spec):
+    replicas = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        host, _, port = entry.partition(":")
+        replicas.append(dict(DB_CONFIG, host=host, port=int(port or 3306)))
+    return replicas
+
+
+REPLICAS = parse_replicas(os.environ.get("DB_REPLICAS", ""))
+_replica_state = {}
+_next_replica = itertools.count()
+
+
+def replica_lag(conn):
+    """Seconds behind the source; 0 for a standalone server, ``None`` if replication is stopped."""
+    cur = conn.cursor(dictionary=True)
+    try:
+        try:
+            cur.execute("SHOW REPLICA STATUS")
+        except Error:  # MySQL before 8.0.22
+            cur.execute("SHOW SLAVE STATUS")
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    if not rows:
+        # Not replicating at all, e.g. a second local instance standing in
+        # for a replica
+        return 0
+    row = rows[0]
+    return row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+
+
+def _connect_replica(config, max_lag):
+    state = _replica_state.setdefault((config["host"], config["port"], config["database"]),
+                                      {"down_until": 0, "checked": 0, "lag": None})
+    now = monotonic()
+    if state["down_until"] > now:
+        return None, state
+    lag_is_fresh = now - state["checked"] < LAG_CHECK_SECONDS
+    if lag_is_fresh and (state["lag"] is None or state["lag"] > max_lag):
+        return None, state
+
+    try:
+        conn = mysql.connector.connect(**config, connection_timeout=REPLICA_CONNECT_TIMEOUT)
+        if not lag_is_fresh:
+            state["lag"] = replica_lag(conn)
+            state["checked"] = now
+    except Error as e:
+        print(f"Replica {config['host']}:{config['port']} unavailable: {e}")
+        state["down_until"] = now + REPLICA_RETRY_SECONDS
+        return None, state
+    if state["lag"] is None or state["lag"] > max_lag:
+        conn.close()
+        return None, state
+    return conn, state
+
+
+def get_read_connection(max_lag=None):
+    """Connection for reads that tolerate ``max_lag`` seconds of staleness.
+
+    Tries the replicas (the current tenant's shard replicas, or
+    ``DB_REPLICAS``) round-robin and falls back to the primary when none is
+    configured, reachable or fresh enough. Never write through it.
+    """
+    max_lag = REPLICA_MAX_LAG if max_lag is None else max_lag
+    tenant = current_tenant.get()
+    replicas = REPLICAS if tenant is None else tenant.replicas
+    first = next(_next_replica)
+    for i in range(len(replicas)):
+        conn, _ = _connect_replica(replicas[(first + i) % len(replicas)], max_lag)
+        if conn is not None:
+            return conn
+    return get_db_connection()
+
+
+# -----------------------
+# ROW TYPES
+# -----------------------
+PRODUCT_COLUMNS = "id, name, price, gst, stock, product_code, cost_price, reorder_level, category"
+Product = namedtuple("Product", PRODUCT_COLUMNS)
+
+BILL_COLUMNS = "id, bill_number, total, discount, payment_mode, bill_date, created_by, subtotal, gst_total"
+Bill = namedtuple("Bill", BILL_COLUMNS)
+
+BILL_ITEM_COLUMNS = "id, bill_id, product_name, quantity, price, gst, item_total, product_id, discount, returned_qty"
+BillItem = namedtuple("BillItem", BILL_ITEM_COLUMNS)
+
+StockMovement = namedtuple(
+    "StockMovement",
+    "id product_id change_qty movement_type reference_id created_by created_at "
+    "username movement_description",
+)
+
+SalesStats = namedtuple("SalesStats", "bill_count total_sales total_discount")
+
+# -----------------------
+# STATEMENT CACHE
+# -----------------------
+# mysql-connector only skips the PREPARE round trip when the *same* string
+# object is executed again on a prepared cursor, so each connection keeps
+# one cursor per distinct SQL text and always re-executes the first string
+# object it saw for that text. The cache lives on the pooled MySQL
+# connection, not the wrapper handed to a request, so later requests reuse
+# it; a reconnect (new connection id) starts it afresh. Connections that are
+# not pooled (replicas, one-off server connections) are closed after one
+# request, where PREPARE + EXECUTE + close would cost more round trips than
+# a text query, so they get plain cursors.
+#
+# Pooled connections live for the whole worker, so each keeps at most
+# STATEMENT_CACHE_SIZE statements, least recently used first out; closing an
+# evicted cursor deallocates its statement on the server and keeps the total
+# well under max_prepared_stmt_count.
+BATCH_SIZE = 1000
+STATEMENT_CACHE_SIZE = 64
+# fetch_by_ids pads id lists to one of these lengths, so a handful of
+# statements serve every batch size
+IN_SIZES = (1, 10, 100)
+
+
+def prepared_cursor(conn, sql):
+    """Return ``(cursor, sql)`` for a cursor cached on ``conn``'s MySQL connection."""
+    cnx = conn._cnx if isinstance(conn, PooledMySQLConnection) else conn
+    connection_id = cnx.connection_id
+    if getattr(cnx, "_stmt_cache_id", None) != connection_id:
+        cnx._stmt_cache = OrderedDict()
+        cnx._stmt_cache_id = connection_id
+    cache = cnx._stmt_cache
+    entry = cache.get(sql)
+    if entry is not None:
+        cache.move_to_end(sql)
+        return entry
+    cursor = conn.cursor(prepared=True) if cnx is not conn else conn.cursor(buffered=True)
+    entry = cache[sql] = (cursor, sql)
+    while len(cache) > STATEMENT_CACHE_SIZE:
+        _, (evicted, _) = cache.popitem(last=False)
+        try:
+            evicted.close()
+        except Error:
+            pass
+    return entry
+
+
+def execute(conn, sql, params=()):
+    cur, sql = prepared_cursor(conn, sql)
+    cur.execute(sql, tuple(params))
+    return cur
+
+
+def query_all(conn, sql, params=(), row_type=None):
+    rows = execute(conn, sql, params).fetchall()
+    if row_type is None:
+        return rows
+    make = row_type._make
+    return [make(row) for row in rows]
+
+
+def query_one(conn, sql, params=(), row_type=None):
+    cur = execute(conn, sql, params)
+    row = cur.fetchone()
+    # Drain anything left so the cached cursor can be re-executed
+    cur.fetchall()
+    if row is None or row_type is None:
+        return row
+    return row_type._make(row)
+
+
+def iter_rows(conn, sql, params=(), row_type=None, batch_size=BATCH_SIZE):
+    """Stream a large result set in ``fetchmany`` batches.
+
+    Uses its own (uncached) text cursor so a half-consumed generator can
+    never block a cached statement on the same connection; a statement run
+    once gains nothing from being prepared.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, tuple(params))
+        make = row_type._make if row_type is not None else None
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield make(row) if make else row
+    finally:
+        cur.close()
+
+
+def in_clause(values):
+    """Placeholder list for ``IN (...)`` with ``len(values)`` parameters."""
+    return ", ".join(["%s"] * len(values))
+
+
+def values_table(rows, columns):
+    """Derived table ``SELECT %s AS a, %s AS b UNION ALL SELECT %s, %s ...``."""
+    first = "SELECT " + ", ".join(f"%s AS {c}" for c in columns)
+    rest = " UNION ALL SELECT " + ", ".join(["%s"] * len(columns))
+    sql = first + rest * (len(rows) - 1)
+    return sql, [v for row in rows for v in row]
+
+
+def fetch_by_ids(conn, sql_template, ids, row_type=None, batch_size=BATCH_SIZE):
+    """Bulk fetch rows for many ids with one ``IN (...)`` query per batch.
+
+    ``sql_template`` contains a single ``{ids}`` marker for the placeholder
+    list. Each batch is padded with its last id to the next of ``IN_SIZES``
+    (or ``batch_size``), so every batch shares one of a few SQL texts and
+    prepared statements; repeated ids in ``IN`` return no extra rows.
+    """
+    ids = list(ids)
+    sizes = [size for size in IN_SIZES if size < batch_size] + [batch_size]
+    rows = []
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        size = next(size for size in sizes if size >= len(chunk))
+        chunk += [chunk[-1]] * (size - len(chunk))
+        sql = sql_template.format(ids=in_clause(chunk))
+        rows.extend(query_all(conn, sql, chunk, row_type))
+    return rows
+
+
+# -----------------------
+# PRODUCTS
+# -----------------------
+SQL_PRODUCTS_ALL = f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY name"
+SQL_PRODUCTS_IN_STOCK = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE stock > 0 ORDER BY name"
+SQL_PRODUCT_BY_ID = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = %s"
+SQL_PRODUCT_BY_CODE_IN_STOCK = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE product_code = %s AND stock > 0"
+SQL_PRODUCTS_BY_IDS = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({{ids}})"
+
+
+def list_products(conn, in_stock_only=False):
+    sql = SQL_PRODUCTS_IN_STOCK if in_stock_only else SQL_PRODUCTS_ALL
+    return query_all(conn, sql, row_type=Product)
+
+
+def get_product(conn, product_id):
+    return query_one(conn, SQL_PRODUCT_BY_ID, (product_id,), Product)
+
+
+def get_product_by_code(conn, product_code):
+    return query_one(conn, SQL_PRODUCT_BY_CODE_IN_STOCK, (product_code,), Product)
+
+
+def get_products_by_ids(conn, product_ids):
+    """Map of product id -> Product for every id that exists."""
+    return {p.id: p for p in fetch_by_ids(conn, SQL_PRODUCTS_BY_IDS, product_ids, Product)}
+
+
+# -----------------------
+# BILLS
+# -----------------------
+SQL_BILL_BY_ID = f"SELECT {BILL_COLUMNS} FROM bills_new WHERE id = %s"
+SQL_BILL_ITEMS = f"SELECT {BILL_ITEM_COLUMNS} FROM bill_items WHERE bill_id = %s ORDER BY id"
+SQL_BILLS_BY_IDS = f"SELECT {BILL_COLUMNS} FROM bills_new WHERE id IN ({{ids}}) ORDER BY id"
+SQL_BILL_ITEMS_BY_BILL_IDS = f"SELECT {BILL_ITEM_COLUMNS} FROM bill_items WHERE bill_id IN ({{ids}}) ORDER BY bill_id, id"
+
+
+def get_bill(conn, bill_id):
+    return query_one(conn, SQL_BILL_BY_ID, (bill_id,), Bill)
+
+
+def get_bill_items(conn, bill_id):
+    return query_all(conn, SQL_BILL_ITEMS, (bill_id,), BillItem)
+
+
+SQL_BILLS_BY_DATE = f"""
+    SELECT {BILL_COLUMNS} FROM bills_new
+    WHERE bill_date >= %s AND bill_date < %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+
+def get_bills_with_items(conn, bill_ids=None, bills=None):
+    """Bulk load bills and their items: ``[(Bill, [BillItem, ...]), ...]``.
+
+    Pass either ``bill_ids`` or already loaded ``bills``; items for all of
+    them come from ``IN (...)`` queries rather than one query per bill.
+    """
+    if bills is None:
+        bills = fetch_by_ids(conn, SQL_BILLS_BY_IDS, bill_ids, Bill)
+    items_by_bill = {bill.id: [] for bill in bills}
+    for item in fetch_by_ids(conn, SQL_BILL_ITEMS_BY_BILL_IDS, items_by_bill, BillItem):
+        items_by_bill[item.bill_id].append(item)
+    return [(bill, items_by_bill[bill.id]) for bill in bills]
+
+
+def get_bills_between(conn, start, end, limit):
+    return query_all(conn, SQL_BILLS_BY_DATE, (start, end, limit), Bill)
+
+
+def sales_stats(conn, date_filter="1=1"):
+    """Bill count, sales and discount totals for a trusted ``WHERE`` fragment."""
+    row = query_one(conn, f"""
+        SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(discount), 0)
+        FROM bills_new
+        WHERE {date_filter}
+    """)
+    return SalesStats(row[0], float(row[1]), float(row[2]))
+
+
+# -----------------------
+# STOCK MOVEMENTS
+# -----------------------
+SQL_STOCK_MOVEMENTS = """
+    SELECT sm.id, sm.product_id, sm.change_qty, sm.movement_type, sm.reference_id,
+           sm.created_by, sm.created_at, u.username,
+           CASE
+               WHEN sm.movement_type = 'PURCHASE' THEN 'Purchase'
+               WHEN sm.movement_type = 'SALE' THEN 'Sale'
+               WHEN sm.movement_type = 'RETURN' THEN 'Return'
+               WHEN sm.movement_type = 'MANUAL' THEN 'Stock Added'
+               WHEN sm.movement_type = 'EDIT' THEN 'Stock Edit'
+               WHEN sm.movement_type = 'OPENING' THEN 'Opening Stock'
+               WHEN sm.movement_type = 'RECONCILE' THEN 'Reconciliation'
+               WHEN sm.movement_type = 'DAMAGE' THEN 'Damage'
+               WHEN sm.movement_type = 'EXPIRED' THEN 'Expired'
+               ELSE sm.movement_type
+           END AS movement_description
+    FROM stock_movements sm
+    JOIN users u ON sm.created_by = u.id
+    WHERE sm.product_id = %s AND sm.created_at >= %s
+    ORDER BY sm.created_at DESC
+"""
+
+
+def get_stock_movements(conn, product_id, since=None):
+    """Movements for a product, newest first, optionally from ``since`` on."""
+    since = datetime.combine(since, time.min) if since else datetime(1970, 1, 1)
+    return list(iter_rows(conn, SQL_STOCK_MOVEMENTS, (product_id, since), StockMovement))
+
+
+# -----------------------
+# INVENTORY SEARCH
+# -----------------------
+INVENTORY_SORTS = {
+    "name": "name",
+    "price": "price",
+    "stock": "stock",
+    "gst": "gst",
+    "id": "id",
+}
+INVENTORY_PAGE_SIZES = (25, 50, 100, 200)
+
+
+def search_products(conn, search="", min_stock=None, max_stock=None, gst=None,
+                    sort="name", direction="asc", page=1, per_page=50):
+    """One page of products plus the total match count.
+
+    Name and code matching is prefix-only (``LIKE 'abc%'``) so it can use the
+    unique indexes on ``name`` and ``product_code``; stock ranges and GST slab
+    use ``idx_products_stock`` and ``idx_products_gst_name``.
+    """
+    clauses = []
+    params = []
+    if search:
+        pattern = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        clauses.append("(name LIKE %s OR product_code LIKE %s)")
+        params += [pattern, pattern.upper()]
+    if min_stock is not None:
+        clauses.append("stock >= %s")
+        params.append(min_stock)
+    if max_stock is not None:
+        clauses.append("stock <= %s")
+        params.append(max_stock)
+    if gst is not None:
+        clauses.append("gst = %s")
+        params.append(gst)
+    where = " AND ".join(clauses) or "1=1"
+
+    column = INVENTORY_SORTS.get(sort, "name")
+    order = "DESC" if direction == "desc" else "ASC"
+    # id breaks ties so pages are stable when the sort column repeats
+    order_by = f"{column} {order}" if column == "id" else f"{column} {order}, id {order}"
+
+    total = query_one(conn, f"SELECT COUNT(*) FROM products WHERE {where}", params)[0]
+    rows = query_all(conn, f"""
+        SELECT {PRODUCT_COLUMNS} FROM products
+        WHERE {where}
+        ORDER BY {order_by}
+        LIMIT %s OFFSET %s
+    """, params + [per_page, (page - 1) * per_page], Product)
+    return rows, total
+
+
+def gst_slabs(conn):
+    return [row[0] for row in query_all(conn, "SELECT DISTINCT gst FROM products ORDER BY gst")]
+
+
+# -----------------------
+# SCHEMA HELPERS
+# -----------------------
+def ensure_index(cur, table, index_name, columns):
+    """``CREATE INDEX`` unless it already exists (MySQL has no IF NOT EXISTS)."""
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index_name))
+    if cur.fetchone()[0] == 0:
+        cur.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
+
+
+def ensure_column(cur, table, column, definition):
+    """``ALTER TABLE ... ADD COLUMN`` unless the column already exists."""
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    if cur.fetchone()[0] == 0:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+if __name__ == "__main__":
+    # Routing check: DB_REPLICAS=127.0.0.1:3307 python db.py
+    if not REPLICAS:
+        print("No replicas configured (set DB_REPLICAS); reads use the primary")
+        sys.exit(0)
+    for config in REPLICAS:
+        conn, state = _connect_replica(config, REPLICA_MAX_LAG)
+        if conn is None:
+            reason = "unreachable" if state["down_until"] else f"lag {state['lag']}"
+            print(f"{config['host']}:{config['port']}  skipped ({reason})")
+        else:
+            print(f"{config['host']}:{config['port']}  ok, lag {state['lag']}s")
+            conn.close()
@@ -0,0 +1,342 @@
+"""Transactional outbox for sales and stock changes.
+
+Write routes call ``record()`` with their own cursor *before* committing, so an
+event exists if and only if the change it describes was committed. After the
+commit, ``dispatch_pending()`` moves undelivered events, in id order, to:
+
+* in-process subscribers registered with ``subscribe()``, and
+* an append-only NDJSON log (``EVENT_LOG_PATH``) where each line carries a
+  gap-free, strictly increasing ``offset``, so consumers can resume with
+  ``consume()`` instead of re-querying ``bills_new`` / ``stock_movements``.
+
+In-process subscribers are best-effort (at-least-once across crashes); the
+log is the durable stream.
+
+Run ``python events.py`` to keep dispatching in the background, e.g. to catch
+events whose request-time dispatch was skipped. Each tenant has its own log
+and consumer checkpoints (``log_path()``); run the dispatcher per tenant
+with ``python tenants.py run <slug> events``.
+"""
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+import db
+import tenants
+from db import get_db_connection
+
+EVENT_LOG_PATH = os.path.join("instance", "events.ndjson")
+OFFSETS_DIR = os.path.join("instance", "event_offsets")
+DISPATCH_BATCH = 500
+DISPATCH_LOCK = "supermarket_outbox_dispatch"
+
+SALE_CREATED = "sale.created"
+SALE_RETURNED = "sale.returned"
+PURCHASE_CREATED = "purchase.created"
+STOCK_CHANGED = "stock.changed"
+STOCK_LOW = "stock.low"
+STOCK_RESTORED = "stock.restored"
+
+_subscribers = defaultdict(list)
+
+
+def log_path():
+    """The current tenant's event log."""
+    return tenants.scoped_path(EVENT_LOG_PATH)
+
+
+def _offsets_dir():
+    return tenants.scoped_path(OFFSETS_DIR)
+
+
+def _dispatch_lock():
+    # GET_LOCK is server-wide; tenants sharing a shard each get their own
+    if tenants.current() is None:
+        return DISPATCH_LOCK
+    return f"outbox:{db.current_config()['database']}"
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return json.dumps(value, default=_default, separators=(",", ":"))
+
+
+# -----------------------
+# WRITE SIDE
+# -----------------------
+SQL_RECORD = "INSERT INTO outbox_events (event_type, aggregate_id, payload) VALUES (%s, %s, %s)"
+
+
+def outbox_rows(events):
+    """``SQL_RECORD`` parameters for ``(event_type, aggregate_id, payload)`` tuples."""
+    return [(event_type, aggregate_id, dumps(payload)) for event_type, aggregate_id, payload in events]
+
+
+def record(cur, event_type, aggregate_id, payload):
+    """Queue one event on the caller's transaction."""
+    cur.execute(SQL_RECORD, (event_type, aggregate_id, dumps(payload)))
+
+
+def record_many(cur, events):
+    """Queue ``(event_type, aggregate_id, payload)`` tuples in one statement."""
+    if not events:
+        return
+    cur.executemany(SQL_RECORD, outbox_rows(events))
+
+
+# -----------------------
+# DISPATCH
+# -----------------------
+def subscribe(event_type, handler=None):
+    """Register ``handler(event)`` for an event type, or ``"*"`` for all.
+
+    Usable as a decorator: ``@events.subscribe(events.STOCK_CHANGED)``.
+    """
+    if handler is None:
+        def decorator(f):
+            _subscribers[event_type].append(f)
+            return f
+        return decorator
+    _subscribers[event_type].append(handler)
+    return handler
+
+
+def _notify(event):
+    for handler in _subscribers.get(event["type"], []) + _subscribers.get("*", []):
+        try:
+            handler(event)
+        except Exception as e:
+            print(f"Error in event subscriber {getattr(handler, '__name__', handler)}: {e}")
+
+
+def _drop_partial_line(path):
+    """Trim a half-written last line left behind by a crash mid-append."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+
+def _append_log(events, path=None):
+    path = path or log_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    _drop_partial_line(path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(dumps(event) + "\n" for event in events))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def last_logged_offset(path=None):
+    """Offset of the last complete line in the log (0 if empty)."""
+    path = path or log_path()
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        chunk = 4096
+        while True:
+            start = max(size - chunk, 0)
+            f.seek(start)
+            lines = f.read(size - start).split(b"\n")
+            # lines[-1] is the (possibly partial) text after the last newline
+            complete = [line for line in lines[:-1] if line.strip()]
+            if complete and (len(complete) > 1 or start == 0):
+                return json.loads(complete[-1])["offset"]
+            if start == 0:
+                return 0
+            chunk *= 2
+
+
+EVENT_COLUMNS = "id, event_type, aggregate_id, payload, created_at, log_offset"
+
+
+def _to_event(row, offset=None):
+    payload = row[3]
+    return {
+        "offset": offset if offset is not None else row[5],
+        "event_id": row[0],
+        "type": row[1],
+        "aggregate_id": row[2],
+        "data": json.loads(payload),
+        "created_at": row[4],
+    }
+
+
+def dispatch_pending(conn=None, batch_size=DISPATCH_BATCH):
+    """Deliver undispatched outbox rows; returns how many were delivered.
+
+    Log offsets are assigned here, in dispatch order, and saved on the
+    outbox row in the same commit that marks it dispatched. The log is then
+    a replay of rows ordered by ``log_offset``: if a crash lost the append,
+    the next run re-appends every row above the log's last offset, so the
+    log never has gaps or duplicate offsets.
+
+    A MySQL advisory lock keeps a single dispatcher at a time across all
+    workers. If another worker holds it, this call returns immediately and
+    that worker (or the background loop) picks our rows up.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if not conn:
+            return 0
+    cur = conn.cursor()
+    delivered = 0
+    try:
+        lock = _dispatch_lock()
+        cur.execute("SELECT GET_LOCK(%s, 0)", (lock,))
+        if cur.fetchone()[0] != 1:
+            return 0
+        try:
+            # Recover rows that were committed as dispatched but never logged
+            cur.execute(f"""
+                SELECT {EVENT_COLUMNS} FROM outbox_events
+                WHERE log_offset > %s
+                ORDER BY log_offset
+            """, (last_logged_offset(),))
+            missing = [_to_event(row) for row in cur.fetchall()]
+            if missing:
+                _append_log(missing)
+                for event in missing:
+                    _notify(event)
+                delivered += len(missing)
+
+            cur.execute("SELECT COALESCE(MAX(log_offset), 0) FROM outbox_events")
+            next_offset = cur.fetchone()[0] + 1
+            while True:
+                cur.execute(f"""
+                    SELECT {EVENT_COLUMNS} FROM outbox_events
+                    WHERE dispatched_at IS NULL
+                    ORDER BY id
+                    LIMIT %s
+                """, (batch_size,))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                batch = [_to_event(row, next_offset + i) for i, row in enumerate(rows)]
+                next_offset += len(batch)
+
+                cases = " ".join(["WHEN %s THEN %s"] * len(batch))
+                params = [v for event in batch for v in (event["event_id"], event["offset"])]
+                ids = [event["event_id"] for event in batch]
+                cur.execute(f"""
+                    UPDATE outbox_events
+                    SET log_offset = CASE id {cases} END, dispatched_at = NOW()
+                    WHERE id IN ({', '.join(['%s'] * len(ids))})
+                """, params + ids)
+                conn.commit()
+
+                _append_log(batch)
+                for event in batch:
+                    _notify(event)
+                delivered += len(batch)
+                if len(rows) < batch_size:
+                    break
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (lock,))
+            cur.fetchall()
+    except Exception as e:
+        print(f"Error dispatching events: {e}")
+    finally:
+        if own_conn:
+            conn.close()
+    return delivered
+
+
+# -----------------------
+# CONSUMERS
+# -----------------------
+def _checkpoint_path(consumer):
+    return os.path.join(_offsets_dir(), f"{consumer}.json")
+
+
+def load_checkpoint(consumer):
+    try:
+        with open(_checkpoint_path(consumer), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"position": 0, "offset": 0}
+
+
+def save_checkpoint(consumer, checkpoint):
+    directory = _offsets_dir()
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp = _checkpoint_path(consumer) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, _checkpoint_path(consumer))
+
+
+def read_log(position=0, path=None, limit=None):
+    """Yield ``(event, next_position)`` from a byte position in the log."""
+    path = path or log_path()
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        f.seek(position)
+        count = 0
+        for line in iter(f.readline, b""):
+            if not line.endswith(b"\n"):
+                break  # partially written line; pick it up next time
+            yield json.loads(line), f.tell()
+            count += 1
+            if limit is not None and count >= limit:
+                break
+
+
+def consume(consumer, handler, limit=None, path=None):
+    """Feed new log events to ``handler`` and persist the consumer's place.
+
+    Returns the number of events handled. Events at or below the last
+    handled offset are skipped, so a lost checkpoint write only replays.
+    """
+    checkpoint = load_checkpoint(consumer)
+    handled = 0
+    try:
+        for event, position in read_log(checkpoint["position"], path, limit):
+            if event["offset"] > checkpoint["offset"]:
+                handler(event)
+                checkpoint["offset"] = event["offset"]
+                handled += 1
+            checkpoint["position"] = position
+    finally:
+        save_checkpoint(consumer, checkpoint)
+    return handled
+
+
+if __name__ == "__main__":
+    print("Dispatching outbox events (Ctrl+C to stop)...")
+    while True:
+        if not dispatch_pending():
+            time.sleep(1)
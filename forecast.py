@@ -0,0 +1,215 @@
+"""Demand forecasting and reorder suggestions from SALE stock movements.
+
+The job reads the last ``WINDOW_DAYS`` of SALE (and RETURN) movements in
+keyset-paginated chunks and folds each chunk into a dense ``products x days``
+NumPy matrix of units sold, net of returns. Moving averages, an exponentially weighted sales velocity, days
+of cover and a suggested purchase quantity are then computed for every
+product at once and written to ``reorder_suggestions``, which the
+``/reorder_suggestions`` page and ``add_purchase`` read.
+
+Memory is bounded by ``MEMORY_BUDGET_BYTES`` regardless of how many movement
+rows exist: each fetched chunk is at most ``CHUNK_ROWS`` rows, and when the
+sales matrix for all products would not fit in the budget, products are
+processed in id blocks that do.
+
+Run ``python forecast.py`` to refresh every ``REFRESH_SECONDS`` in the
+background, or ``python forecast.py --once`` from cron.
+"""
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import db
+from db import get_db_connection
+
+WINDOW_DAYS = 56
+HALF_LIFE_DAYS = 14
+LEAD_TIME_DAYS = 3
+COVER_DAYS = 14
+CHUNK_ROWS = 50000
+MEMORY_BUDGET_BYTES = 64 * 1024 * 1024
+REFRESH_SECONDS = 6 * 60 * 60
+
+Suggestion = namedtuple(
+    "Suggestion",
+    "product_id name supplier stock reorder_level avg_7d avg_28d velocity "
+    "days_of_cover suggested_qty computed_at",
+)
+
+
+def _load_products(conn):
+    rows = db.query_all(conn, "SELECT id, stock, reorder_level FROM products ORDER BY id")
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    ids, stock, levels = (np.array(col, dtype=np.int64) for col in zip(*rows))
+    return ids, np.maximum(stock, 0), levels
+
+
+def _last_suppliers(conn):
+    rows = db.query_all(conn, """
+        SELECT p.product_id, p.supplier
+        FROM purchases p
+        JOIN (SELECT product_id, MAX(id) AS id FROM purchases GROUP BY product_id) last
+          ON last.id = p.id
+    """)
+    return {product_id: supplier or "" for product_id, supplier in rows}
+
+
+def _sales_matrix(conn, product_ids, today):
+    """Units sold per product (row) and age in days (column, 0 = today)."""
+    matrix = np.zeros((len(product_ids), WINDOW_DAYS), dtype=np.float32)
+    if not len(product_ids):
+        return matrix
+    lo, hi = int(product_ids[0]), int(product_ids[-1])
+
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT MIN(id) FROM stock_movements
+        WHERE movement_type IN ('SALE', 'RETURN') AND created_at >= CURDATE() - INTERVAL %s DAY
+    """, (WINDOW_DAYS - 1,))
+    first_id = cur.fetchone()[0]
+    if first_id is None:
+        return matrix
+
+    last_id = first_id - 1
+    while True:
+        cur.execute("""
+            SELECT id, product_id, TO_DAYS(created_at), -change_qty
+            FROM stock_movements
+            WHERE id > %s AND movement_type IN ('SALE', 'RETURN')
+              AND product_id BETWEEN %s AND %s
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, lo, hi, CHUNK_ROWS))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.int64)
+        last_id = int(chunk[-1, 0])
+
+        age = today - chunk[:, 2]
+        positions = np.searchsorted(product_ids, chunk[:, 1])
+        positions = np.minimum(positions, len(product_ids) - 1)
+        keep = (age >= 0) & (age < WINDOW_DAYS) & (product_ids[positions] == chunk[:, 1])
+        np.add.at(matrix, (positions[keep], age[keep]), chunk[keep, 3])
+
+        if len(rows) < CHUNK_ROWS:
+            break
+    cur.close()
+    return matrix
+
+
+def compute(matrix, stock, reorder_levels):
+    """Vectorised metrics for every row of the sales matrix.
+
+    Returns ``(avg_7d, avg_28d, velocity, days_of_cover, suggested_qty)``.
+    ``days_of_cover`` is NaN where nothing sold. The suggestion covers lead
+    time plus ``COVER_DAYS`` of demand on top of the reorder level.
+    """
+    avg_7d = matrix[:, :7].sum(axis=1) / 7.0
+    avg_28d = matrix[:, :28].sum(axis=1) / 28.0
+
+    weights = 0.5 ** (np.arange(WINDOW_DAYS) / HALF_LIFE_DAYS)
+    velocity = matrix @ weights / weights.sum()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_of_cover = np.where(velocity > 0, stock / velocity, np.nan)
+
+    target = np.ceil(velocity * (LEAD_TIME_DAYS + COVER_DAYS)) + reorder_levels
+    suggested = np.maximum(target - stock, 0).astype(np.int64)
+    # Nothing sells and stock is above the reorder level: no order needed
+    suggested[(velocity <= 0) & (stock >= reorder_levels)] = 0
+    return avg_7d, avg_28d, velocity, days_of_cover, suggested
+
+
+def _blocks(product_ids):
+    block = max(MEMORY_BUDGET_BYTES // (WINDOW_DAYS * 4 * 2), 1)
+    for start in range(0, len(product_ids), block):
+        yield slice(start, start + block)
+
+
+def run():
+    """Recompute all suggestions; returns the number of products scored."""
+    conn = get_db_connection()
+    if not conn:
+        print("Forecast: database connection error")
+        return 0
+    try:
+        product_ids, stock, levels = _load_products(conn)
+        suppliers = _last_suppliers(conn)
+        today = db.query_one(conn, "SELECT TO_DAYS(CURDATE())")[0]
+
+        results = []
+        for block in _blocks(product_ids):
+            matrix = _sales_matrix(conn, product_ids[block], today)
+            metrics = compute(matrix, stock[block], levels[block])
+            for i, product_id in enumerate(product_ids[block]):
+                avg_7d, avg_28d, velocity, cover, qty = (m[i] for m in metrics)
+                results.append((
+                    int(product_id), suppliers.get(int(product_id), ""),
+                    round(float(avg_7d), 3), round(float(avg_28d), 3), round(float(velocity), 3),
+                    None if np.isnan(cover) else round(float(cover), 1), int(qty),
+                ))
+            del matrix
+
+        cur = conn.cursor()
+        cur.execute("DELETE FROM reorder_suggestions")
+        for start in range(0, len(results), 1000):
+            cur.executemany("""
+                INSERT INTO reorder_suggestions
+                    (product_id, supplier, avg_7d, avg_28d, velocity, days_of_cover, suggested_qty)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, results[start:start + 1000])
+        conn.commit()
+        return len(results)
+    except Exception as e:
+        conn.rollback()
+        print(f"Forecast failed: {e}")
+        return 0
+    finally:
+        conn.close()
+
+
+# -----------------------
+# READ SIDE
+# -----------------------
+SQL_SUGGESTIONS = """
+    SELECT r.product_id, p.name, r.supplier, p.stock, p.reorder_level, r.avg_7d,
+           r.avg_28d, r.velocity, r.days_of_cover, r.suggested_qty, r.computed_at
+    FROM reorder_suggestions r
+    JOIN products p ON p.id = r.product_id
+    WHERE r.suggested_qty > 0
+    ORDER BY r.supplier, r.days_of_cover IS NULL, r.days_of_cover, p.name
+"""
+SQL_SUGGESTION = """
+    SELECT r.product_id, p.name, r.supplier, p.stock, p.reorder_level, r.avg_7d,
+           r.avg_28d, r.velocity, r.days_of_cover, r.suggested_qty, r.computed_at
+    FROM reorder_suggestions r
+    JOIN products p ON p.id = r.product_id
+    WHERE r.product_id = %s
+"""
+
+
+def suggestions_by_supplier(conn):
+    """``[(supplier, [Suggestion, ...]), ...]`` for products needing an order."""
+    grouped = {}
+    for row in db.query_all(conn, SQL_SUGGESTIONS, row_type=Suggestion):
+        grouped.setdefault(row.supplier or "Unknown supplier", []).append(row)
+    return list(grouped.items())
+
+
+def suggestion_for(conn, product_id):
+    return db.query_one(conn, SQL_SUGGESTION, (product_id,), Suggestion)
+
+
+if __name__ == "__main__":
+    once = "--once" in sys.argv
+    while True:
+        started = time.time()
+        count = run()
+        print(f"Forecast: scored {count} products in {time.time() - started:.1f}s")
+        if once:
+            break
+        time.sleep(REFRESH_SECONDS)
@@ -0,0 +1,212 @@
+"""Goods-received notes: many purchase lines written in one transaction.
+
+``receive()`` takes already-parsed lines and, inside a single transaction,
+writes the GRN header, all ``purchases`` rows, the stock and cost-price
+updates and all ``stock_movements`` with multi-row statements. The round
+trip count is fixed no matter how many lines a delivery has. The
+``parse_*`` helpers turn form fields, JSON and Excel sheets into those lines.
+"""
+from collections import namedtuple
+
+import alerts
+import db
+import events
+import valuation
+
+MAX_LINES = 2000
+
+GrnLine = namedtuple("GrnLine", "product_id quantity cost_price supplier")
+
+
+class GrnError(ValueError):
+    """Invalid GRN input; ``errors`` lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+# -----------------------
+# PARSING
+# -----------------------
+def _ref(kind, value):
+    """Product reference ``("id" | "code", text)``; ``None`` when blank."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return (kind, value) if value else None
+
+
+def _clean_lines(raw_lines, default_supplier=""):
+    """Validate ``(row_label, product_ref, quantity, cost_price, supplier)``."""
+    lines = []
+    errors = []
+    for label, product_ref, quantity, cost_price, supplier in raw_lines:
+        if product_ref is None and quantity in (None, "") and cost_price in (None, ""):
+            continue  # blank form row
+        try:
+            quantity = int(float(quantity))
+            cost_price = float(cost_price)
+        except (TypeError, ValueError):
+            errors.append(f"{label}: invalid quantity or cost price")
+            continue
+        if quantity <= 0 or cost_price < 0:
+            errors.append(f"{label}: quantity must be positive and cost price cannot be negative")
+            continue
+        if product_ref is None:
+            errors.append(f"{label}: product is required")
+            continue
+        supplier = (str(supplier).strip() if supplier not in (None, "") else "") or default_supplier
+        lines.append((label, product_ref, quantity, cost_price, supplier))
+    if len(lines) > MAX_LINES:
+        errors.append(f"A GRN can have at most {MAX_LINES} lines")
+    return lines, errors
+
+
+def parse_form(form):
+    """Rows posted as parallel ``product_id[]``/``quantity[]``/``cost_price[]``."""
+    rows = zip(form.getlist("product_id[]"), form.getlist("quantity[]"), form.getlist("cost_price[]"))
+    return [(f"Line {i}", _ref("id", p), q, c, None) for i, (p, q, c) in enumerate(rows, start=1)]
+
+
+def parse_json(data):
+    lines = data.get("lines") or []
+    return [(
+        f"Line {i}",
+        _ref("id", line["product_id"]) if line.get("product_id") else _ref("code", line.get("product_code")),
+        line.get("quantity"),
+        line.get("cost_price"),
+        line.get("supplier"),
+    ) for i, line in enumerate(lines, start=1)]
+
+
+def parse_excel(file_storage):
+    """Sheet columns: product_code or product_id, quantity, cost_price[, supplier]."""
+    import pandas as pd
+
+    df = pd.read_excel(file_storage)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    ref_column = "product_code" if "product_code" in df.columns else "product_id"
+    missing = [c for c in (ref_column, "quantity", "cost_price") if c not in df.columns]
+    if missing:
+        raise GrnError(["Excel file must contain columns: product_code (or product_id), quantity, cost_price"])
+    df = df.astype(object).where(pd.notna(df), None)
+    suppliers = df["supplier"] if "supplier" in df.columns else [None] * len(df)
+    return [
+        (f"Row {i + 2}", _ref(ref_column[len("product_"):], ref), qty, cost, supplier)
+        for i, (ref, qty, cost, supplier) in enumerate(zip(df[ref_column], df["quantity"], df["cost_price"], suppliers))
+    ]
+
+
+def resolve(conn, raw_lines, default_supplier=""):
+    """Turn raw lines into ``GrnLine``s, looking products up in bulk.
+
+    Product references are product ids or product codes. Raises ``GrnError``
+    listing every bad line, so nothing is written for a partially bad GRN.
+    """
+    lines, errors = _clean_lines(raw_lines, default_supplier)
+    refs = {ref for _, ref, _, _, _ in lines}
+    id_refs = [int(value) for kind, value in refs if kind == "id" and value.isdigit()]
+    code_refs = list({value.upper() for kind, value in refs if kind == "code"})
+
+    known_ids = set()
+    if id_refs:
+        known_ids = {row[0] for row in db.fetch_by_ids(
+            conn, "SELECT id FROM products WHERE id IN ({ids})", id_refs)}
+    ids_by_code = {}
+    if code_refs:
+        ids_by_code = {code: pid for pid, code in db.fetch_by_ids(
+            conn, "SELECT id, product_code FROM products WHERE product_code IN ({ids})", code_refs)}
+
+    resolved = []
+    for label, (kind, value), quantity, cost_price, supplier in lines:
+        if kind == "id":
+            product_id = int(value) if value.isdigit() and int(value) in known_ids else None
+        else:
+            product_id = ids_by_code.get(value.upper())
+        if product_id is None:
+            errors.append(f"{label}: unknown product '{value}'")
+            continue
+        resolved.append(GrnLine(product_id, quantity, cost_price, supplier))
+    if not resolved and not errors:
+        errors.append("Add at least one line")
+    if errors:
+        raise GrnError(errors)
+    return resolved
+
+
+# -----------------------
+# WRITING
+# -----------------------
+def receive(conn, lines, user_id, supplier="", reference="", token=None, store_id=None):
+    """Record a delivery; returns ``(grn_id, purchase_ids)``.
+
+    Everything happens on ``conn`` in one transaction; the caller commits.
+    ``token`` makes resubmitting the same form a no-op (duplicate key).
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO grns (supplier, reference, token, line_count, created_by)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (supplier, reference, token, len(lines), user_id))
+    grn_id = cur.lastrowid
+
+    cur.executemany("""
+        INSERT INTO purchases (product_id, quantity, cost_price, supplier, created_by, grn_id)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, [(l.product_id, l.quantity, l.cost_price, l.supplier, user_id, grn_id) for l in lines])
+
+    # A multi-row INSERT hands out ascending ids in statement order
+    cur.execute("SELECT id FROM purchases WHERE grn_id = %s ORDER BY id", (grn_id,))
+    purchase_ids = [row[0] for row in cur.fetchall()]
+
+    # One UPDATE for all products; repeated products add up, last cost wins
+    totals = {}
+    for line in lines:
+        quantity, _ = totals.get(line.product_id, (0, None))
+        totals[line.product_id] = (quantity + line.quantity, line.cost_price)
+    table, params = db.values_table(
+        [(pid, qty, cost) for pid, (qty, cost) in totals.items()], ("id", "qty", "cost"))
+    cur.execute(f"""
+        UPDATE products p
+        JOIN ({table}) t ON t.id = p.id
+        SET p.stock = p.stock + t.qty, p.cost_price = t.cost
+    """, params)
+
+    cur.executemany("""
+        INSERT INTO stock_movements (product_id, change_qty, movement_type, reference_id, created_by)
+        VALUES (%s, %s, 'PURCHASE', %s, %s)
+    """, [(l.product_id, l.quantity, pid, user_id) for l, pid in zip(lines, purchase_ids)])
+
+    outbox = []
+    for line, purchase_id in zip(lines, purchase_ids):
+        outbox.append((events.PURCHASE_CREATED, purchase_id, {
+            "purchase_id": purchase_id,
+            "grn_id": grn_id,
+            "product_id": line.product_id,
+            "quantity": line.quantity,
+            "cost_price": line.cost_price,
+            "supplier": line.supplier,
+            "created_by": user_id,
+        }))
+        outbox.append((events.STOCK_CHANGED, line.product_id, {
+            "product_id": line.product_id,
+            "change_qty": line.quantity,
+            "movement_type": "PURCHASE",
+            "reference_id": purchase_id,
+        }))
+    events.record_many(cur, outbox)
+    alerts.record_crossings(conn, changes={pid: qty for pid, (qty, _) in totals.items()})
+    valuation.record(conn, [
+        valuation.Move(l.product_id, l.quantity, l.cost_price, "PURCHASE", pid)
+        for l, pid in zip(lines, purchase_ids)
+    ], user_id, store_id)
+
+    cur.execute(
+        "INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)",
+        (user_id, "Goods Received", f"GRN #{grn_id}: {len(lines)} lines from {supplier or 'various suppliers'}")
+    )
+    cur.close()
+    return grn_id, purchase_ids
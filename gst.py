@@ -0,0 +1,134 @@
+"""GST by rate ("slab"), stored per bill at checkout and summarised for filing.
+
+Checkout writes one ``gst_entries`` row per GST rate on the bill: the taxable
+value (line price x quantity less its promotion) and the tax on it. A credit
+note (``returns.py``) writes the same rows, negative and dated on the day of
+the return. A period's GST return is then one ``GROUP BY`` over a date range
+of the primary key, ``(entry_date, id)``, so a month is read as one
+contiguous slice of the table. No bill is re-opened and no tax is recomputed.
+
+Each entry also carries the store, so the report can be cut by rate, by day
+or by store. Sales are treated as intra-state: the tax splits evenly into
+CGST and SGST.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+
+import db
+import valuation
+
+Slab = namedtuple("Slab", "gst_rate taxable_value tax_amount")
+
+SQL_INSERT_ENTRY = """
+    INSERT INTO gst_entries (bill_id, credit_note_id, gst_rate, taxable_value, tax_amount, entry_date, store_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def _money(value):
+    return Decimal(value).quantize(valuation.MONEY_PLACES)
+
+
+def slabs(lines):
+    """``[Slab, ...]`` by rate from ``(rate, taxable, tax)`` lines, summed then rounded."""
+    totals = {}
+    for rate, taxable, tax in lines:
+        rate = Decimal(str(rate))
+        entry = totals.setdefault(rate, [Decimal(0), Decimal(0)])
+        entry[0] += Decimal(str(taxable))
+        entry[1] += Decimal(str(tax))
+    return [Slab(rate, _money(taxable), _money(tax)) for rate, (taxable, tax) in sorted(totals.items())]
+
+
+def entry_rows(bill_id, slab_list, when, store_id=None, credit_note_id=None, sign=1):
+    """``SQL_INSERT_ENTRY`` parameters; ``sign=-1`` for a credit note."""
+    return [(bill_id, credit_note_id, slab.gst_rate, sign * slab.taxable_value, sign * slab.tax_amount,
+             when, store_id or 0) for slab in slab_list]
+
+
+# -----------------------
+# BACK-FILL
+# -----------------------
+def seed(cur):
+    """Fill ``gst_entries`` from bill and credit-note lines the first time it is created."""
+    cur.execute("SELECT COUNT(*) FROM gst_entries")
+    if cur.fetchone()[0]:
+        return
+    cur.execute("""
+        INSERT INTO gst_entries (bill_id, gst_rate, taxable_value, tax_amount, entry_date, store_id)
+        SELECT b.id, i.gst, ROUND(SUM(i.price * i.quantity - i.discount), 2),
+               ROUND(SUM((i.price * i.quantity - i.discount) * i.gst / 100), 2),
+               b.bill_date, COALESCE(u.store_id, 0)
+        FROM bills_new b
+        JOIN bill_items i ON i.bill_id = b.id
+        LEFT JOIN users u ON u.id = b.created_by
+        GROUP BY b.id, i.gst, b.bill_date, COALESCE(u.store_id, 0)
+    """)
+    # Credit-note lines keep the tax but not the taxable value on its own
+    cur.execute("""
+        INSERT INTO gst_entries (bill_id, credit_note_id, gst_rate, taxable_value, tax_amount, entry_date, store_id)
+        SELECT c.bill_id, c.id, ci.gst,
+               -ROUND(SUM(CASE WHEN ci.gst > 0 THEN ci.gst_amount * 100 / ci.gst
+                               ELSE ci.price * ci.quantity - ci.discount END), 2),
+               -SUM(ci.gst_amount), c.created_at, COALESCE(u.store_id, 0)
+        FROM credit_notes c
+        JOIN credit_note_items ci ON ci.credit_note_id = c.id
+        LEFT JOIN users u ON u.id = c.created_by
+        GROUP BY c.id, c.bill_id, ci.gst, c.created_at, COALESCE(u.store_id, 0)
+    """)
+
+
+# -----------------------
+# READ SIDE
+# -----------------------
+# Report groupings: row key expression and GROUP BY / ORDER BY list
+GROUPS = {
+    "rate": ("NULL", "e.gst_rate"),
+    "day": ("DATE(e.entry_date)", "DATE(e.entry_date), e.gst_rate"),
+    "store": ("COALESCE(s.store_name, 'No store')", "e.store_id, s.store_name, e.gst_rate"),
+}
+SummaryRow = namedtuple("SummaryRow", "key gst_rate taxable_value cgst sgst tax_amount bills")
+
+SQL_BILL_SLABS = """
+    SELECT bill_id, gst_rate, taxable_value, tax_amount FROM gst_entries
+    WHERE bill_id IN ({ids}) AND credit_note_id IS NULL
+    ORDER BY bill_id, gst_rate
+"""
+
+
+def month_range(today=None):
+    """First day of this month and today."""
+    today = today or date.today()
+    return today.replace(day=1), today
+
+
+def summary(conn, start, end, group="rate"):
+    """``[SummaryRow, ...]`` for entries from ``start`` to ``end`` (dates, inclusive).
+
+    ``key`` is ``None`` by rate, the day by day, and the store name by store.
+    Credit notes are already negative, so the figures are net of returns.
+    """
+    key, group_by = GROUPS[group]
+    rows = db.query_all(conn, f"""
+        SELECT {key}, e.gst_rate, SUM(e.taxable_value), SUM(e.tax_amount),
+               COUNT(DISTINCT CASE WHEN e.credit_note_id IS NULL THEN e.bill_id END)
+        FROM gst_entries e
+        {"LEFT JOIN stores s ON s.id = e.store_id" if group == "store" else ""}
+        WHERE e.entry_date >= %s AND e.entry_date < %s
+        GROUP BY {group_by}
+        ORDER BY {group_by}
+    """, (start, end + timedelta(days=1)))
+    result = []
+    for key, rate, taxable, tax, bills in rows:
+        half = _money(Decimal(tax or 0) / 2)
+        result.append(SummaryRow(key, rate, taxable or 0, half, Decimal(tax or 0) - half, tax or 0, bills))
+    return result
+
+
+def bill_slabs(conn, bill_ids):
+    """``{bill_id: [Slab, ...]}`` as charged (credit notes excluded)."""
+    by_bill = {bill_id: [] for bill_id in bill_ids}
+    for bill_id, rate, taxable, tax in db.fetch_by_ids(conn, SQL_BILL_SLABS, bill_ids):
+        by_bill[bill_id].append(Slab(rate, taxable, tax))
+    return by_bill
@@ -0,0 +1,25 @@
+"""gunicorn settings, read automatically when gunicorn starts in this directory.
+
+    gunicorn wsgi:app
+
+Threaded workers: a request that waits a long time (an Excel import, a live
+low-stock stream) ties up one thread rather than a whole worker, so
+checkouts keep being served. Each thread holds at most one pooled MySQL
+connection at a time, so keep ``threads`` below ``DB_POOL_SIZE`` (12). Command-line flags
+override these, e.g. ``gunicorn -w 8 wsgi:app``.
+"""
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+preload_app = True
+
+
+def on_starting(server):
+    # Per-process stores would log users out whenever a request reached
+    # another worker, and hide role changes and deactivations from it
+    if server.cfg.workers > 1:
+        for name in ("SESSION_BACKEND", "CACHE_BACKEND"):
+            if os.environ.get(name, "sqlite") == "memory":
+                raise RuntimeError(f"{name}=memory only works with one worker (-w 1); use sqlite")
@@ -0,0 +1,164 @@
+"""Password hashing off the request threads, and login rate limiting.
+
+Password hashes are deliberately slow. Run on a request worker, a burst of
+logins at shift change would hold up every till served by that worker.
+``check()`` and ``generate()`` instead hand the work to a small process pool
+running at lower CPU priority, and at most ``HASH_QUEUE_LIMIT`` hashes may be
+queued or running at once. Past that, callers wait up to ``HASH_WAIT``
+seconds for a slot and then get ``Busy``; so does a hash not finished
+within ``HASH_TIMEOUT`` seconds.
+
+``LoginLimiter`` counts failed logins per username and per client address in
+memory (per worker), so guessing passwords is throttled before any hashing
+is done.
+
+Tune with ``PASSWORD_HASH_WORKERS`` and ``PASSWORD_HASH_QUEUE``.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+HASH_QUEUE_LIMIT = int(os.environ.get("PASSWORD_HASH_QUEUE", 32))
+HASH_WAIT = 5
+HASH_TIMEOUT = 30
+HASH_NICENESS = 5
+
+
+class Busy(Exception):
+    """Too many password hashes are already queued."""
+
+
+# -----------------------
+# HASHING POOL
+# -----------------------
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+
+
+def _lower_priority():
+    try:
+        os.nice(HASH_NICENESS)
+    except OSError:
+        pass
+
+
+def _get_pool():
+    # gunicorn forks workers after import, so each worker starts its own pool
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, initializer=_lower_priority)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=HASH_WAIT):
+        raise Busy("Too many logins at once, please try again")
+    try:
+        future = _get_pool().submit(fn, *args)
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        # Saturated pool: drop the job if it has not started yet
+        future.cancel()
+        raise Busy("Too many logins at once, please try again")
+    except BrokenProcessPool:
+        # A hashing process died; start a fresh pool for the next caller
+        shutdown()
+        raise Busy("Login service restarting, please try again")
+    finally:
+        _slots.release()
+
+
+def check(pwhash, password):
+    """``check_password_hash`` on the hashing pool."""
+    return _run(check_password_hash, pwhash, password)
+
+
+def generate(password):
+    """``generate_password_hash`` on the hashing pool."""
+    return _run(generate_password_hash, password)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# -----------------------
+# RATE LIMITING
+# -----------------------
+class LoginLimiter:
+    """Sliding-window count of failed logins per key."""
+
+    def __init__(self, limit, window, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        failures = self._failures.get(key)
+        if failures is None:
+            return None
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return None
+        return failures
+
+    def retry_after(self, key):
+        """Seconds until ``key`` may try again, or ``0`` if it is not blocked."""
+        now = time.time()
+        with self._lock:
+            failures = self._recent(key, now)
+            if failures is None or len(failures) < self.limit:
+                return 0
+            return int(failures[0] + self.window - now) + 1
+
+    def fail(self, key):
+        now = time.time()
+        with self._lock:
+            failures = self._recent(key, now)
+            if failures is None:
+                if len(self._failures) >= self.max_keys:
+                    # Drop the oldest keys rather than grow without bound
+                    for old in sorted(self._failures, key=lambda k: self._failures[k][-1])[:self.max_keys // 10]:
+                        del self._failures[old]
+                failures = self._failures[key] = deque()
+            failures.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+username_limiter = LoginLimiter(limit=5, window=900)
+address_limiter = LoginLimiter(limit=30, window=900)
+
+
+def login_blocked(username, address):
+    """Seconds the login must wait, or ``0``."""
+    return max(username_limiter.retry_after(username.lower()), address_limiter.retry_after(address))
+
+
+def login_failed(username, address):
+    username_limiter.fail(username.lower())
+    address_limiter.fail(address)
+
+
+def login_succeeded(username):
+    username_limiter.reset(username.lower())
@@ -0,0 +1,320 @@
+"""Period-end close: immutable daily and monthly snapshots.
+
+``close()`` freezes every finished day (and every finished month) into:
+
+* ``period_summaries`` - bills, sales and discount (net of credit notes),
+  net revenue, purchase value, cost of goods sold and write-offs per period
+  and store,
+* ``stock_snapshots`` - closing stock, average cost and value per product,
+* ``closed_periods`` - one row per closed period.
+
+Rows are only ever inserted (``INSERT IGNORE``), so re-running a close is a
+no-op and closed figures never change. Reports add up closed months and days
+and only aggregate raw ``bills_new`` rows for the open period, so their cost
+does not grow with years of history.
+
+Closing stock is rebuilt by rolling the current ``stock_valuation`` back
+through ``valuation_ledger``, newest day first, so closing any number of
+missed days reads each ledger row once. The first close back-fills the sales
+summaries for all earlier days; stock snapshots start at that first close.
+
+Run ``python periods.py`` nightly (e.g. from cron shortly after midnight) to
+close everything up to yesterday, or ``python periods.py --through
+YYYY-MM-DD``.
+"""
+import sys
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import db
+import valuation
+from db import get_db_connection
+
+DAY = "day"
+MONTH = "month"
+
+PeriodSummary = namedtuple(
+    "PeriodSummary",
+    "bill_count sales_total discount_total sales_revenue purchase_value cogs writeoff_value",
+)
+StockSnapshot = namedtuple("StockSnapshot", "period_type period_start product_id closing_stock avg_cost closing_value")
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _day_start(day):
+    return datetime.combine(day, time.min)
+
+
+def last_closed(conn, period_type=DAY):
+    return db.query_one(
+        conn, "SELECT MAX(period_start) FROM closed_periods WHERE period_type = %s", (period_type,)
+    )[0]
+
+
+# -----------------------
+# CLOSE
+# -----------------------
+def _summaries(cur, first, through):
+    """``{(day, store_id): [bill_count, sales, discount, revenue, purchases, cogs, write-offs]}``."""
+    rows = {}
+    cur.execute("""
+        SELECT DATE(b.bill_date), COALESCE(u.store_id, 0),
+               COUNT(*), COALESCE(SUM(b.total), 0), COALESCE(SUM(b.discount), 0)
+        FROM bills_new b
+        LEFT JOIN users u ON u.id = b.created_by
+        WHERE b.bill_date >= %s AND b.bill_date < %s
+        GROUP BY DATE(b.bill_date), COALESCE(u.store_id, 0)
+    """, (_day_start(first), _day_start(through + timedelta(days=1))))
+    for day, store_id, count, sales, discount in cur.fetchall():
+        rows[(day, store_id)] = [count, sales, discount, 0, 0, 0, 0]
+    # Refunds count against the day and store they were given on
+    cur.execute("""
+        SELECT DATE(c.created_at), COALESCE(u.store_id, 0),
+               COALESCE(SUM(c.total), 0), COALESCE(SUM(c.discount), 0)
+        FROM credit_notes c
+        LEFT JOIN users u ON u.id = c.created_by
+        WHERE c.created_at >= %s AND c.created_at < %s
+        GROUP BY DATE(c.created_at), COALESCE(u.store_id, 0)
+    """, (_day_start(first), _day_start(through + timedelta(days=1))))
+    for day, store_id, refunds, discount in cur.fetchall():
+        row = rows.setdefault((day, store_id), [0, 0, 0, 0, 0, 0, 0])
+        row[1] -= refunds
+        row[2] -= discount
+    cur.execute("""
+        SELECT day, store_id, sales_revenue, purchase_value, cogs, writeoff_value
+        FROM valuation_daily
+        WHERE day BETWEEN %s AND %s
+    """, (first, through))
+    for day, store_id, revenue, purchases, cogs, writeoffs in cur.fetchall():
+        rows.setdefault((day, store_id), [0, 0, 0, 0, 0, 0, 0])[3:] = [revenue, purchases, cogs, writeoffs]
+    return rows
+
+
+def _stock_snapshots(cur, first, through):
+    """Yield ``(day, [(product_id, qty, avg_cost), ...])`` from ``through`` back to ``first``."""
+    cur.execute("SELECT product_id, quantity, avg_cost FROM stock_valuation")
+    state = {pid: [quantity, avg_cost] for pid, quantity, avg_cost in cur.fetchall()}
+    cur.execute("""
+        SELECT product_id, quantity, unit_cost, qty_after, avg_cost_after, created_at
+        FROM valuation_ledger
+        WHERE created_at >= %s
+        ORDER BY created_at DESC, id DESC
+    """, (_day_start(first + timedelta(days=1)),))
+    ledger = cur.fetchall()
+
+    position = 0
+    day = through
+    while day >= first:
+        cutoff = _day_start(day + timedelta(days=1))
+        # Undo every move made after the end of ``day``
+        while position < len(ledger) and ledger[position][5] >= cutoff:
+            product_id, quantity, unit_cost, qty_after, avg_after, _ = ledger[position]
+            position += 1
+            if product_id not in state:
+                continue
+            qty_before = qty_after - quantity
+            avg_before = avg_after
+            base = max(qty_before, 0)
+            if quantity > 0 and base > 0:
+                # Inflows re-average: invert valuation.record()'s formula
+                # (a no-op for moves valued at the average itself)
+                avg_before = (avg_after * (base + quantity) - quantity * unit_cost) / base
+            state[product_id] = [qty_before, avg_before]
+        yield day, [(pid, qty, avg) for pid, (qty, avg) in state.items()]
+        day -= timedelta(days=1)
+
+
+def close(through=None, conn=None):
+    """Close every day up to ``through`` (default: yesterday); returns days closed."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if not conn:
+            print("Period close: database connection error")
+            return 0
+    cur = conn.cursor()
+    try:
+        conn.start_transaction(consistent_snapshot=True)
+        cur.execute("SELECT CURDATE() - INTERVAL 1 DAY")
+        yesterday = cur.fetchone()[0]
+        through = min(through or yesterday, yesterday)
+
+        cur.execute("SELECT MAX(period_start) FROM closed_periods WHERE period_type = %s", (DAY,))
+        last = cur.fetchone()[0]
+        if last is not None:
+            first = snapshot_first = last + timedelta(days=1)
+        else:
+            # First close: back-fill summaries from the first bill or movement
+            cur.execute("SELECT DATE(MIN(bill_date)) FROM bills_new")
+            first_bill = cur.fetchone()[0]
+            cur.execute("SELECT MIN(day) FROM valuation_daily")
+            first_move = cur.fetchone()[0]
+            first = min(d for d in (first_bill, first_move, through) if d is not None)
+            snapshot_first = through
+        if first > through:
+            conn.rollback()
+            return 0
+
+        summaries = _summaries(cur, first, through)
+        cur.executemany("""
+            INSERT IGNORE INTO period_summaries
+                (period_type, period_start, store_id, bill_count, sales_total, discount_total,
+                 sales_revenue, purchase_value, cogs, writeoff_value)
+            VALUES ('day', %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, [(day, store_id, *values) for (day, store_id), values in sorted(summaries.items())])
+
+        for day, products in _stock_snapshots(cur, snapshot_first, through):
+            cur.executemany("""
+                INSERT IGNORE INTO stock_snapshots
+                    (period_type, period_start, product_id, closing_stock, avg_cost, closing_value)
+                VALUES ('day', %s, %s, %s, %s, %s)
+            """, [(day, pid, qty, avg.quantize(valuation.COST_PLACES),
+                   (max(qty, 0) * avg).quantize(valuation.MONEY_PLACES)) for pid, qty, avg in products])
+
+        days = [first + timedelta(days=i) for i in range((through - first).days + 1)]
+        cur.executemany(
+            "INSERT IGNORE INTO closed_periods (period_type, period_start) VALUES ('day', %s)",
+            [(day,) for day in days]
+        )
+
+        # A month closes with its last day: totals add up its days and the
+        # closing stock is that last day's snapshot
+        for day in days:
+            if (day + timedelta(days=1)).day != 1:
+                continue
+            month = _month_start(day)
+            cur.execute("""
+                INSERT IGNORE INTO period_summaries
+                    (period_type, period_start, store_id, bill_count, sales_total, discount_total,
+                     sales_revenue, purchase_value, cogs, writeoff_value)
+                SELECT 'month', %s, store_id, SUM(bill_count), SUM(sales_total), SUM(discount_total),
+                       SUM(sales_revenue), SUM(purchase_value), SUM(cogs), SUM(writeoff_value)
+                FROM period_summaries
+                WHERE period_type = 'day' AND period_start BETWEEN %s AND %s
+                GROUP BY store_id
+            """, (month, month, day))
+            cur.execute("""
+                INSERT IGNORE INTO stock_snapshots
+                    (period_type, period_start, product_id, closing_stock, avg_cost, closing_value)
+                SELECT 'month', %s, product_id, closing_stock, avg_cost, closing_value
+                FROM stock_snapshots
+                WHERE period_type = 'day' AND period_start = %s
+            """, (month, day))
+            cur.execute(
+                "INSERT IGNORE INTO closed_periods (period_type, period_start) VALUES ('month', %s)",
+                (month,)
+            )
+
+        conn.commit()
+        return len(days)
+    except Exception as e:
+        conn.rollback()
+        print(f"Period close failed: {e}")
+        return 0
+    finally:
+        cur.close()
+        if own_conn:
+            conn.close()
+
+
+# -----------------------
+# READ SIDE
+# -----------------------
+SQL_SUM_SUMMARIES = """
+    SELECT COALESCE(SUM(bill_count), 0), COALESCE(SUM(sales_total), 0),
+           COALESCE(SUM(discount_total), 0), COALESCE(SUM(sales_revenue), 0),
+           COALESCE(SUM(purchase_value), 0), COALESCE(SUM(cogs), 0),
+           COALESCE(SUM(writeoff_value), 0)
+    FROM period_summaries
+    WHERE period_type = %s AND period_start >= %s AND period_start < %s
+"""
+
+
+def _closed_summary(conn, period_type, start, end):
+    if start >= end:
+        return PeriodSummary(0, 0, 0, 0, 0, 0, 0)
+    return db.query_one(conn, SQL_SUM_SUMMARIES, (period_type, start, end), PeriodSummary)
+
+
+def _open_summary(conn, start=None):
+    """Aggregate raw rows from ``start`` (inclusive, ``None`` = all) up to now."""
+    if start is None:
+        stats = db.query_one(conn, """
+            SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(discount), 0)
+            FROM bills_new
+        """)
+    else:
+        stats = db.query_one(conn, """
+            SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(discount), 0)
+            FROM bills_new
+            WHERE bill_date >= %s
+        """, (_day_start(start),))
+    if start is None:
+        refunds = db.query_one(conn, """
+            SELECT COALESCE(SUM(total), 0), COALESCE(SUM(discount), 0) FROM credit_notes
+        """)
+    else:
+        refunds = db.query_one(conn, """
+            SELECT COALESCE(SUM(total), 0), COALESCE(SUM(discount), 0)
+            FROM credit_notes
+            WHERE created_at >= %s
+        """, (_day_start(start),))
+    totals = valuation.period_totals(conn, start)
+    return PeriodSummary(stats[0], stats[1] - refunds[0], stats[2] - refunds[1], *totals)
+
+
+def summary(conn, start=None):
+    """``PeriodSummary`` from ``start`` (``None`` = all time) until now.
+
+    Whole closed months come from month rows, other closed days from day
+    rows, and only the open period is aggregated from raw rows.
+    """
+    last_day = last_closed(conn, DAY)
+    if last_day is None:
+        return _open_summary(conn, start)
+
+    if start is None:
+        start = db.query_one(
+            conn, "SELECT MIN(period_start) FROM closed_periods WHERE period_type = %s", (DAY,)
+        )[0]
+    open_start = max(start, last_day + timedelta(days=1))
+    parts = [_open_summary(conn, open_start)]
+    if start <= last_day:
+        last_month = last_closed(conn, MONTH)
+        months_from = start if start.day == 1 else _next_month(start)
+        months_to = _next_month(last_month) if last_month and last_month >= months_from else months_from
+        parts.append(_closed_summary(conn, MONTH, months_from, months_to))
+        parts.append(_closed_summary(conn, DAY, start, min(months_from, open_start)))
+        parts.append(_closed_summary(conn, DAY, max(months_to, start), open_start))
+    return PeriodSummary(*(sum(Decimal(str(part[i])) for part in parts) for i in range(len(PeriodSummary._fields))))
+
+
+def opening_balance(conn, product_id):
+    """Latest month-end ``StockSnapshot`` for a product, or ``None``."""
+    return db.query_one(conn, """
+        SELECT period_type, period_start, product_id, closing_stock, avg_cost, closing_value
+        FROM stock_snapshots
+        WHERE product_id = %s AND period_type = 'month'
+        ORDER BY period_start DESC
+        LIMIT 1
+    """, (product_id,), StockSnapshot)
+
+
+def opening_date(snapshot):
+    """First day after a month-end snapshot."""
+    return _next_month(snapshot.period_start)
+
+
+if __name__ == "__main__":
+    through = None
+    if "--through" in sys.argv:
+        through = datetime.strptime(sys.argv[sys.argv.index("--through") + 1], "%Y-%m-%d").date()
+    print(f"Period close: closed {close(through)} day(s)")
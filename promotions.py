@@ -0,0 +1,215 @@
+"""Promotions applied at checkout: BOGO, quantity slabs and percent-off offers.
+
+Rules live in the ``promotions`` table. Each has a ``kind``:
+
+* ``bogo`` - buy ``buy_qty`` of a product and get ``free_qty`` more free
+* ``slab`` - ``percent`` off a product's line once ``min_qty`` are bought;
+  with several slabs for one product the best one reached wins
+* ``percent`` - ``percent`` off a product, or off every product in
+  ``category``
+
+Any rule can be limited to a date range (``starts_at``/``ends_at``) and to a
+daily time window (``daily_from``/``daily_to``, e.g. a 5-7pm happy hour).
+
+The active rules are compiled into a ``PromotionIndex``: a dict from product
+id to the rules that can apply to it, with category rules copied onto each
+product of their category at compile time. Pricing a basket is then one dict
+lookup per product plus a check of its few rules, however many promotions
+are running. Each product gets its single best offer; offers do not stack.
+The discount comes off the line before GST.
+
+``current_index()`` keeps the compiled index per tenant and rebuilds it when
+the "promotions" cache namespace is invalidated (promotion and product
+category edits) or after ``INDEX_TTL``. If the rules cannot be read it
+raises ``Unavailable`` instead of pricing without them.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+import cache
+import tenants
+from db import get_db_connection
+
+BOGO = "bogo"
+SLAB = "slab"
+PERCENT = "percent"
+KINDS = (BOGO, SLAB, PERCENT)
+
+INDEX_TTL = 300
+
+RULE_COLUMNS = ("id, name, kind, product_id, category, buy_qty, free_qty, min_qty, percent, "
+                "starts_at, ends_at, daily_from, daily_to")
+Rule = namedtuple("Rule", RULE_COLUMNS)
+
+SQL_ACTIVE_RULES = f"""
+    SELECT {RULE_COLUMNS} FROM promotions
+    WHERE active = 1 AND (ends_at IS NULL OR ends_at > NOW())
+"""
+SQL_CATEGORY_PRODUCTS = "SELECT id, category FROM products WHERE category IN ({categories})"
+
+
+def _minutes(value):
+    """Minutes after midnight for a MySQL ``TIME`` (a timedelta) or ``time``."""
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        return int(value.total_seconds()) // 60 % (24 * 60)
+    return value.hour * 60 + value.minute
+
+
+def compile_rule(row):
+    """``Rule`` from a database row, with numbers and time windows normalised."""
+    rule = Rule(*row)
+    return rule._replace(
+        buy_qty=int(rule.buy_qty or 0),
+        free_qty=int(rule.free_qty or 0),
+        min_qty=int(rule.min_qty or 1),
+        percent=float(rule.percent or 0),
+        daily_from=_minutes(rule.daily_from),
+        daily_to=_minutes(rule.daily_to),
+    )
+
+
+def is_live(rule, now):
+    if rule.starts_at is not None and now < rule.starts_at:
+        return False
+    if rule.ends_at is not None and now >= rule.ends_at:
+        return False
+    if rule.daily_from is None or rule.daily_to is None:
+        return True
+    minute = now.hour * 60 + now.minute
+    if rule.daily_from <= rule.daily_to:
+        return rule.daily_from <= minute < rule.daily_to
+    return minute >= rule.daily_from or minute < rule.daily_to  # window past midnight
+
+
+def rule_discount(rule, price, qty):
+    """Discount ``rule`` gives on ``qty`` units at ``price`` (before GST)."""
+    if rule.kind == BOGO:
+        group = rule.buy_qty + rule.free_qty
+        if rule.free_qty <= 0 or group <= 0:
+            return 0
+        return (qty // group) * rule.free_qty * price
+    if qty < rule.min_qty:
+        return 0
+    return price * qty * min(rule.percent, 100) / 100
+
+
+class PromotionIndex:
+    """Active rules keyed by product id."""
+
+    def __init__(self, rules, product_categories=()):
+        by_category = defaultdict(list)
+        self.by_product = defaultdict(list)
+        for rule in rules:
+            if rule.product_id is not None:
+                self.by_product[rule.product_id].append(rule)
+            elif rule.category:
+                by_category[rule.category].append(rule)
+        for product_id, category in product_categories:
+            if category in by_category:
+                self.by_product[product_id].extend(by_category[category])
+        self.by_product = dict(self.by_product)
+        self.rule_count = len(rules)
+
+    def best(self, product_id, price, qty, now):
+        """``(discount, rule)`` of the best live offer, or ``(0, None)``."""
+        best, best_rule = 0, None
+        for rule in self.by_product.get(product_id, ()):
+            if is_live(rule, now):
+                discount = rule_discount(rule, price, qty)
+                if discount > best:
+                    best, best_rule = discount, rule
+        return best, best_rule
+
+    def apply(self, cart, now=None):
+        """Set ``discount`` and ``promotion_id`` on each cart line; returns the total discount.
+
+        Lines for the same product are priced together (three single milk
+        lines still earn "buy 2 get 1"), and the discount is shared between
+        them by quantity.
+        """
+        now = now or datetime.now()
+        lines = defaultdict(list)
+        for item in cart:
+            item["discount"] = 0
+            item["promotion_id"] = None
+            lines[int(item["id"])].append(item)
+
+        total = 0
+        for product_id, items in lines.items():
+            if product_id not in self.by_product:
+                continue
+            qty = sum(item["qty"] for item in items)
+            discount, rule = self.best(product_id, items[0]["price"], qty, now)
+            if rule is None:
+                continue
+            discount = round(discount, 2)
+            remaining = discount
+            for i, item in enumerate(items):
+                share = remaining if i == len(items) - 1 else round(discount * item["qty"] / qty, 2)
+                item["discount"] = share
+                item["promotion_id"] = rule.id
+                remaining = round(remaining - share, 2)
+            total += discount
+        return round(total, 2)
+
+
+def build_index(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute(SQL_ACTIVE_RULES)
+        rules = [compile_rule(row) for row in cur.fetchall()]
+        categories = sorted({rule.category for rule in rules if rule.product_id is None and rule.category})
+        product_categories = []
+        if categories:
+            cur.execute(SQL_CATEGORY_PRODUCTS.format(categories=", ".join(["%s"] * len(categories))), categories)
+            product_categories = cur.fetchall()
+    finally:
+        cur.close()
+    return PromotionIndex(rules, product_categories)
+
+
+# -----------------------
+# CURRENT INDEX
+# -----------------------
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class Unavailable(Exception):
+    """The promotion rules could not be loaded."""
+
+
+def current_index(conn=None):
+    """The compiled index for the current tenant, rebuilt on ``conn`` if given.
+
+    Raises ``Unavailable`` when it cannot be loaded: a checkout must fail
+    rather than quietly charge full price.
+    """
+    key = tenants.scope("promotions")
+    version = cache.versions(("promotions",))[0]
+    now = time.time()
+    with _indexes_lock:
+        entry = _indexes.get(key)
+    if entry is not None and entry[0] == version and entry[1] > now:
+        return entry[2]
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if not conn:
+            raise Unavailable("Promotions could not be loaded, please try again")
+    try:
+        index = build_index(conn)
+    except Exception as e:
+        print(f"Error loading promotions: {e}")
+        raise Unavailable("Promotions could not be loaded, please try again") from e
+    finally:
+        if own_conn:
+            conn.close()
+    with _indexes_lock:
+        _indexes[key] = (version, now + INDEX_TTL, index)
+    return index
@@ -0,0 +1,295 @@
+"""Stock reconciliation: ``products.stock`` against the ``stock_movements`` ledger.
+
+Every stock change should leave a movement, so each product's stock equals
+the sum of its ``change_qty``. ``run()`` checks that without re-reading the
+whole ledger or holding locks on ``products``:
+
+1. **Fold.** New movements are added to per-product running sums in
+   ``stock_ledger_totals``. The pass reads primary-key ranges of
+   ``CHUNK_ROWS`` ids past the checkpoint and commits the sums and the
+   checkpoint together, so a crash just redoes one chunk. Only movements
+   older than ``SETTLE_SECONDS`` are folded. Ids are handed out before
+   commit, so this keeps a slow transaction from being skipped. After the
+   first run, each pass reads only the movements written since the last one.
+2. **Compare.** Products are read in id order, ``CHUNK_ROWS`` at a time,
+   with plain (non-locking) reads and joined to their sums.
+3. **Confirm.** Products that differ are re-read inside a consistent
+   snapshot, together with their movements past the checkpoint. A route
+   changes stock and writes its movement in one transaction, so the two
+   always agree in a snapshot, even while tills keep selling.
+
+The result is stored in ``stock_mismatches`` for the ``/stock_reconciliation``
+page. With ``repair=True`` each mismatch gets a ``RECONCILE`` movement for
+the difference: the stock counter is what tills sell against, and the known
+drift comes from edits that changed it without writing a movement.
+
+    python reconcile.py              # report
+    python reconcile.py --repair     # report and write RECONCILE movements
+    python reconcile.py --full       # re-fold the ledger from the start
+"""
+import sys
+import time
+from collections import namedtuple
+
+import db
+from db import get_db_connection
+
+CHUNK_ROWS = 100000
+CONFIRM_BATCH = 500
+SETTLE_SECONDS = 60
+CHECKPOINT = "stock_ledger"
+
+Mismatch = namedtuple("Mismatch", "product_id name stock ledger_qty difference checked_at repaired")
+Result = namedtuple("Result", "folded products mismatches repaired")
+
+
+# -----------------------
+# FOLD
+# -----------------------
+def _checkpoint(cur):
+    cur.execute("SELECT last_id FROM job_checkpoints WHERE job = %s", (CHECKPOINT,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def fold(conn, chunk_rows=CHUNK_ROWS):
+    """Add settled movements past the checkpoint to ``stock_ledger_totals``.
+
+    Returns ``(rows folded, checkpoint)``.
+    """
+    cur = conn.cursor()
+    try:
+        last_id = _checkpoint(cur)
+        cur.execute("""
+            SELECT COALESCE(MAX(id), 0) FROM stock_movements
+            WHERE created_at < NOW() - INTERVAL %s SECOND
+        """, (SETTLE_SECONDS,))
+        high = max(cur.fetchone()[0], last_id)
+        conn.commit()
+
+        folded = 0
+        while last_id < high:
+            upper = min(last_id + chunk_rows, high)
+            cur.execute("""
+                SELECT product_id, SUM(change_qty), COUNT(*)
+                FROM stock_movements
+                WHERE id > %s AND id <= %s AND product_id IS NOT NULL
+                GROUP BY product_id
+            """, (last_id, upper))
+            sums = cur.fetchall()
+            cur.executemany("""
+                INSERT INTO stock_ledger_totals (product_id, ledger_qty, movement_count)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    ledger_qty = ledger_qty + VALUES(ledger_qty),
+                    movement_count = movement_count + VALUES(movement_count)
+            """, [(pid, int(qty or 0), count) for pid, qty, count in sums])
+            cur.execute("""
+                INSERT INTO job_checkpoints (job, last_id) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)
+            """, (CHECKPOINT, upper))
+            conn.commit()
+            folded += sum(count for _, _, count in sums)
+            last_id = upper
+        return folded, last_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def reset(conn):
+    """Forget the folded sums, so the next ``fold()`` re-reads the whole ledger."""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM stock_ledger_totals")
+    cur.execute("DELETE FROM job_checkpoints WHERE job = %s", (CHECKPOINT,))
+    conn.commit()
+    cur.close()
+
+
+# -----------------------
+# COMPARE
+# -----------------------
+def candidates(conn, chunk_rows=CHUNK_ROWS):
+    """Yield ``(products checked, [product_id, ...])`` per chunk whose stock differs from the folded sum."""
+    cur = conn.cursor()
+    last_id = 0
+    try:
+        while True:
+            cur.execute("""
+                SELECT p.id, p.stock, COALESCE(t.ledger_qty, 0)
+                FROM products p
+                LEFT JOIN stock_ledger_totals t ON t.product_id = p.id
+                WHERE p.id > %s
+                ORDER BY p.id
+                LIMIT %s
+            """, (last_id, chunk_rows))
+            rows = cur.fetchall()
+            conn.commit()  # end the read view; nothing here is locked
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            yield len(rows), [pid for pid, stock, ledger in rows if (stock or 0) != ledger]
+            if len(rows) < chunk_rows:
+                break
+    finally:
+        cur.close()
+
+
+def confirm(conn, product_ids, checkpoint):
+    """``Mismatch`` rows for products whose stock and full ledger really differ.
+
+    Stock, folded sums and the unfolded tail of each product's movements are
+    read in one consistent snapshot, without locks.
+    """
+    if not product_ids:
+        return []
+    ids = db.in_clause(product_ids)
+    cur = conn.cursor()
+    try:
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+        cur.execute(f"""
+            SELECT p.id, p.name, p.stock, COALESCE(t.ledger_qty, 0)
+            FROM products p
+            LEFT JOIN stock_ledger_totals t ON t.product_id = p.id
+            WHERE p.id IN ({ids})
+        """, product_ids)
+        products = cur.fetchall()
+        cur.execute(f"""
+            SELECT product_id, SUM(change_qty)
+            FROM stock_movements
+            WHERE product_id IN ({ids}) AND id > %s
+            GROUP BY product_id
+        """, [*product_ids, checkpoint])
+        tail = {pid: int(qty or 0) for pid, qty in cur.fetchall()}
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    mismatches = []
+    for pid, name, stock, folded in products:
+        ledger = int(folded) + tail.get(pid, 0)
+        if (stock or 0) != ledger:
+            mismatches.append(Mismatch(pid, name, stock or 0, ledger, (stock or 0) - ledger, None, 0))
+    return mismatches
+
+
+# -----------------------
+# REPAIR AND REPORT
+# -----------------------
+def repair(conn, mismatches, user_id):
+    """Write a ``RECONCILE`` movement for each mismatch; ``products`` is not touched."""
+    if not mismatches:
+        return 0
+    cur = conn.cursor()
+    cur.executemany("""
+        INSERT INTO stock_movements (product_id, change_qty, movement_type, created_by)
+        VALUES (%s, %s, 'RECONCILE', %s)
+    """, [(m.product_id, m.difference, user_id) for m in mismatches])
+    cur.close()
+    return len(mismatches)
+
+
+def save_report(conn, mismatches, repaired=False):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM stock_mismatches")
+    for start in range(0, len(mismatches), 1000):
+        cur.executemany("""
+            INSERT INTO stock_mismatches (product_id, stock, ledger_qty, difference, repaired)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [(m.product_id, m.stock, m.ledger_qty, m.difference, int(repaired))
+              for m in mismatches[start:start + 1000]])
+    cur.close()
+
+
+def default_user(conn):
+    """The first admin, who owns repairs made from the command line."""
+    row = db.query_one(conn, "SELECT id FROM users WHERE role = 'admin' ORDER BY id LIMIT 1")
+    return row[0] if row else None
+
+
+def run(repair_mismatches=False, user_id=None, full=False, conn=None):
+    """Fold, compare, confirm and (optionally) repair; returns a ``Result``."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if not conn:
+            print("Reconciliation: database connection error")
+            return None
+    try:
+        if full:
+            reset(conn)
+        folded, checkpoint = fold(conn)
+        checked = 0
+        mismatches = []
+        for count, ids in candidates(conn):
+            checked += count
+            for start in range(0, len(ids), CONFIRM_BATCH):
+                mismatches.extend(confirm(conn, ids[start:start + CONFIRM_BATCH], checkpoint))
+
+        repaired = 0
+        if repair_mismatches and mismatches:
+            repaired = repair(conn, mismatches, user_id or default_user(conn))
+        save_report(conn, mismatches, repaired=bool(repaired))
+        conn.commit()
+        return Result(folded, checked, mismatches, repaired)
+    except Exception as e:
+        conn.rollback()
+        print(f"Reconciliation failed: {e}")
+        return None
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def repair_reported(conn, user_id):
+    """Re-check the products in the last report and repair those still off."""
+    ids = [row[0] for row in db.query_all(conn, "SELECT product_id FROM stock_mismatches WHERE repaired = 0")]
+    checkpoint = db.query_one(conn, "SELECT COALESCE(MAX(last_id), 0) FROM job_checkpoints WHERE job = %s",
+                              (CHECKPOINT,))[0]
+    conn.commit()  # confirm() starts its own snapshot
+    mismatches = []
+    for start in range(0, len(ids), CONFIRM_BATCH):
+        mismatches.extend(confirm(conn, ids[start:start + CONFIRM_BATCH], checkpoint))
+    count = repair(conn, mismatches, user_id)
+    save_report(conn, mismatches, repaired=True)
+    conn.commit()
+    return count
+
+
+# -----------------------
+# READ SIDE
+# -----------------------
+SQL_MISMATCHES = """
+    SELECT m.product_id, p.name, m.stock, m.ledger_qty, m.difference, m.checked_at, m.repaired
+    FROM stock_mismatches m
+    JOIN products p ON p.id = m.product_id
+    ORDER BY ABS(m.difference) DESC, p.name
+"""
+
+
+def mismatches(conn):
+    return db.query_all(conn, SQL_MISMATCHES, row_type=Mismatch)
+
+
+def last_checkpoint(conn):
+    return db.query_one(conn, "SELECT last_id, updated_at FROM job_checkpoints WHERE job = %s", (CHECKPOINT,))
+
+
+if __name__ == "__main__":
+    started = time.time()
+    result = run(repair_mismatches="--repair" in sys.argv, full="--full" in sys.argv)
+    if result is None:
+        sys.exit(1)
+    print(f"Reconciliation: folded {result.folded} movements, checked {result.products} products "
+          f"in {time.time() - started:.1f}s")
+    for m in result.mismatches[:50]:
+        print(f"  #{m.product_id} {m.name}: stock {m.stock}, ledger {m.ledger_qty} ({m.difference:+d})")
+    if len(result.mismatches) > 50:
+        print(f"  ... and {len(result.mismatches) - 50} more")
+    print(f"{len(result.mismatches)} mismatch(es)"
+          + (f", {result.repaired} repaired with RECONCILE movements" if result.repaired else ""))
@@ -0,0 +1,236 @@
+"""Sales returns: credit notes that reverse lines of a bill.
+
+``record()`` takes ``{bill_item_id: quantity}`` for one bill and, inside a
+single transaction, writes the credit note and its lines, marks the
+quantities returned on ``bill_items``, puts the stock back with one UPDATE
+and writes all ``RETURN`` stock movements, outbox events and valuation moves
+with multi-row statements, like a goods-received note (``grn.py``).
+
+Refunds mirror the bill: each returned unit gives back its price less its
+share of the line's promotion, its GST, and its share of the cashier's
+bill-level discount (spread over the bill by net line value). The credit
+note keeps the bill's identity ``total = subtotal + gst_total - discount``.
+
+The rollups move by the return alone, on the day of the return:
+``valuation_daily`` (negative revenue and cost of goods sold), the period
+close (sales net of refunds), ``gst_entries`` (negative tax per rate),
+low-stock alerts and the event log, so reports and analytics never
+recompute history. Closed periods are left as they were.
+"""
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+import alerts
+import db
+import events
+import gst
+import valuation
+
+REFUND_MODES = ("Cash", "Card", "UPI", "Store Credit")
+
+ReturnItem = namedtuple("ReturnItem", "id product_id product_name quantity returned_qty price gst discount")
+ReturnLine = namedtuple("ReturnLine", "item quantity promotion discount gst_amount amount")
+CreditNote = namedtuple("CreditNote", "lines subtotal gst_total discount total revenue")
+
+CREDIT_NOTE_COLUMNS = ("id, credit_note_number, bill_id, reason, refund_mode, subtotal, gst_total, "
+                       "discount, total, created_by, created_at")
+CreditNoteRow = namedtuple("CreditNoteRow", CREDIT_NOTE_COLUMNS)
+
+
+class ReturnError(ValueError):
+    """Invalid return; ``errors`` lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def credit_note_number(now=None):
+    return f"CN{(now or datetime.now()).strftime('%Y%m%d%H%M%S')}"
+
+
+# -----------------------
+# REFUND MATHS
+# -----------------------
+def _money(value):
+    return Decimal(value).quantize(valuation.MONEY_PLACES)
+
+
+def plan(bill_discount, items, quantities):
+    """``CreditNote`` for returning ``quantities`` (``{item_id: qty}``) of ``items``.
+
+    ``items`` are every ``ReturnItem`` of the bill (the flat discount is
+    shared over all of them). Raises ``ReturnError`` for unknown lines or
+    more units than are left to return.
+    """
+    by_id = {item.id: item for item in items}
+    errors = []
+    for item_id, qty in quantities.items():
+        item = by_id.get(item_id)
+        if item is None:
+            errors.append(f"Line {item_id} is not on this bill")
+        elif qty < 0:
+            errors.append(f"{item.product_name}: quantity cannot be negative")
+        elif qty > item.quantity - item.returned_qty:
+            errors.append(f"{item.product_name}: only {item.quantity - item.returned_qty} left to return")
+    if errors:
+        raise ReturnError(errors)
+    if not any(quantities.values()):
+        raise ReturnError(["Select at least one item to return"])
+
+    def net(item):
+        return Decimal(item.price) * item.quantity - Decimal(item.discount)
+
+    bill_net = sum(net(item) for item in items)
+    flat = max(Decimal(bill_discount or 0) - sum(Decimal(item.discount) for item in items), Decimal(0))
+
+    lines = []
+    for item in items:
+        qty = quantities.get(item.id, 0)
+        if not qty:
+            continue
+        promotion = _money(Decimal(item.discount) * qty / item.quantity)
+        line_net = Decimal(item.price) * qty - promotion
+        share = _money(flat * line_net / bill_net) if bill_net > 0 else Decimal(0)
+        gst_amount = _money(line_net * Decimal(item.gst) / 100)
+        lines.append(ReturnLine(item, qty, promotion, promotion + share, gst_amount,
+                                _money(line_net) + gst_amount - share))
+
+    subtotal = _money(sum(Decimal(line.item.price) * line.quantity for line in lines))
+    gst_total = sum(line.gst_amount for line in lines)
+    discount = sum(line.discount for line in lines)
+    return CreditNote(lines, subtotal, gst_total, discount, subtotal + gst_total - discount, subtotal - discount)
+
+
+# -----------------------
+# WRITING
+# -----------------------
+SQL_LOCK_BILL = "SELECT id, bill_number, discount FROM bills_new WHERE id = %s FOR UPDATE"
+SQL_LOCK_ITEMS = """
+    SELECT id, product_id, product_name, quantity, returned_qty, price, gst, discount
+    FROM bill_items WHERE bill_id = %s ORDER BY id FOR UPDATE
+"""
+SQL_INSERT_CREDIT_NOTE = """
+    INSERT INTO credit_notes
+        (credit_note_number, bill_id, reason, refund_mode, subtotal, gst_total, discount, total, created_by)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_INSERT_CREDIT_ITEM = """
+    INSERT INTO credit_note_items
+        (credit_note_id, bill_item_id, product_id, quantity, price, gst, discount, gst_amount, amount)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_LOCK_PRODUCTS = "SELECT id, stock FROM products WHERE id IN ({ids}) ORDER BY id FOR UPDATE"
+SQL_INSERT_MOVEMENT = """
+    INSERT INTO stock_movements (product_id, change_qty, movement_type, reference_id, created_by)
+    VALUES (%s, %s, 'RETURN', %s, %s)
+"""
+
+
+def record(conn, bill_id, quantities, user_id, reason="", refund_mode="Cash", store_id=None):
+    """Return ``quantities`` (``{bill_item_id: qty}``) of a bill; returns ``(credit_note_id, number, CreditNote)``.
+
+    Everything happens on ``conn`` in one transaction; the caller commits.
+    The bill and its lines are locked first, so two returns of the same bill
+    cannot both take the last units.
+    """
+    cur = conn.cursor()
+    cur.execute(SQL_LOCK_BILL, (bill_id,))
+    bill = cur.fetchone()
+    if bill is None:
+        cur.close()
+        raise ReturnError(["Bill not found"])
+    _, bill_number, bill_discount = bill
+    cur.execute(SQL_LOCK_ITEMS, (bill_id,))
+    note = plan(bill_discount, [ReturnItem(*row) for row in cur.fetchall()], quantities)
+
+    now = datetime.now()
+    number = credit_note_number(now)
+    cur.execute(SQL_INSERT_CREDIT_NOTE, (number, bill_id, reason, refund_mode, note.subtotal,
+                                         note.gst_total, note.discount, note.total, user_id))
+    credit_note_id = cur.lastrowid
+    cur.executemany(SQL_INSERT_CREDIT_ITEM, [
+        (credit_note_id, line.item.id, line.item.product_id, line.quantity, line.item.price, line.item.gst,
+         line.discount, line.gst_amount, line.amount)
+        for line in note.lines
+    ])
+    cur.executemany(gst.SQL_INSERT_ENTRY, gst.entry_rows(bill_id, gst.slabs(
+        (line.item.gst, Decimal(line.item.price) * line.quantity - line.promotion, line.gst_amount)
+        for line in note.lines
+    ), now, store_id, credit_note_id, sign=-1))
+    cur.executemany("UPDATE bill_items SET returned_qty = returned_qty + %s WHERE id = %s",
+                    [(line.quantity, line.item.id) for line in note.lines])
+
+    # Stock goes back to products that still exist, in id order like every
+    # other multi-product write, with one UPDATE
+    changes = {}
+    for line in note.lines:
+        if line.item.product_id is not None:
+            changes[line.item.product_id] = changes.get(line.item.product_id, 0) + line.quantity
+    ids = sorted(changes)
+    stock = {}
+    if ids:
+        cur.execute(SQL_LOCK_PRODUCTS.format(ids=db.in_clause(ids)), ids)
+        stock = dict(cur.fetchall())
+        changes = {pid: qty for pid, qty in changes.items() if pid in stock}
+    if changes:
+        table, params = db.values_table(sorted(changes.items()), ("id", "qty"))
+        cur.execute(f"""
+            UPDATE products p
+            JOIN ({table}) t ON t.id = p.id
+            SET p.stock = p.stock + t.qty
+        """, params)
+    restocked = [line for line in note.lines if line.item.product_id in changes]
+    cur.executemany(SQL_INSERT_MOVEMENT, [
+        (line.item.product_id, line.quantity, credit_note_id, user_id) for line in restocked
+    ])
+
+    outbox = [(events.SALE_RETURNED, credit_note_id, {
+        "credit_note_id": credit_note_id,
+        "credit_note_number": number,
+        "bill_id": bill_id,
+        "bill_number": bill_number,
+        "total": note.total,
+        "subtotal": note.subtotal,
+        "gst_total": note.gst_total,
+        "discount": note.discount,
+        "refund_mode": refund_mode,
+        "reason": reason,
+        "created_by": user_id,
+        "store_id": store_id,
+        "items": [{
+            "bill_item_id": line.item.id,
+            "product_id": line.item.product_id,
+            "name": line.item.product_name,
+            "qty": line.quantity,
+            "amount": line.amount,
+        } for line in note.lines],
+    })]
+    for line in restocked:
+        stock[line.item.product_id] += line.quantity
+        outbox.append((events.STOCK_CHANGED, line.item.product_id, {
+            "product_id": line.item.product_id,
+            "change_qty": line.quantity,
+            "movement_type": "RETURN",
+            "reference_id": credit_note_id,
+            "stock_after": stock[line.item.product_id],
+        }))
+    events.record_many(cur, outbox)
+    alerts.record_crossings(conn, changes=changes)
+    valuation.record(conn, [
+        valuation.Move(line.item.product_id, line.quantity, movement_type="RETURN", reference_id=credit_note_id)
+        for line in restocked
+    ], user_id, store_id, revenue=-note.revenue)
+    cur.close()
+    return credit_note_id, number, note
+
+
+# -----------------------
+# READ SIDE
+# -----------------------
+SQL_BILL_CREDIT_NOTES = f"SELECT {CREDIT_NOTE_COLUMNS} FROM credit_notes WHERE bill_id = %s ORDER BY id"
+
+
+def bill_credit_notes(conn, bill_id):
+    return db.query_all(conn, SQL_BILL_CREDIT_NOTES, (bill_id,), CreditNoteRow)
@@ -0,0 +1,306 @@
+"""Server-side login sessions and a per-worker cache of user roles.
+
+The session cookie only carries a random id; the session data lives in a
+store on the server, so a session can be revoked (logout everywhere, user
+deactivated) without waiting for the cookie to expire. Two stores mirror the
+page cache backends:
+
+* ``SQLiteSessionStore`` (default) - a shared SQLite file so every gunicorn
+  worker (and the async till API) sees the same sessions.
+* ``MemorySessionStore`` - per-process dict, only for a single process
+  (tests, ``python app.py``); gunicorn refuses it with more than one worker.
+
+Select one with ``SESSION_BACKEND`` ("sqlite" or "memory") and
+``SESSION_PATH`` in the app config.
+
+``current_user()`` resolves the logged-in user's role, store and active flag
+through a small LRU cache. Entries are tagged with the page cache's "users"
+namespace version, so ``cache.invalidate("users")`` after a role change makes
+every worker reload the user on its next request (the page cache is shared
+between workers unless ``CACHE_BACKEND=memory``).
+
+With several tenants, sessions record the tenant they logged in to and user
+ids are qualified by it (``owner()``), since each tenant numbers its users
+from 1.
+"""
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import cache
+import db
+import tenants
+from db import get_db_connection
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 300
+
+UserInfo = namedtuple("UserInfo", "id role store_id active")
+
+
+# -----------------------
+# STORES
+# -----------------------
+class MemorySessionStore:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            data, _, expires = entry
+            if expires < time.time():
+                del self._data[sid]
+                return None
+            return dict(data)
+
+    def save(self, sid, data, user_id, ttl):
+        with self._lock:
+            self._data[sid] = (dict(data), user_id, time.time() + ttl)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for sid in [sid for sid, entry in self._data.items() if entry[1] == user_id]:
+                del self._data[sid]
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            for sid in [sid for sid, entry in self._data.items() if entry[2] < now]:
+                del self._data[sid]
+
+
+class SQLiteSessionStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                user_id INTEGER,
+                data BLOB,
+                expires REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id)")
+        conn.commit()
+
+    def _conn(self):
+        # A connection opened before a fork (gunicorn --preload) must not be
+        # used by the worker, so connections are per process and thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute("SELECT data, expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self.delete(sid)
+            return None
+        return pickle.loads(row[0])
+
+    def save(self, sid, data, user_id, ttl):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (sid, user_id, data, expires) VALUES (?, ?, ?, ?)",
+            (sid, user_id, pickle.dumps(dict(data), pickle.HIGHEST_PROTOCOL), time.time() + ttl)
+        )
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def delete_user(self, user_id):
+        self._conn().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def purge(self):
+        self._conn().execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+
+# -----------------------
+# FLASK SESSION INTERFACE
+# -----------------------
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def _ttl(self, app):
+        return int(app.permanent_session_lifetime.total_seconds())
+
+    def load(self, sid):
+        """Session data for a cookie value, or ``None``."""
+        if not sid:
+            return None
+        try:
+            return self.store.get(sid)
+        except Exception as e:
+            print(f"Error loading session: {e}")
+            return None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        data = self.load(sid)
+        if data is None:
+            return ServerSession(sid=new_sid(), new=True)
+        return ServerSession(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not (session.modified or session.new or self.should_set_cookie(app, session)):
+            return
+
+        self.store.save(session.sid, session, owner(session.get("user_id"), session.get("tenant")),
+                        self._ttl(app))
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add("Cookie")
+
+
+interface = ServerSessionInterface(MemorySessionStore())
+
+
+def init_app(app):
+    global interface
+    if app.config.get("SESSION_BACKEND", "sqlite") != "memory":
+        store = SQLiteSessionStore(app.config.get("SESSION_PATH", os.path.join("instance", "sessions.sqlite3")))
+    else:
+        store = MemorySessionStore()
+    interface = ServerSessionInterface(store)
+    app.session_interface = interface
+
+
+def rotate(session):
+    """Give ``session`` a fresh id (call on login to prevent session fixation)."""
+    if not session.new:
+        interface.store.delete(session.sid)
+    session.sid = new_sid()
+    session.modified = True
+
+
+def owner(user_id, tenant_slug=None):
+    """Store key for a user's sessions: the id, qualified by tenant if any."""
+    if user_id is None or tenant_slug is None:
+        return user_id
+    return f"{tenant_slug}:{user_id}"
+
+
+def revoke_user(user_id):
+    """End every session of a user (of the current tenant), e.g. after deactivating the account."""
+    tenant = tenants.current()
+    try:
+        interface.store.delete_user(owner(user_id, tenant and tenant.slug))
+    except Exception as e:
+        print(f"Error revoking sessions: {e}")
+
+
+# -----------------------
+# USER CACHE
+# -----------------------
+_users = OrderedDict()
+_users_lock = threading.Lock()
+
+
+def load_user(user_id):
+    """``UserInfo`` from MySQL; inactive if the user no longer exists."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        user = db.query_one(conn, "SELECT id, role, store_id, active FROM users WHERE id = %s",
+                            (user_id,), UserInfo)
+    finally:
+        conn.close()
+    return user or UserInfo(user_id, None, None, 0)
+
+
+def user_info(user_id):
+    """Cached ``UserInfo`` for ``user_id``, or ``None`` if it cannot be loaded."""
+    version = cache.versions(("users",))[0]
+    key = tenants.scope(str(user_id))
+    now = time.time()
+    with _users_lock:
+        entry = _users.get(key)
+        if entry is not None and entry[0] == version and entry[1] > now:
+            _users.move_to_end(key)
+            return entry[2]
+
+    info = load_user(user_id)
+    if info is None:
+        return None
+    with _users_lock:
+        _users[key] = (version, now + USER_CACHE_TTL, info)
+        _users.move_to_end(key)
+        while len(_users) > USER_CACHE_SIZE:
+            _users.popitem(last=False)
+    return info
+
+
+def current_user(session):
+    """Re-check a logged-in session against the user's current role and status.
+
+    Returns ``False`` when the account is gone or deactivated. Role and store
+    changes are copied into ``session``. If the database is unreachable the
+    session is trusted as-is.
+    """
+    info = user_info(session["user_id"])
+    if info is None:
+        return True
+    if not info.active:
+        return False
+    if session.get("role") != info.role:
+        session["role"] = info.role
+    if session.get("store_id") != info.store_id:
+        session["store_id"] = info.store_id
+    return True
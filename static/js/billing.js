@@ -0,0 +1,474 @@
+function updateScanStatus(message, isError = false) {
+    const statusDiv = document.getElementById('scanStatus');
+    if (statusDiv) {
+        statusDiv.textContent = message;
+        statusDiv.style.color = isError ? '#dc2626' : '#6b7280';
+    }
+}
+
+function checkLibraries() {
+    const html5Available = typeof Html5Qrcode !== 'undefined';
+
+    alert(`Library Status:
+Html5Qrcode: ${html5Available ? '✅ Loaded' : '❌ Not loaded'}
+
+If library is not loaded, check your internet connection and refresh the page.`);
+}
+
+// Check library loading
+window.addEventListener('load', function() {
+    console.log('Page loaded, checking libraries...');
+    console.log('Html5Qrcode available:', typeof Html5Qrcode !== 'undefined');
+    console.log('QRCode available:', typeof QRCode !== 'undefined');
+
+    setTimeout(function() {
+        if (typeof Html5Qrcode === 'undefined') {
+            console.error('Html5Qrcode library failed to load');
+            updateScanStatus('Scanner library failed to load. Please check your internet connection and refresh the page.', true);
+            document.getElementById('startScanBtn').disabled = true;
+            document.getElementById('startScanBtn').textContent = 'Scanner Unavailable';
+        } else {
+            console.log('Html5Qrcode library loaded successfully');
+            updateScanStatus('Scanner ready - click "Start Camera Scan" to begin');
+        }
+
+        if (typeof QRCode === 'undefined') {
+            console.warn('QRCode library failed to load - QR generation will not work');
+        } else {
+            console.log('QRCode library loaded successfully');
+        }
+    }, 1000);
+});
+
+let cart = [];
+let offers = [];      // promotion discount per cart line, priced by the server
+let quoteRequest = 0;
+
+function renderProductOptions() {
+    const select = document.getElementById('productSelect');
+    const selected = select.value;
+    select.length = 1;  // keep the placeholder
+    Catalog.inStock().forEach(p => {
+        const option = document.createElement('option');
+        option.value = p.id;
+        option.dataset.name = p.name;
+        option.dataset.price = p.price;
+        option.dataset.gst = p.gst;
+        option.dataset.stock = p.stock;
+        option.textContent = `${p.name} - ₹${p.price.toFixed(2)} (Stock: ${p.stock})`;
+        select.appendChild(option);
+    });
+    select.value = selected;
+}
+
+Catalog.onChange(renderProductOptions);
+Catalog.start();
+
+function addToCart() {
+    const select = document.getElementById('productSelect');
+    const qty = parseInt(document.getElementById('quantityInput').value);
+
+    if (!select.value) { alert('Please select a product'); return; }
+    if (qty < 1) { alert('Quantity must be at least 1'); return; }
+
+    const option = select.options[select.selectedIndex];
+    const productId = select.value;
+    const name = option.dataset.name;
+    const price = parseFloat(option.dataset.price);
+    const gst = parseFloat(option.dataset.gst);
+    const stock = parseInt(option.dataset.stock);
+
+    const existing = cart.find(item => item.id === productId);
+    if (existing) {
+        if (existing.qty + qty <= stock) existing.qty += qty;
+        else { alert('Not enough stock!'); return; }
+    } else {
+        if (qty > stock) { alert('Not enough stock!'); return; }
+        cart.push({ id: productId, name, price, gst, qty, stock });
+    }
+
+    updateCart();
+    select.value = '';
+    document.getElementById('quantityInput').value = 1;
+}
+
+function removeFromCart(index) {
+    cart.splice(index, 1);
+    updateCart();
+}
+
+function updateCart() {
+    offers = [];
+    renderCart();
+    refreshOffers();
+}
+
+// Promotions are evaluated on the server; fetch this cart's discounts so the
+// total shown is the total that will be charged
+function refreshOffers() {
+    const request = ++quoteRequest;
+    if (cart.length === 0) return;
+    fetch('/api/checkout/quote', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({ cart })
+    })
+    .then(res => (res.ok ? res.json() : null))
+    .then(quote => {
+        // Ignore answers for a cart that has changed since
+        if (!quote || request !== quoteRequest) return;
+        offers = quote.lines.map(line => line.discount);
+        renderCart();
+    })
+    .catch(err => console.warn('Could not load offers:', err));
+}
+
+function renderCart() {
+    const tbody = document.getElementById('cartBody');
+    if (cart.length === 0) {
+        tbody.innerHTML = '<tr><td colspan="5" class="empty-cart">Cart is empty</td></tr>';
+        document.getElementById('checkoutBtn').disabled = true;
+    } else {
+        tbody.innerHTML = cart.map((item, index) => {
+            const offer = offers[index] || 0;
+            const itemSubtotal = item.price * item.qty - offer;
+            const itemGst = itemSubtotal * (item.gst / 100);
+            const itemTotal = itemSubtotal + itemGst;
+            const offerNote = offer ? `<br><small style="color: #059669;">Offer −₹${offer.toFixed(2)}</small>` : '';
+            return `
+                <tr>
+                    <td><strong>${item.name}</strong>${offerNote}</td>
+                    <td>₹${item.price.toFixed(2)}</td>
+                    <td>${item.qty}</td>
+                    <td>₹${itemTotal.toFixed(2)}</td>
+                    <td><button class="btn-remove" onclick="removeFromCart(${index})">Remove</button></td>
+                </tr>
+            `;
+        }).join('');
+        document.getElementById('checkoutBtn').disabled = false;
+    }
+    updateTotal();
+}
+
+function updateTotal() {
+    let subtotal = 0, gstTotal = 0, offersTotal = 0;
+    cart.forEach((item, index) => {
+        const offer = offers[index] || 0;
+        const itemSubtotal = item.price * item.qty;
+        const itemGst = (itemSubtotal - offer) * (item.gst / 100);
+        subtotal += itemSubtotal;
+        gstTotal += itemGst;
+        offersTotal += offer;
+    });
+    const discount = parseFloat(document.getElementById('discount').value) || 0;
+    const grandTotal = subtotal - offersTotal + gstTotal - discount;
+    document.getElementById('offersRow').style.display = offersTotal ? '' : 'none';
+    document.getElementById('offersTotal').textContent = offersTotal.toFixed(2);
+    document.getElementById('subtotal').textContent = subtotal.toFixed(2);
+    document.getElementById('gstTotal').textContent = gstTotal.toFixed(2);
+    document.getElementById('grandTotal').textContent = grandTotal.toFixed(2);
+}
+
+function checkout() {
+    if (cart.length === 0) { alert('Cart is empty!'); return; }
+    const discount = parseFloat(document.getElementById('discount').value) || 0;
+    const paymentMode = document.getElementById('paymentMode').value;
+
+    fetch('/process_checkout', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({ cart, discount, payment_mode: paymentMode })
+    })
+    .then(res => res.json())
+    .then(data => {
+        if (data.success) {
+            // Show print options modal instead of alert
+            showPrintOptionsModal(data.bill_number, data.bill_id, data.total);
+
+            // Pick up the new stock levels
+            Catalog.sync();
+
+            // Clear cart
+            cart = [];
+            updateCart();
+            document.getElementById('discount').value = 0;
+            document.getElementById('productSelect').value = '';
+            document.getElementById('quantityInput').value = 1;
+        } else {
+            alert('Error: ' + data.message);
+        }
+    })
+    .catch(err => {
+        console.error(err);
+        alert('An error occurred during checkout');
+    });
+}
+
+// Print Options Modal Functions
+function showPrintOptionsModal(billNumber, billId, total) {
+    const modalHTML = `
+        <div id="printModal" class="modal-overlay">
+            <div class="modal-content">
+                <div class="success-icon">
+                    <span>✓</span>
+                </div>
+
+                <h2>Bill Generated Successfully!</h2>
+                <p class="bill-number">Bill Number: <strong>${billNumber}</strong></p>
+                <p class="bill-total">₹${total.toFixed(2)}</p>
+
+                <div class="modal-buttons">
+                    <button class="modal-btn modal-btn-primary" onclick="printBillA4(${billId})">
+                        <span style="font-size: 20px;">🖨️</span>
+                        Print A4 Invoice
+                    </button>
+
+                    <button class="modal-btn modal-btn-success" onclick="printBillThermal(${billId})">
+                        <span style="font-size: 20px;">🧾</span>
+                        Print Thermal Receipt
+                    </button>
+
+                    <button class="modal-btn modal-btn-secondary" onclick="viewBill(${billId})">
+                        <span style="font-size: 20px;">👁️</span>
+                        View Bill Details
+                    </button>
+                </div>
+
+                <button class="modal-close" onclick="closeModal()">
+                    Close and Continue Billing
+                </button>
+            </div>
+        </div>
+    `;
+
+    document.body.insertAdjacentHTML('beforeend', modalHTML);
+}
+
+function printBillA4(billId) {
+    window.open('/print_bill_a4/' + billId, '_blank');
+}
+
+function printBillThermal(billId) {
+    window.open('/print_bill_thermal/' + billId, '_blank');
+}
+
+function viewBill(billId) {
+    window.location.href = '/view_bill/' + billId;
+}
+
+function closeModal() {
+    const modal = document.getElementById('printModal');
+    if (modal) {
+        modal.remove();
+    }
+}
+
+// Product Scanning Functions
+let html5QrCode = null;
+let isScanning = false;
+
+function startScanner() {
+    if (isScanning) return;
+
+    if (typeof Html5Qrcode === 'undefined') {
+        updateScanStatus('Scanner library not loaded. Please refresh the page and check your internet connection.', true);
+        alert('The QR scanner library failed to load. Please:\n1. Check your internet connection\n2. Refresh the page\n3. Try a different browser');
+        return;
+    }
+
+    updateScanStatus('Initializing camera...');
+
+    if (!navigator.mediaDevices || !navigator.mediaDevices.getUserMedia) {
+        updateScanStatus('Camera not supported in this browser', true);
+        alert('Camera is not supported in this browser. Please use a modern browser like Chrome, Firefox, or Edge.');
+        return;
+    }
+
+    if (location.protocol !== 'https:' && location.hostname !== 'localhost' && location.hostname !== '127.0.0.1') {
+        updateScanStatus('Camera requires HTTPS or localhost', true);
+        alert('Camera access requires HTTPS or localhost. For demo purposes, please access this page via https:// or localhost.');
+        return;
+    }
+
+    try {
+        if (!html5QrCode) {
+            html5QrCode = new Html5Qrcode("qr-reader");
+        }
+
+        const config = {
+            fps: 10,
+            qrbox: { width: 250, height: 250 },
+            aspectRatio: 1.0
+        };
+
+        html5QrCode.start(
+            { facingMode: "environment" },
+            config,
+            (decodedText, decodedResult) => {
+                updateScanStatus('QR Code detected!');
+                console.log('QR Code detected:', decodedText);
+                stopScanner();
+                document.getElementById('productCodeInput').value = decodedText.toUpperCase();
+                setTimeout(() => fetchProductByCode(), 500);
+            },
+            (errorMessage) => {
+                console.log('Scan error:', errorMessage);
+            }
+        ).then(() => {
+            isScanning = true;
+            document.getElementById('startScanBtn').style.display = 'none';
+            document.getElementById('stopScanBtn').style.display = 'inline-block';
+            updateScanStatus('Camera active - point at QR code');
+        }).catch((err) => {
+            console.error('Failed to start scanner:', err);
+            updateScanStatus('Failed to access camera: ' + err.message, true);
+
+            if (err.message.includes('environment')) {
+                updateScanStatus('Trying front camera...');
+                html5QrCode.start(
+                    { facingMode: "user" },
+                    config,
+                    (decodedText, decodedResult) => {
+                        updateScanStatus('QR Code detected!');
+                        stopScanner();
+                        document.getElementById('productCodeInput').value = decodedText.toUpperCase();
+                        setTimeout(() => fetchProductByCode(), 500);
+                    },
+                    (errorMessage) => {
+                        console.log('Scan error:', errorMessage);
+                    }
+                ).then(() => {
+                    isScanning = true;
+                    document.getElementById('startScanBtn').style.display = 'none';
+                    document.getElementById('stopScanBtn').style.display = 'inline-block';
+                    updateScanStatus('Front camera active - point at QR code');
+                }).catch((frontErr) => {
+                    updateScanStatus('Camera access failed. Please check permissions.', true);
+                    alert('Camera access failed. Please:\n1. Allow camera permissions\n2. Make sure no other app is using the camera\n3. Try refreshing the page');
+                });
+            }
+        });
+    } catch (err) {
+        updateScanStatus('Error initializing scanner: ' + err.message, true);
+        alert('Error initializing scanner: ' + err.message);
+    }
+}
+
+function stopScanner() {
+    if (html5QrCode && isScanning) {
+        html5QrCode.stop().then(() => {
+            isScanning = false;
+            document.getElementById('startScanBtn').style.display = 'inline-block';
+            document.getElementById('stopScanBtn').style.display = 'none';
+            updateScanStatus('Camera stopped');
+        }).catch((err) => {
+            console.error('Error stopping scanner:', err);
+            updateScanStatus('Error stopping camera', true);
+        });
+    }
+}
+
+function fetchProductByCode() {
+    const productCode = document.getElementById('productCodeInput').value.trim().toUpperCase();
+    if (!productCode) {
+        showScanError('Please enter a product code');
+        return;
+    }
+
+    // Resolve from the local catalog; only unknown codes go to the server
+    const local = Catalog.byCode(productCode);
+    if (local && local.stock > 0) {
+        showProductDetails(local);
+        hideScanError();
+        return;
+    }
+
+    fetch('/get_product_by_code', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({ product_code: productCode })
+    })
+    .then(res => res.json())
+    .then(data => {
+        if (data.error) {
+            showScanError(data.error);
+            hideProductDetails();
+        } else {
+            showProductDetails(data);
+            hideScanError();
+        }
+    })
+    .catch(err => {
+        showScanError('Error fetching product: ' + err);
+        hideProductDetails();
+    });
+}
+
+function showProductDetails(product) {
+    const detailsDiv = document.getElementById('productDetails');
+    const infoDiv = document.getElementById('productInfo');
+
+    infoDiv.innerHTML = `
+        <p><strong>Name:</strong> ${product.name}</p>
+        <p><strong>Price:</strong> ₹${parseFloat(product.price).toFixed(2)}</p>
+        <p><strong>GST:</strong> ${product.gst}%</p>
+        <p><strong>Available Stock:</strong> ${product.stock}</p>
+    `;
+
+    detailsDiv.dataset.productId = product.id;
+    detailsDiv.dataset.productName = product.name;
+    detailsDiv.dataset.productPrice = product.price;
+    detailsDiv.dataset.productGst = product.gst;
+
+    detailsDiv.style.display = 'block';
+}
+
+function hideProductDetails() {
+    document.getElementById('productDetails').style.display = 'none';
+}
+
+function showScanError(message) {
+    const errorDiv = document.getElementById('scanError');
+    errorDiv.textContent = message;
+    errorDiv.style.display = 'block';
+}
+
+function hideScanError() {
+    document.getElementById('scanError').style.display = 'none';
+}
+
+function addScannedToCart() {
+    const detailsDiv = document.getElementById('productDetails');
+    const qty = parseInt(document.getElementById('scanQuantityInput').value);
+
+    if (!detailsDiv.dataset.productId) {
+        alert('No product selected');
+        return;
+    }
+
+    if (qty < 1) {
+        alert('Quantity must be at least 1');
+        return;
+    }
+
+    const productId = parseInt(detailsDiv.dataset.productId);
+    const name = detailsDiv.dataset.productName;
+    const price = parseFloat(detailsDiv.dataset.productPrice);
+    const gst = parseFloat(detailsDiv.dataset.productGst);
+
+    const existingIndex = cart.findIndex(item => item.id === productId);
+    if (existingIndex >= 0) {
+        cart[existingIndex].qty += qty;
+    } else {
+        cart.push({ id: productId, name, price, gst, qty });
+    }
+
+    updateCart();
+
+    document.getElementById('productCodeInput').value = '';
+    document.getElementById('scanQuantityInput').value = 1;
+    hideProductDetails();
+    hideScanError();
+
+    alert('Product added to cart!');
+}
@@ -0,0 +1,109 @@
+// Till-side product catalog.
+//
+// Products are kept in IndexedDB and mirrored in memory, and refreshed with
+// small deltas from /api/catalog/changes every SYNC_INTERVAL ms (and after
+// each checkout), so scans and the product list resolve locally without a
+// server round-trip. Without IndexedDB (e.g. private browsing) the catalog
+// lives in memory only and is fetched in full when the page opens.
+const Catalog = (() => {
+    const DB_NAME = 'till-catalog';
+    const SYNC_INTERVAL = 30000;
+
+    const products = new Map();  // id -> product
+    const byCode = new Map();    // product_code -> product
+    const listeners = [];
+    let version = 0;
+    let db = null;
+    let syncing = null;
+
+    function openDb() {
+        return new Promise(resolve => {
+            if (!window.indexedDB) return resolve(null);
+            const request = indexedDB.open(DB_NAME, 1);
+            request.onupgradeneeded = () => {
+                request.result.createObjectStore('products', { keyPath: 'id' });
+                request.result.createObjectStore('meta');
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => resolve(null);
+        });
+    }
+
+    function put(product) {
+        const old = products.get(product.id);
+        if (old && old.product_code) byCode.delete(old.product_code);
+        products.set(product.id, product);
+        if (product.product_code) byCode.set(product.product_code, product);
+    }
+
+    function remove(id) {
+        const old = products.get(id);
+        if (old && old.product_code) byCode.delete(old.product_code);
+        products.delete(id);
+    }
+
+    function load() {
+        return new Promise(resolve => {
+            if (!db) return resolve();
+            const tx = db.transaction(['products', 'meta'], 'readonly');
+            tx.objectStore('products').getAll().onsuccess = e => e.target.result.forEach(put);
+            tx.objectStore('meta').get('version').onsuccess = e => { version = e.target.result || 0; };
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => resolve();
+        });
+    }
+
+    function save(delta) {
+        if (!db) return;
+        const tx = db.transaction(['products', 'meta'], 'readwrite');
+        const store = tx.objectStore('products');
+        if (delta.full) store.clear();
+        delta.products.forEach(p => store.put(p));
+        delta.deleted.forEach(id => store.delete(id));
+        tx.objectStore('meta').put(delta.version, 'version');
+    }
+
+    function apply(delta) {
+        if (delta.full) {
+            products.clear();
+            byCode.clear();
+        }
+        delta.products.forEach(put);
+        delta.deleted.forEach(remove);
+        version = delta.version;
+        save(delta);
+        if (delta.full || delta.products.length || delta.deleted.length) {
+            listeners.forEach(listener => listener());
+        }
+    }
+
+    function sync() {
+        // One request at a time; callers share the one in flight
+        if (!syncing) {
+            syncing = fetch('/api/catalog/changes?since=' + version, { credentials: 'same-origin' })
+                .then(res => (res.ok ? res.json() : null))
+                .then(delta => { if (delta) apply(delta); })
+                .catch(err => console.warn('Catalog sync failed:', err))
+                .finally(() => { syncing = null; });
+        }
+        return syncing;
+    }
+
+    async function start() {
+        db = await openDb();
+        await load();
+        if (products.size) listeners.forEach(listener => listener());
+        await sync();
+        setInterval(sync, SYNC_INTERVAL);
+    }
+
+    return {
+        start,
+        sync,
+        byCode: code => byCode.get(code),
+        inStock: () => [...products.values()]
+            .filter(p => p.stock > 0)
+            .sort((a, b) => a.name.localeCompare(b.name)),
+        onChange: listener => listeners.push(listener),
+    };
+})();
@@ -0,0 +1,261 @@
+"""Tenant directory: which MySQL server and database hold each chain's data.
+
+Every tenant (a supermarket chain) has a database of its own, so a large
+chain's tables, indexes and locks never slow down a small shop's queries, and
+tenants can be spread over several MySQL servers ("shards"). The directory is
+a JSON file, ``TENANTS_FILE`` (default ``instance/tenants.json``)::
+
+    {
+      "shards": {
+        "shard-1": {"host": "10.0.0.5"},
+        "shard-2": {"host": "10.0.0.6", "port": 3307, "replicas": "10.0.0.7"}
+      },
+      "tenants": {
+        "freshmart": {"shard": "shard-1", "domains": ["billing.freshmart.in"]},
+        "corner": {"shard": "shard-2", "database": "corner_store"}
+      },
+      "default": "freshmart"
+    }
+
+Shards take ``host``, ``port``, ``user``, ``password`` (defaults from
+``db.DB_CONFIG``) and ``replicas`` (as in ``DB_REPLICAS``). A tenant's
+database defaults to ``supermarket_<slug>``. The file is re-read when it
+changes, so tenants can be added without a restart.
+
+A request's tenant is taken from its host name (a listed domain, or
+``<slug>.<any domain>``), else the company entered on the login form, else
+the login session, else ``default``. While a request runs,
+``db.get_db_connection()`` hands out connections from that tenant's pool,
+and the page cache, sessions, event log and downloads are kept per tenant.
+Without a directory file the app is single-tenant and uses ``db.DB_CONFIG``.
+
+    python tenants.py list
+    python tenants.py run <slug|all> forecast --once
+
+``bootstrap.py`` creates and migrates every tenant database in parallel.
+"""
+import json
+import os
+import re
+import runpy
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, request, session
+
+import db
+
+TENANTS_FILE = os.environ.get("TENANTS_FILE", os.path.join("instance", "tenants.json"))
+TENANT_DIR = os.path.join("instance", "tenants")
+RELOAD_SECONDS = 5
+MIGRATE_WORKERS = 4
+
+NAME_PATTERN = re.compile(r"^[a-z0-9_]{1,48}$")
+
+Tenant = namedtuple("Tenant", "slug config replicas domains")
+
+_tenants = {}
+_domains = {}
+_default = None
+_mtime = None
+_checked = 0
+_lock = threading.Lock()
+
+
+# -----------------------
+# DIRECTORY
+# -----------------------
+def parse(directory):
+    """``({slug: Tenant}, {domain: slug}, default slug)`` from the JSON structure."""
+    shards = directory.get("shards", {})
+    tenants, domains = {}, {}
+    for slug, entry in directory.get("tenants", {}).items():
+        database = entry.get("database", f"supermarket_{slug}")
+        if not NAME_PATTERN.match(slug) or not NAME_PATTERN.match(database):
+            raise ValueError(f"Tenant {slug!r}: names may only use a-z, 0-9 and _")
+        if entry.get("shard") not in shards:
+            raise ValueError(f"Tenant {slug!r}: unknown shard {entry.get('shard')!r}")
+        shard = shards[entry["shard"]]
+        config = dict(db.DB_CONFIG, database=database)
+        config.update((key, shard[key]) for key in ("host", "port", "user", "password") if key in shard)
+        replicas = [dict(replica, user=config["user"], password=config["password"], database=database)
+                    for replica in db.parse_replicas(shard.get("replicas", ""))]
+        tenant_domains = tuple(domain.lower() for domain in entry.get("domains", ()))
+        tenants[slug] = Tenant(slug, config, replicas, tenant_domains)
+        domains.update((domain, slug) for domain in tenant_domains)
+
+    default = directory.get("default")
+    if default is not None and default not in tenants:
+        raise ValueError(f"Default tenant {default!r} is not in the directory")
+    return tenants, domains, default
+
+
+def _reload():
+    global _tenants, _domains, _default, _mtime, _checked
+    now = time.monotonic()
+    if now - _checked < RELOAD_SECONDS:
+        return
+    with _lock:
+        _checked = now
+        try:
+            mtime = os.path.getmtime(TENANTS_FILE)
+        except OSError:
+            mtime = None
+        if mtime == _mtime:
+            return
+        if mtime is None:
+            _tenants, _domains, _default = {}, {}, None
+        else:
+            try:
+                with open(TENANTS_FILE, encoding="utf-8") as f:
+                    _tenants, _domains, _default = parse(json.load(f))
+            except (OSError, ValueError) as e:
+                # Keep serving with the last good directory
+                print(f"Error loading tenant directory: {e}")
+                return
+        _mtime = mtime
+
+
+def enabled():
+    _reload()
+    return bool(_tenants)
+
+
+def get(slug):
+    _reload()
+    return _tenants.get(slug)
+
+
+def all_tenants():
+    _reload()
+    return list(_tenants.values())
+
+
+def from_host(host):
+    """Tenant named by a request's host, e.g. ``freshmart.example.com``."""
+    _reload()
+    host = (host or "").split(":", 1)[0].lower()
+    if host in _domains:
+        return _tenants[_domains[host]]
+    label, dot, _ = host.partition(".")
+    return _tenants.get(label) if dot else None
+
+
+def resolve(host, requested=None, session_tenant=None):
+    """The tenant for a request, or ``None`` if it cannot be told."""
+    tenant = from_host(host)
+    if tenant is None and requested:
+        tenant = get(requested.strip().lower())
+        if tenant is None:
+            return None
+    if tenant is None and session_tenant:
+        tenant = get(session_tenant)
+    if tenant is None and _default:
+        tenant = get(_default)
+    return tenant
+
+
+# -----------------------
+# CURRENT TENANT
+# -----------------------
+def current():
+    return db.current_tenant.get()
+
+
+def scope(name):
+    """``name`` prefixed with the current tenant, for shared caches and stores."""
+    tenant = db.current_tenant.get()
+    return name if tenant is None else f"{tenant.slug}/{name}"
+
+
+def scoped_path(path):
+    """Per-tenant location for a file or directory under ``instance/``."""
+    tenant = db.current_tenant.get()
+    if tenant is None:
+        return path
+    return os.path.join(TENANT_DIR, tenant.slug, os.path.basename(path))
+
+
+def run_for(tenant, job, *args):
+    """Call ``job(*args)`` with ``tenant`` as the current tenant."""
+    token = db.current_tenant.set(tenant)
+    try:
+        return job(*args)
+    finally:
+        db.current_tenant.reset(token)
+
+
+def migrate(job, tenants=None, workers=MIGRATE_WORKERS):
+    """Run ``job()`` (e.g. ``init_database``) for every tenant in parallel.
+
+    Returns ``{slug: result}``; a job that raises counts as ``False``.
+    """
+    tenants = all_tenants() if tenants is None else tenants
+
+    def run(tenant):
+        started = time.monotonic()
+        try:
+            result = run_for(tenant, job)
+        except Exception as e:
+            print(f"[{tenant.slug}] migration failed: {e}")
+            result = False
+        print(f"[{tenant.slug}] {'ok' if result else 'FAILED'} in {time.monotonic() - started:.1f}s")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tenants)))) as pool:
+        return dict(zip((t.slug for t in tenants), pool.map(run, tenants)))
+
+
+# -----------------------
+# REQUESTS
+# -----------------------
+def _before_request():
+    g.tenant = None
+    g.tenant_token = None
+    if not enabled():
+        return
+    requested = request.form.get("tenant") if request.endpoint == "login" and request.method == "POST" else None
+    tenant = resolve(request.host, requested, session.get("tenant"))
+    # A session only ever belongs to the tenant it logged in to
+    if "user_id" in session and (tenant is None or session.get("tenant") != tenant.slug):
+        session.clear()
+    g.tenant = tenant
+    g.tenant_token = db.current_tenant.set(tenant)
+
+
+def _teardown_request(_exc=None):
+    token = g.pop("tenant_token", None)
+    if token is not None:
+        db.current_tenant.reset(token)
+
+
+def init_app(app):
+    if _before_request not in app.before_request_funcs.setdefault(None, []):
+        app.before_request(_before_request)
+        app.teardown_request(_teardown_request)
+        # The login form asks for the company when the host does not name it
+        app.jinja_env.globals["ask_tenant"] = lambda: enabled() and from_host(request.host) is None
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        for tenant in all_tenants():
+            config = tenant.config
+            print(f"{tenant.slug:20} {config['host']}:{config.get('port', 3306)}/{config['database']}"
+                  f"  replicas={len(tenant.replicas)}  domains={','.join(tenant.domains) or '-'}")
+    elif command == "run" and len(sys.argv) >= 4:
+        # Background jobs (forecast, periods, events, analytics, reconcile) for one or all tenants
+        slug, module = sys.argv[2], sys.argv[3]
+        targets = all_tenants() if slug == "all" else [get(slug)]
+        if None in targets:
+            sys.exit(f"Unknown tenant {slug!r}")
+        sys.argv = [module] + sys.argv[4:]
+        for tenant in targets:
+            print(f"[{tenant.slug}] python {module}.py {' '.join(sys.argv[1:])}")
+            run_for(tenant, runpy.run_module, module, None, "__main__")
+    else:
+        print("Usage: python tenants.py [list | run <slug|all> <module> [args]]")
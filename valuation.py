@@ -0,0 +1,273 @@
+"""Moving weighted-average cost and stock valuation.
+
+Every route that moves stock calls ``record()`` inside its own transaction,
+after the ``products`` UPDATE and before ``commit()``. For each move it:
+
+* appends a row to ``valuation_ledger`` (quantity, unit cost, value change
+  and the quantity/average cost afterwards),
+* updates the product's row in ``stock_valuation`` - the current quantity,
+  weighted-average cost and value, indexed for the inventory-value report,
+* adds the purchase value, net revenue, cost of goods sold and write-offs to
+  today's ``valuation_daily`` row for the user's store.
+
+Purchases re-average the cost; sales, returns, write-offs and manual
+corrections move stock out (or in) at the current average. Reports then read these tables
+instead of re-aggregating ``purchases`` and ``bills_new`` history.
+
+Stock is held per product in this schema, not per store, so the cost pool is
+per product while the daily margin figures are split by store.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+import db
+
+COST_PLACES = Decimal("0.0001")
+MONEY_PLACES = Decimal("0.01")
+
+WRITE_OFF_TYPES = ("DAMAGE", "EXPIRED")
+# Returns come back in at the current average and reduce cost of goods sold
+COGS_TYPES = ("SALE", "RETURN")
+
+Move = namedtuple(
+    "Move", "product_id quantity unit_cost movement_type reference_id", defaults=(None, None, None)
+)
+
+ProductValuation = namedtuple("ProductValuation", "product_id quantity avg_cost value updated_at")
+PeriodTotals = namedtuple("PeriodTotals", "purchase_value sales_revenue cogs writeoff_value")
+
+
+def _money(value):
+    return Decimal(value).quantize(MONEY_PLACES, ROUND_HALF_UP)
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value or 0))
+
+
+# -----------------------
+# WRITE SIDE
+# -----------------------
+SQL_LOCK_STATES = """
+    SELECT product_id, quantity, avg_cost FROM stock_valuation
+    WHERE product_id IN ({ids})
+    ORDER BY product_id
+    FOR UPDATE
+"""
+SQL_PRODUCT_COSTS = "SELECT id, stock, cost_price FROM products WHERE id IN ({ids})"
+SQL_INSERT_LEDGER = """
+    INSERT INTO valuation_ledger
+        (product_id, store_id, movement_type, reference_id, quantity,
+         unit_cost, value_change, qty_after, avg_cost_after, created_by)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_SAVE_STATES = """
+    INSERT INTO stock_valuation (product_id, quantity, avg_cost, value)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        quantity = VALUES(quantity), avg_cost = VALUES(avg_cost), value = VALUES(value)
+"""
+SQL_ADD_DAILY = """
+    INSERT INTO valuation_daily (day, store_id, purchase_value, sales_revenue, cogs, writeoff_value)
+    VALUES (CURDATE(), %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        purchase_value = purchase_value + VALUES(purchase_value),
+        sales_revenue = sales_revenue + VALUES(sales_revenue),
+        cogs = cogs + VALUES(cogs),
+        writeoff_value = writeoff_value + VALUES(writeoff_value)
+"""
+
+ValuedMoves = namedtuple("ValuedMoves", "ledger_rows state_rows daily_params cogs")
+
+
+def states_from_rows(locked_rows):
+    """``{product_id: [quantity, avg_cost]}`` from ``SQL_LOCK_STATES`` rows."""
+    return {product_id: [quantity, avg_cost] for product_id, quantity, avg_cost in locked_rows}
+
+
+def add_missing_states(states, moves, product_rows):
+    """Start products with no valuation yet from ``SQL_PRODUCT_COSTS`` rows.
+
+    Their quantity is the current stock minus what this transaction already
+    changed, at the recorded cost price.
+    """
+    net = {}
+    for move in moves:
+        net[move.product_id] = net.get(move.product_id, 0) + move.quantity
+    for product_id, stock, cost_price in product_rows:
+        states[product_id] = [(stock or 0) - net[product_id], _decimal(cost_price)]
+    return states
+
+
+def _load_states(cur, moves):
+    """``{product_id: [quantity, avg_cost]}`` before ``moves``, rows locked."""
+    ids = sorted({move.product_id for move in moves})
+    cur.execute(SQL_LOCK_STATES.format(ids=db.in_clause(ids)), ids)
+    states = states_from_rows(cur.fetchall())
+    missing = [pid for pid in ids if pid not in states]
+    if missing:
+        cur.execute(SQL_PRODUCT_COSTS.format(ids=db.in_clause(missing)), missing)
+        add_missing_states(states, moves, cur.fetchall())
+    return states
+
+
+def apply(states, moves, user_id, store_id=None, revenue=0):
+    """Value ``moves`` against ``states`` (updated in place).
+
+    Returns the parameters for ``SQL_INSERT_LEDGER``, ``SQL_SAVE_STATES``
+    and ``SQL_ADD_DAILY`` plus the cost of goods sold, so any driver can
+    write them.
+    """
+    ledger = []
+    totals = {"purchase_value": Decimal(0), "cogs": Decimal(0), "writeoff_value": Decimal(0)}
+    for move in moves:
+        if move.product_id not in states:
+            continue  # product deleted meanwhile
+        state = states[move.product_id]
+        quantity, avg_cost = state
+        if move.unit_cost is not None and move.quantity > 0:
+            unit_cost = _decimal(move.unit_cost)
+            # Negative stock (oversold) carries no cost, so it does not dilute
+            # the new average
+            base = max(quantity, 0)
+            avg_cost = ((base * avg_cost + move.quantity * unit_cost) / (base + move.quantity)).quantize(COST_PLACES)
+            totals["purchase_value"] += move.quantity * unit_cost
+        else:
+            unit_cost = avg_cost
+        value_change = _money(move.quantity * unit_cost)
+        if move.movement_type in COGS_TYPES:
+            totals["cogs"] -= value_change
+        elif move.movement_type in WRITE_OFF_TYPES:
+            totals["writeoff_value"] -= value_change
+
+        state[0], state[1] = quantity + move.quantity, avg_cost
+        ledger.append((
+            move.product_id, store_id or 0, move.movement_type, move.reference_id, move.quantity,
+            unit_cost, value_change, state[0], avg_cost, user_id,
+        ))
+
+    state_rows = [(pid, quantity, avg_cost, _money(max(quantity, 0) * avg_cost))
+                  for pid, (quantity, avg_cost) in states.items()]
+    daily = (store_id or 0, _money(totals["purchase_value"]), _money(_decimal(revenue)),
+             _money(totals["cogs"]), _money(totals["writeoff_value"]))
+    return ValuedMoves(ledger, state_rows, daily, totals["cogs"])
+
+
+def record(conn, moves, user_id, store_id=None, revenue=0):
+    """Value ``moves`` (a list of ``Move``) on the caller's transaction.
+
+    ``quantity`` is signed like ``stock_movements.change_qty``. Pass
+    ``unit_cost`` for purchases; everything else is valued at the current
+    average. ``revenue`` is the net (ex-GST, after discount) sale amount
+    for checkout (negative for a refund). Returns the cost of goods sold by
+    these moves.
+    """
+    moves = [move for move in moves if move.quantity]
+    if not moves and not revenue:
+        return Decimal(0)
+    cur = conn.cursor()
+    states = _load_states(cur, moves) if moves else {}
+    result = apply(states, moves, user_id, store_id, revenue)
+    cur.executemany(SQL_INSERT_LEDGER, result.ledger_rows)
+    cur.executemany(SQL_SAVE_STATES, result.state_rows)
+    cur.execute(SQL_ADD_DAILY, result.daily_params)
+    cur.close()
+    return result.cogs
+
+
+def seed(cur):
+    """Start valuation for products that have none, and back-fill
+    ``valuation_daily`` from history the first time it is created.
+
+    Historical cost of goods sold uses each product's current cost price,
+    since the average at the time of sale was never recorded.
+    """
+    cur.execute("""
+        INSERT IGNORE INTO stock_valuation (product_id, quantity, avg_cost, value)
+        SELECT id, COALESCE(stock, 0), COALESCE(cost_price, 0),
+               GREATEST(COALESCE(stock, 0), 0) * COALESCE(cost_price, 0)
+        FROM products
+    """)
+    cur.execute("SELECT COUNT(*) FROM valuation_daily")
+    if cur.fetchone()[0]:
+        return
+    cur.execute("""
+        INSERT INTO valuation_daily (day, store_id, purchase_value)
+        SELECT DATE(p.created_at), COALESCE(u.store_id, 0), SUM(p.quantity * p.cost_price)
+        FROM purchases p
+        LEFT JOIN users u ON u.id = p.created_by
+        GROUP BY DATE(p.created_at), COALESCE(u.store_id, 0)
+    """)
+    cur.execute("""
+        INSERT INTO valuation_daily (day, store_id, sales_revenue)
+        SELECT DATE(b.bill_date), COALESCE(u.store_id, 0),
+               SUM(COALESCE(b.subtotal, b.total) - COALESCE(b.discount, 0))
+        FROM bills_new b
+        LEFT JOIN users u ON u.id = b.created_by
+        GROUP BY DATE(b.bill_date), COALESCE(u.store_id, 0)
+        ON DUPLICATE KEY UPDATE sales_revenue = VALUES(sales_revenue)
+    """)
+    cur.execute("""
+        INSERT INTO valuation_daily (day, store_id, cogs, writeoff_value)
+        SELECT DATE(m.created_at), COALESCE(u.store_id, 0),
+               SUM(CASE WHEN m.movement_type IN ('SALE', 'RETURN') THEN -m.change_qty * p.cost_price ELSE 0 END),
+               SUM(CASE WHEN m.movement_type IN ('DAMAGE', 'EXPIRED') THEN -m.change_qty * p.cost_price ELSE 0 END)
+        FROM stock_movements m
+        JOIN products p ON p.id = m.product_id
+        LEFT JOIN users u ON u.id = m.created_by
+        WHERE m.movement_type IN ('SALE', 'RETURN', 'DAMAGE', 'EXPIRED')
+        GROUP BY DATE(m.created_at), COALESCE(u.store_id, 0)
+        ON DUPLICATE KEY UPDATE cogs = VALUES(cogs), writeoff_value = VALUES(writeoff_value)
+    """)
+
+
+# -----------------------
+# READ SIDE
+# -----------------------
+SQL_PRODUCT_VALUATION = """
+    SELECT product_id, quantity, avg_cost, value, updated_at
+    FROM stock_valuation WHERE product_id = %s
+"""
+SQL_INVENTORY_VALUE = "SELECT COALESCE(SUM(value), 0) FROM stock_valuation"
+
+
+def product_valuation(conn, product_id):
+    return db.query_one(conn, SQL_PRODUCT_VALUATION, (product_id,), ProductValuation)
+
+
+def inventory_value(conn):
+    return db.query_one(conn, SQL_INVENTORY_VALUE)[0]
+
+
+def period_start(report_type, today=None):
+    """First day covered by a ``reports`` period; ``None`` for all time."""
+    today = today or date.today()
+    if report_type == "daily":
+        return today
+    if report_type == "weekly":
+        return today - timedelta(days=7)
+    if report_type == "monthly":
+        return today.replace(day=1)
+    return None
+
+
+def period_totals(conn, start=None, end=None, store_id=None):
+    """Summed ``valuation_daily`` rows for ``start <= day <= end``."""
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("day >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("day <= %s")
+        params.append(end)
+    if store_id is not None:
+        conditions.append("store_id = %s")
+        params.append(store_id)
+    where = " AND ".join(conditions) or "1=1"
+    return db.query_one(conn, f"""
+        SELECT COALESCE(SUM(purchase_value), 0), COALESCE(SUM(sales_revenue), 0),
+               COALESCE(SUM(cogs), 0), COALESCE(SUM(writeoff_value), 0)
+        FROM valuation_daily
+        WHERE {where}
+    """, params, PeriodTotals)
@@ -0,0 +1,22 @@
+"""Production WSGI entry point.
+
+    python bootstrap.py
+    gunicorn wsgi:app        # settings in gunicorn.conf.py
+
+With ``preload_app`` the gunicorn master imports this module once and then
+forks the workers, so the app code, its libraries and the templates compiled
+below are shared copy-on-write instead of being loaded again by every worker.
+"""
+import gc
+
+from app import create_app
+
+app = create_app()
+
+# Compile every template up front so workers inherit the bytecode
+for name in app.jinja_env.list_templates(extensions=["html"]):
+    app.jinja_env.get_template(name)
+
+# Move everything loaded so far out of the collector's reach: a worker's
+# garbage collections would otherwise write to (and un-share) those pages
+gc.freeze()